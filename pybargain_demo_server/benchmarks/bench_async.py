@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+End to end benchmark of the asynchronous response path
+Proposals are posted to seller_demo.app (flask test client) while utxos are fetched from a slow stub backend.
+Compares the time spent in request threads in blocking and non blocking modes, 
+and measures the throughput of responses delivered to a local http sink.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_async [nb_negos] [latency_ms] [failure_rate]
+'''
+import sys
+import time
+import seller_demo
+from pybargain_protocol.bargaining_message import BargainingMessage
+from helpers.messages_helpers import CALLBACK_URI_HEADER
+from services.utxo_service import UtxoService, StubUtxoBackend
+from services.admission_service import AdmissionService
+from benchmarks.buyer import build_request_msg, build_proposal_msg
+from benchmarks.http_sink import HttpSink
+from benchmarks.loadgen import stub_seller_broadcaster
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NEGOS   = 200
+DEFAULT_LATENCY_MS = 50
+BUYER_OFFER        = 10000000
+
+
+def post(client, msg, headers = None):
+    headers = dict(headers or {})
+    headers['Content-Transfer-Encoding'] = 'binary'
+    return client.post('/bargain', data = msg.pbuff, headers = headers,
+                       content_type = 'application/bitcoin-%s' % msg.msg_type)
+
+
+def start_negos(client, nb_negos):
+    '''
+    Starts negotiations and returns the list of RequestACK messages sent by the seller
+    '''
+    acks = []
+    for i in range(nb_negos):
+        resp = post(client, build_request_msg(seller_demo.NETWORK))
+        acks.append(BargainingMessage.deserialize(resp.data))
+    return acks
+
+
+def bench(name, blocking, nb_negos, latency, sink):
+    seller_demo.utxo_service = UtxoService(StubUtxoBackend(latency = latency), blocking = blocking)
+    seller_demo.SUM_UNSPENT_FUNC = seller_demo.utxo_service
+    seller_demo.admission = AdmissionService()
+    stub_seller_broadcaster(seller_demo)
+    client = seller_demo.app.test_client()
+    acks = start_negos(client, nb_negos)
+    proposals = [build_proposal_msg(ack, BUYER_OFFER) for ack in acks]
+    nb_received = len(sink.received)
+    start = time.time()
+    for p in proposals: post(client, p, {CALLBACK_URI_HEADER: sink.uri})
+    request_time = time.time() - start
+    if not blocking:
+        # Waits for the responses sent asynchronously
+        while (len(sink.received) - nb_received < nb_negos) and (time.time() - start < 60):
+            time.sleep(0.01)
+    total_time = time.time() - start
+    print '%-12s request threads busy %7.3fs  all responses after %7.3fs  async stats %s' % \
+          (name, request_time, total_time, seller_demo.async_service.get_stats())
+
+
+def main(nb_negos, latency, failure_rate):
+    sink = HttpSink(failure_rate = failure_rate)
+    sink.start()
+    # The local sink must be allowed explicitly (callbacks to local addresses are refused)
+    seller_demo.CALLBACK_ALLOWED_HOSTS.append('127.0.0.1')
+    try:
+        bench('blocking', True, nb_negos, latency, sink)
+        bench('non blocking', False, nb_negos, latency, sink)
+    finally:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    nb_negos     = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    latency      = (int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LATENCY_MS) / 1000.0
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    main(nb_negos, latency, failure_rate)
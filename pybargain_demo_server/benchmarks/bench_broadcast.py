@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''
+Benchmark of the broadcast of transactions of completed negotiations
+Concurrent request threads complete negotiations (a part of them are retransmissions of the same COMPLETION).
+Compares broadcasting in the request thread with the background pipeline (BroadcastService) for several batch sizes.
+Reports the cost paid by request threads, the latency from completion to broadcast and the broadcast throughput.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_broadcast [nb_txs] [batch_latency_ms] [nb_threads]
+'''
+import os
+import sys
+import time
+import threading
+from pybargain_protocol.constants import TESTNET
+from services.broadcast_service import BroadcastService, StubBroadcaster
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_TXS     = 2000
+DEFAULT_LATENCY_MS = 20
+DEFAULT_NB_THREADS = 16
+# Ratio of completions retransmitted by buyers
+DUPLICATE_RATIO    = 0.2
+BATCH_SIZES        = [10, 50, 200]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else 0
+
+
+def build_txs(nb_txs):
+    txs = ['01000000' + os.urandom(100).encode('hex') for i in range(nb_txs)]
+    return txs + txs[:int(nb_txs * DUPLICATE_RATIO)]
+
+
+def run_threads(txs, nb_threads, complete):
+    '''
+    Completes negotiations with concurrent threads
+    Returns a tuple (dictionary of times of completion indexed by transaction, list of costs paid by threads)
+    '''
+    completed, costs = dict(), []
+    def worker(idx):
+        for tx in txs[idx::nb_threads]:
+            start = time.time()
+            complete(tx)
+            end = time.time()
+            completed.setdefault(tx, start)
+            costs.append(end - start)
+    threads = [threading.Thread(target = worker, args = (i,)) for i in range(nb_threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return (completed, costs)
+
+
+def report(label, start, completed, costs, broadcaster):
+    end = max(broadcaster.times.values())
+    latencies = [broadcaster.times[tx] - t for (tx, t) in completed.items()]
+    print '%-14s thread cost p50 %8.3fms  p99 %8.3fms | completion to broadcast p50 %8.1fms  p99 %8.1fms | %7.1f txs/s  %5d batches' % \
+          (label, percentile(costs, 50) * 1000, percentile(costs, 99) * 1000,
+           percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+           len(broadcaster.times) / (end - start), broadcaster.nb_batches)
+
+
+def bench_inline(txs, latency, nb_threads):
+    broadcaster = StubBroadcaster(latency)
+    start = time.time()
+    completed, costs = run_threads(txs, nb_threads, lambda tx: broadcaster.broadcast([tx], TESTNET))
+    report('inline', start, completed, costs, broadcaster)
+
+
+def bench_pipeline(txs, latency, nb_threads, batch_size):
+    broadcaster = StubBroadcaster(latency)
+    service = BroadcastService(broadcaster, batch_size)
+    service.start()
+    start = time.time()
+    completed, costs = run_threads(txs, nb_threads, lambda tx: service.submit([tx], TESTNET))
+    service.stop()
+    stats = service.get_stats()
+    report('batch %d' % batch_size, start, completed, costs, broadcaster)
+    assert stats['duplicates'] == len(txs) - len(broadcaster.times)
+
+
+if __name__ == '__main__':
+    nb_txs     = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_TXS
+    latency    = (int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LATENCY_MS) / 1000.0
+    nb_threads = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_NB_THREADS
+    txs = build_txs(nb_txs)
+    print '%d transactions (+%d retransmissions), %d threads, %.0fms per batch' % \
+          (nb_txs, len(txs) - nb_txs, nb_threads, latency * 1000)
+    bench_inline(txs, latency, nb_threads)
+    for batch_size in BATCH_SIZES: bench_pipeline(txs, latency, nb_threads, batch_size)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+Benchmark of the checks of received messages (format, signature, consistency)
+Measures the throughput of concurrent checks from 1 to N worker processes
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_checker [nb_msgs] [nb_threads]
+'''
+import sys
+import time
+import threading
+from multiprocessing import cpu_count
+from pybargain_protocol.constants import *
+from pybargain_protocol.negotiation import Negotiation
+from services.checker_service import CheckerService
+from benchmarks.buyer import build_request_msg
+
+
+'''
+CONSTANTS
+'''
+NETWORK            = TESTNET
+DEFAULT_NB_MSGS    = 400
+DEFAULT_NB_THREADS = 16
+
+
+def bench(nb_processes, msgs, nb_threads):
+    checker = CheckerService(NETWORK, nb_processes)
+    # Starts the pool before measuring
+    if nb_processes: checker._get_pool()
+    def run(part):
+        for (i, msg) in part:
+            checker.check_msg(Negotiation('nego%d' % i, ROLE_SELLER, NETWORK), msg, msg.pbuff)
+    items = list(enumerate(msgs))
+    threads = [threading.Thread(target = run, args = (items[t::nb_threads],)) for t in range(nb_threads)]
+    start = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.time() - start
+    checker.close()
+    print 'processes %3d  %8.1f msgs/s' % (nb_processes, len(msgs) / elapsed)
+
+
+def main(nb_msgs, nb_threads):
+    msgs = [build_request_msg(NETWORK) for i in range(nb_msgs)]
+    bench(0, msgs, nb_threads)
+    nb = 1
+    while nb <= cpu_count():
+        bench(nb, msgs, nb_threads)
+        nb *= 2
+
+
+if __name__ == '__main__':
+    nb_msgs    = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_MSGS
+    nb_threads = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_THREADS
+    main(nb_msgs, nb_threads)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+Stress test of the concurrent processing of messages by seller_demo.app (flask test client)
+Fires duplicated and interleaved proposals from many threads, then checks the integrity of chains:
+    - no message is stored twice
+    - buyer and seller messages alternate
+    - each buyer message gets exactly one seller reply (sent again byte for byte to duplicates)
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_concurrency [nb_negos] [nb_duplicates] [nb_rounds]
+'''
+import sys
+import time
+import threading
+import seller_demo
+from pybargain_protocol.constants import *
+from pybargain_protocol.bargaining_message import BargainingMessage
+from services.utxo_service import UtxoService, StubUtxoBackend
+from services.admission_service import AdmissionService
+from benchmarks.buyer import build_proposal_msg
+from benchmarks.bench_async import post, start_negos
+from benchmarks.loadgen import stub_seller_broadcaster
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NEGOS      = 50
+DEFAULT_NB_DUPLICATES = 4
+DEFAULT_NB_ROUNDS     = 5
+BUYER_OFFER           = 10000000
+BUYER_MSG_TYPES       = [TYPE_BARGAIN_REQUEST, TYPE_BARGAIN_PROPOSAL]
+
+
+def send_round(last_msgs, nb_duplicates):
+    '''
+    Sends a proposal for every negotiation. Each proposal is sent nb_duplicates times by concurrent threads.
+    Returns the list of replies (protobuff messages) of the seller by negotiation
+    '''
+    proposals = [build_proposal_msg(m, BUYER_OFFER) for m in last_msgs]
+    replies = [[] for p in proposals]
+    def run(t):
+        client = seller_demo.app.test_client()
+        # Threads send the proposals in different orders (interleaving)
+        order = range(len(proposals))
+        order = order[t % len(order):] + order[:t % len(order)]
+        for i in order:
+            resp = post(client, proposals[i])
+            if resp.data: replies[i].append(resp.data)
+    threads = [threading.Thread(target = run, args = (t,)) for t in range(nb_duplicates)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return replies
+
+
+def check_chain(nego):
+    '''
+    Returns a list of errors detected in the chain of a negotiation
+    '''
+    errors = []
+    pbuffs = set()
+    for idx in range(nego.length()):
+        msg = nego.get_msg_at_idx(idx)
+        if msg.pbuff in pbuffs: errors.append('duplicated message at index %d' % idx)
+        pbuffs.add(msg.pbuff)
+        if (msg.msg_type in BUYER_MSG_TYPES) != (idx % 2 == 0):
+            errors.append('unexpected %s at index %d' % (msg.msg_type, idx))
+    return errors
+
+
+def main(nb_negos, nb_duplicates, nb_rounds):
+    seller_demo.utxo_service = UtxoService(StubUtxoBackend())
+    seller_demo.SUM_UNSPENT_FUNC = seller_demo.utxo_service
+    seller_demo.admission = AdmissionService()
+    stub_seller_broadcaster(seller_demo)
+    client = seller_demo.app.test_client()
+    last_msgs = start_negos(client, nb_negos)
+    nids = [seller_demo.get_seller_data(m).get(seller_demo.SDATA_NEGO_ID) for m in last_msgs]
+    nb_errors = 0
+    start = time.time()
+    for r in range(nb_rounds):
+        replies = send_round(last_msgs, nb_duplicates)
+        for (i, rep) in enumerate(replies):
+            if len(set(rep)) != 1:
+                nb_errors += 1
+                print 'nego %s round %d : %d distinct replies' % (nids[i], r, len(set(rep)))
+        last_msgs = [BargainingMessage.deserialize(rep[0]) if rep else m for (rep, m) in zip(replies, last_msgs)]
+    elapsed = time.time() - start
+    for nid in nids:
+        for e in check_chain(seller_demo.nego_db_service.get_nego_by_id(nid)):
+            nb_errors += 1
+            print 'nego %s : %s' % (nid, e)
+    nb_msgs = nb_negos * nb_duplicates * nb_rounds
+    print '%d messages in %.2fs (%.0f msgs/s), %d errors' % (nb_msgs, elapsed, nb_msgs / elapsed, nb_errors)
+    print 'response cache %s' % seller_demo.response_cache.get_stats()
+    return nb_errors
+
+
+if __name__ == '__main__':
+    nb_negos      = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    nb_duplicates = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_DUPLICATES
+    nb_rounds     = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_NB_ROUNDS
+    sys.exit(1 if main(nb_negos, nb_duplicates, nb_rounds) else 0)
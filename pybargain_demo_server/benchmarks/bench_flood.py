@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+Flood benchmark of admission control
+A flooding client posts BargainingRequests as fast as possible while legitimate buyers
+(one address each, one negotiation every THINK_TIME seconds) run full negotiations.
+The same scenario is run without and with admission control. Measures:
+    - negotiations completed by legitimate buyers and their latencies
+    - requests of the flooder admitted and shed, cost of a shed request
+    - live negotiations stored at the end of the run
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_flood [duration_s] [nb_flooders] [nb_buyers]
+'''
+import sys
+import time
+import threading
+import seller_demo
+from pybargain_protocol.constants import *
+from services.nego_db_service import MemoryNegoDbService
+from services.response_cache_service import ResponseCacheService
+from services.admission_service import AdmissionService
+from benchmarks.buyer import build_request_msg
+from benchmarks.loadgen import TestClientTransport, LoadStats, run_buyer, stub_seller_utxos, stub_seller_broadcaster
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_DURATION    = 10
+DEFAULT_NB_FLOODERS = 4
+DEFAULT_NB_BUYERS   = 8
+# Delay (in seconds) between two negotiations of a legitimate buyer
+THINK_TIME          = 0.5
+NB_ROUNDS           = 1
+# Number of distinct requests prebuilt for the flooder (signing is not measured)
+NB_FLOOD_MSGS       = 2000
+FLOODER_ADDR        = '10.0.0.1'
+# Limits used when admission control is enabled
+ADMISSION_LIMITS    = {'rate': 100, 'burst': 200, 'client_rate': 5, 'client_burst': 10, 'max_in_flight': 64}
+
+
+def run(admission, duration, nb_flooders, nb_buyers, flood_msgs):
+    '''
+    Runs the scenario with a given admission control
+    Returns a dictionary of results
+    '''
+    # Fresh state (db and responses of previous runs)
+    seller_demo.nego_db_service = MemoryNegoDbService()
+    seller_demo.response_cache = ResponseCacheService()
+    seller_demo.admission = admission
+
+    stats = LoadStats()
+    outcomes = {'completed': 0, 'other': 0}
+    flood = {'admitted': 0, 'shed': 0, 'shed_time': 0.0}
+    lock = threading.Lock()
+    stop = time.time() + duration
+
+    def flooder(idx):
+        transport = TestClientTransport(seller_demo.app, FLOODER_ADDR)
+        i = idx
+        while time.time() < stop:
+            start = time.time()
+            status, body = transport.post(flood_msgs[i % len(flood_msgs)])
+            elapsed = time.time() - start
+            with lock:
+                if status in [429, 503]:
+                    flood['shed'] += 1
+                    flood['shed_time'] += elapsed
+                else:
+                    flood['admitted'] += 1
+            i += nb_flooders
+
+    def buyer(idx):
+        transport = TestClientTransport(seller_demo.app, '10.1.%d.%d' % (idx / 256, idx % 256))
+        while time.time() < stop:
+            try:
+                outcome = run_buyer(transport, stats, NB_ROUNDS, False)
+            except Exception, e:
+                outcome = 'error:%s' % e
+            with lock:
+                outcomes['completed' if outcome == 'completed' else 'other'] += 1
+            time.sleep(THINK_TIME)
+
+    threads = [threading.Thread(target = flooder, args = (i,)) for i in range(nb_flooders)]
+    threads += [threading.Thread(target = buyer, args = (i,)) for i in range(nb_buyers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    latencies = stats.get_latencies().get(TYPE_BARGAIN_REQUEST, {})
+    return {'completed'  : outcomes['completed'],
+            'failed'     : outcomes['other'],
+            'request_p50': latencies.get('p50', 0),
+            'request_p99': latencies.get('p99', 0),
+            'admitted'   : flood['admitted'],
+            'shed'       : flood['shed'],
+            'shed_cost'  : flood['shed_time'] / flood['shed'] * 1e6 if flood['shed'] else 0,
+            'live'       : seller_demo.nego_db_service.count_negos()}
+
+
+def main(duration, nb_flooders, nb_buyers):
+    stub_seller_utxos(seller_demo)
+    stub_seller_broadcaster(seller_demo)
+    flood_msgs = [build_request_msg(seller_demo.NETWORK, 'Flood') for i in range(NB_FLOOD_MSGS)]
+    results = []
+    for (name, admission) in [('no admission', AdmissionService()),
+                              ('admission', AdmissionService(**ADMISSION_LIMITS))]:
+        results.append((name, run(admission, duration, nb_flooders, nb_buyers, flood_msgs)))
+    print 'Duration %ds, %d flooding threads, %d buyers' % (duration, nb_flooders, nb_buyers)
+    print '%-14s %10s %8s %12s %12s %10s %10s %12s %8s' % ('', 'completed', 'failed', 'req p50 ms', 'req p99 ms',
+                                                          'flood ok', 'flood shed', 'shed us/req', 'live')
+    for (name, r) in results:
+        print '%-14s %10d %8d %12.1f %12.1f %10d %10d %12.1f %8d' % (name, r['completed'], r['failed'],
+                                                                     r['request_p50'], r['request_p99'], r['admitted'],
+                                                                     r['shed'], r['shed_cost'], r['live'])
+
+
+if __name__ == '__main__':
+    duration = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DURATION
+    nb_flooders = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_FLOODERS
+    nb_buyers = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_NB_BUYERS
+    main(duration, nb_flooders, nb_buyers)
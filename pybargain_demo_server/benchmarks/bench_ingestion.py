@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+Benchmark of the ingestion of requests
+Measures the cost of rejected requests (oversized, junk, wrong type) and of valid requests
+with the previous ingestion (body fully read, then parsed) and with read_msg (size and type checked before parsing)
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_ingestion [nb_requests]
+'''
+import os
+import sys
+import time
+from cStringIO import StringIO
+from pybargain_protocol.constants import *
+from pybargain_protocol.bargaining_message import BargainingMessage
+from helpers.ingestion_helpers import read_msg
+from benchmarks.buyer import build_request_msg
+
+
+'''
+CONSTANTS
+'''
+NETWORK             = TESTNET
+DEFAULT_NB_REQUESTS = 2000
+OVERSIZED_LENGTH    = 4 * 1024 * 1024
+JUNK_LENGTH         = 4 * 1024
+
+
+class FakeRequest(object):
+    '''
+    Minimal http request (content length and input stream)
+    '''
+
+    def __init__(self, body):
+        self.content_length = len(body)
+        self.stream = StringIO(body)
+
+
+def legacy_ingestion(req, msg_type):
+    '''
+    Previous ingestion: the body is fully read, then parsed
+    '''
+    pbuff = req.stream.read()
+    try:
+        return BargainingMessage.deserialize(pbuff)
+    except Exception:
+        return None
+
+
+def new_ingestion(req, msg_type):
+    pbuff, reason = read_msg(req, msg_type)
+    if reason: return None
+    try:
+        return BargainingMessage.deserialize(pbuff)
+    except Exception:
+        return None
+
+
+def bench(func, body, msg_type, nb_requests):
+    reqs = [FakeRequest(body) for i in xrange(nb_requests)]
+    start = time.time()
+    for req in reqs: func(req, msg_type)
+    return (time.time() - start) / nb_requests
+
+
+def main(nb_requests):
+    valid = build_request_msg(NETWORK).pbuff
+    cases = [('valid request', valid, TYPE_BARGAIN_REQUEST),
+             ('oversized (%d MB)' % (OVERSIZED_LENGTH / 1024 / 1024), '\x00' * OVERSIZED_LENGTH, TYPE_BARGAIN_REQUEST),
+             ('junk (%d KB)' % (JUNK_LENGTH / 1024), os.urandom(JUNK_LENGTH), TYPE_BARGAIN_REQUEST),
+             ('wrong type', valid, TYPE_BARGAIN_PROPOSAL)]
+    print '%-20s %14s %14s' % ('', 'legacy us/req', 'new us/req')
+    for (name, body, msg_type) in cases:
+        # Oversized bodies are expensive to build. Fewer requests are used.
+        n = max(1, nb_requests / 100) if len(body) > JUNK_LENGTH * 16 else nb_requests
+        legacy = bench(legacy_ingestion, body, msg_type, n)
+        new = bench(new_ingestion, body, msg_type, n)
+        print '%-20s %14.1f %14.1f' % (name, legacy * 1e6, new * 1e6)
+
+
+if __name__ == '__main__':
+    nb_requests = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_REQUESTS
+    main(nb_requests)
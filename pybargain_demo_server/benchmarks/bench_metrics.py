@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Benchmark of the overhead of metrics
+Runs the load generator (in process) alternately with metrics enabled and disabled
+and compares the throughputs. Also measures the cost of a single stage timer.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_metrics [nb_negos] [nb_runs] [concurrency]
+'''
+import sys
+import time
+import seller_demo
+from helpers.metrics_helpers import Metrics
+from benchmarks.loadgen import TestClientTransport, run_load, stub_seller_utxos, stub_seller_broadcaster, disable_admission
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NEGOS    = 300
+DEFAULT_NB_RUNS     = 5
+DEFAULT_CONCURRENCY = 8
+NB_ROUNDS           = 3
+CANCEL_RATIO        = 0.2
+# Maximum tolerated overhead
+MAX_OVERHEAD        = 0.02
+
+
+def bench_timer(nb_iters = 200000):
+    '''
+    Returns the cost (in seconds) of a stage timer (enabled, disabled)
+    '''
+    res = []
+    for enabled in [True, False]:
+        metrics = Metrics(enabled)
+        start = time.time()
+        for i in xrange(nb_iters):
+            with metrics.stage('sign', 'proposal'): pass
+        res.append((time.time() - start) / nb_iters)
+    return res
+
+
+def main(nb_negos, nb_runs, concurrency):
+    stub_seller_utxos(seller_demo)
+    stub_seller_broadcaster(seller_demo)
+    disable_admission(seller_demo)
+    transport = TestClientTransport(seller_demo.app)
+    # Warm up
+    run_load(transport, nb_negos / 10 + 1, concurrency, NB_ROUNDS, CANCEL_RATIO)
+    # Runs are interleaved so that both modes see the same conditions (ie: size of the db)
+    throughputs = {True: [], False: []}
+    for i in range(nb_runs):
+        for enabled in [False, True]:
+            seller_demo.metrics.enabled = enabled
+            report = run_load(transport, nb_negos, concurrency, NB_ROUNDS, CANCEL_RATIO)
+            throughputs[enabled].append(report['negos_per_s'])
+    seller_demo.metrics.enabled = True
+
+    on, off = max(throughputs[True]), max(throughputs[False])
+    overhead = (off - on) / off
+    timer_on, timer_off = bench_timer()
+    print 'Metrics disabled %8.1f negos/s (best of %d runs)' % (off, nb_runs)
+    print 'Metrics enabled  %8.1f negos/s (best of %d runs)' % (on, nb_runs)
+    print 'Overhead         %8.2f%% (max %.0f%%) %s' % (overhead * 100, MAX_OVERHEAD * 100, 'OK' if overhead < MAX_OVERHEAD else 'KO')
+    print 'Stage timer      %8.2f us enabled, %.2f us disabled' % (timer_on * 1e6, timer_off * 1e6)
+
+
+if __name__ == '__main__':
+    nb_negos    = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    nb_runs     = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_RUNS
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CONCURRENCY
+    main(nb_negos, nb_runs, concurrency)
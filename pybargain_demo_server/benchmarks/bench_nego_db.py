@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''
+Benchmark of the backends storing negotiations
+Measures create / get / update throughput for 10k to 1M negotiations
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_nego_db [nb_negos ...]
+'''
+import os
+import sys
+import time
+import uuid
+import shutil
+import tempfile
+from pybargain_protocol.constants import *
+from pybargain_protocol.negotiation import Negotiation
+from services.nego_db_service import MemoryNegoDbService
+from services.sqlite_nego_db_service import SqliteNegoDbService
+from services.sharded_nego_db_service import ShardedNegoDbService
+from services.negotiator_service import NegotiatorService
+from benchmarks.buyer import build_request_msg, receive_msg
+
+
+'''
+CONSTANTS
+'''
+NETWORK       = TESTNET
+DEFAULT_SIZES = [10000, 100000, 1000000]
+NB_SHARDS     = 4
+
+
+def build_template_nego():
+    '''
+    Builds a negotiation containing a REQUEST and a REQUEST_ACK
+    Returns a tuple (negotiation, negotiator)
+    '''
+    negotiator = NegotiatorService(NETWORK, 'http://localhost:8082/bargain')
+    nego = Negotiation(str(uuid.uuid4()), ROLE_SELLER, NETWORK)
+    receive_msg(nego, build_request_msg(NETWORK), NETWORK)
+    nego.append(negotiator.process(nego))
+    return (nego, negotiator)
+
+
+def timeit(func, nids):
+    start = time.time()
+    for nid in nids: func(nid)
+    elapsed = time.time() - start
+    return len(nids) / elapsed if elapsed else float('inf')
+
+
+def bench(name, store, nego, size):
+    nids = ['%032x' % i for i in range(size)]
+    res = [timeit(lambda nid: store.create_nego(nid, nego), nids),
+           timeit(store.get_nego_by_id, nids),
+           timeit(lambda nid: store.update_nego(nid, nego), nids)]
+    print '%-10s %9d  create %10.0f/s  get %10.0f/s  update %10.0f/s' % tuple([name, size] + res)
+
+
+def main(sizes):
+    nego, _ = build_template_nego()
+    for size in sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            bench('memory', MemoryNegoDbService(), nego, size)
+            bench('sqlite', SqliteNegoDbService(os.path.join(tmp_dir, 'negos.db')), nego, size)
+            shards = [SqliteNegoDbService(os.path.join(tmp_dir, 'negos.db.%d' % i)) for i in range(NB_SHARDS)]
+            bench('sharded', ShardedNegoDbService(shards), nego, size)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or DEFAULT_SIZES)
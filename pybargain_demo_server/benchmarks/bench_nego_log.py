@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+Benchmark of the append only mode of the sqlite backend
+Measures the number of bytes written per round while negotiations get longer
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_nego_log [nb_rounds]
+'''
+import os
+import sys
+import shutil
+import tempfile
+from pybargain_protocol.constants import *
+from services.sqlite_nego_db_service import SqliteNegoDbService
+from benchmarks.buyer import build_proposal_msg, receive_msg
+from benchmarks.bench_nego_db import build_template_nego, NETWORK
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_ROUNDS = 60
+# Amount offered by the buyer (low enough to keep the seller bargaining)
+BUYER_OFFER = 10000000
+
+
+def bench(name, store, nb_rounds):
+    nego, negotiator = build_template_nego()
+    store.create_nego(nego.nid, nego)
+    written = []
+    for r in range(nb_rounds):
+        start = store.bytes_written
+        receive_msg(nego, build_proposal_msg(nego.get_last_msg(), BUYER_OFFER), NETWORK)
+        store.update_nego(nego.nid, nego)
+        if nego.status in [NEGO_STATUS_COMPLETED, NEGO_STATUS_CANCELLED]: break
+        nego.append(negotiator.process(nego))
+        store.update_nego(nego.nid, nego)
+        written.append(store.bytes_written - start)
+    # Checks that the negotiation is correctly rebuilt from the db
+    assert store.get_nego_by_id(nego.nid).length() == nego.length()
+    for r in range(0, len(written), 10):
+        print '%-12s round %3d  bytes written %8d' % (name, r + 1, written[r])
+    print '%-12s total bytes written %d for %d rounds' % (name, store.bytes_written, len(written))
+
+
+def main(nb_rounds):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        bench('full', SqliteNegoDbService(os.path.join(tmp_dir, 'full.db'), False), nb_rounds)
+        bench('append_only', SqliteNegoDbService(os.path.join(tmp_dir, 'log.db'), True), nb_rounds)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_ROUNDS)
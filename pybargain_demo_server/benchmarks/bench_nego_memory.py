@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+Benchmark of the memory used by live negotiations
+Stores negotiations (REQUEST, REQUEST_ACK, PROPOSAL, PROPOSAL_ACK) in the memory and compact backends
+and measures the growth of the resident memory per negotiation.
+Each backend is measured in a separate process.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_nego_memory [nb_negos]
+'''
+import gc
+import sys
+from multiprocessing import Process, Queue
+from pybargain_protocol.constants import *
+from helpers.nego_helpers import serialize_nego, deserialize_nego
+from services.nego_db_service import MemoryNegoDbService
+from services.compact_nego_db_service import CompactNegoDbService
+from benchmarks.bench_nego_db import build_template_nego
+from benchmarks.buyer import build_proposal_msg, receive_msg, get_offer
+from benchmarks.loadgen import get_rss
+
+
+'''
+CONSTANTS
+'''
+NETWORK          = TESTNET
+DEFAULT_NB_NEGOS = 20000
+BACKENDS         = [('memory', MemoryNegoDbService), ('compact', CompactNegoDbService)]
+
+
+def build_template_chain():
+    '''
+    Returns the serialized chain of a negotiation after one round of proposals
+    '''
+    nego, negotiator = build_template_nego()
+    last_msg = nego.get_last_msg()
+    receive_msg(nego, build_proposal_msg(last_msg, get_offer(last_msg) / 2), NETWORK)
+    nego.append(negotiator.process(nego))
+    return serialize_nego(nego)
+
+
+def measure(store_class, chain, nb_negos, queue):
+    '''
+    Stores negotiations and puts the growth of resident memory (in bytes) in the queue
+    Every negotiation is a distinct object graph, as for negotiations built from received messages
+    '''
+    store = store_class()
+    gc.collect()
+    rss_start = get_rss()
+    for i in xrange(nb_negos):
+        nid = '%032x' % i
+        store.create_nego(nid, deserialize_nego(nid, NETWORK, chain))
+    gc.collect()
+    queue.put(get_rss() - rss_start)
+
+
+def main(nb_negos):
+    chain = build_template_chain()
+    print 'Serialized chain: %d bytes' % len(chain)
+    for (name, store_class) in BACKENDS:
+        queue = Queue()
+        proc = Process(target = measure, args = (store_class, chain, nb_negos, queue))
+        proc.start()
+        growth = queue.get()
+        proc.join()
+        print '%-8s %9d negos  %10.0f bytes/nego' % (name, nb_negos, growth / float(nb_negos))
+
+
+if __name__ == '__main__':
+    nb_negos = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    main(nb_negos)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''
+Benchmark of the negotiator registry
+Measures, for a catalog of synthetic products sharing the keys of the seller:
+    - loading time of the catalog
+    - cost of the first lookup of a product (negotiator built)
+    - cost of next lookups (cached negotiator)
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_registry [nb_products] [nb_lookups]
+'''
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from pybargain_protocol.constants import *
+from services.negotiator_registry_service import NegotiatorRegistryService
+
+
+'''
+CONSTANTS
+'''
+NETWORK             = TESTNET
+DEFAULT_NB_PRODUCTS = 5000
+DEFAULT_NB_LOOKUPS  = 1000000
+
+
+def write_catalog(path, nb_products):
+    products = [{'pid': 'sku-%06d' % i,
+                 'welcome': 'Best offer for product %d' % i,
+                 'amounts': [(i % 100 + 1) * 1000000, (i % 50 + 1) * 1000000],
+                 'floor': (i % 100 + 1) * 500000}
+                for i in range(nb_products)]
+    with open(path, 'w') as f:
+        json.dump({'default': products[0]['pid'], 'products': products}, f)
+    return [p['pid'] for p in products]
+
+
+def main(nb_products, nb_lookups):
+    fd, path = tempfile.mkstemp(suffix = '.json')
+    os.close(fd)
+    try:
+        pids = write_catalog(path, nb_products)
+        start = time.time()
+        registry = NegotiatorRegistryService(NETWORK, path)
+        print 'Catalog of %d products loaded in %.1f ms' % (nb_products, (time.time() - start) * 1000)
+
+        # First lookups (negotiators are built, keys are derived once)
+        start = time.time()
+        for pid in pids: registry.get_negotiator(pid)
+        duration = time.time() - start
+        print 'First lookups   %10.1f us/lookup (%d negotiators)' % (duration * 1e6 / nb_products, registry.count_negotiators())
+
+        # Next lookups (cached negotiators)
+        lookups = [random.choice(pids) for i in xrange(nb_lookups)]
+        start = time.time()
+        for pid in lookups: registry.get_negotiator(pid)
+        duration = time.time() - start
+        print 'Cached lookups  %10.3f us/lookup' % (duration * 1e6 / nb_lookups)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    nb_products = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_PRODUCTS
+    nb_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_LOOKUPS
+    main(nb_products, nb_lookups)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+Benchmark of the routing front (see seller_router.py) with several local seller nodes
+The load generator runs full negotiations over http:
+    - directly against a single node (baseline)
+    - through the front with a single node (cost of the extra hop)
+    - through the front with N nodes
+    - through the front with N nodes, one of them being drained in the middle of the load
+      (its live negotiations are handed off to the other nodes, buyers retry messages rejected with a 503)
+Reports negotiations/s, latencies of proposals, errors and the numbers of negotiations handed off.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_scaleout [nb_nodes] [nb_negos] [concurrency]
+'''
+import sys
+import time
+import json
+import urllib2
+import threading
+import subprocess
+from pybargain_protocol.constants import TESTNET, TYPE_BARGAIN_PROPOSAL
+from benchmarks.buyer import build_request_msg, post_msg
+from helpers.messages_helpers import ADMIN_TOKEN_HEADER
+from benchmarks.loadgen import HttpTransport, run_load
+from seller_router import ADMIN_TOKEN_PATH
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NODES    = 3
+DEFAULT_NB_NEGOS    = 600
+DEFAULT_CONCURRENCY = 16
+NB_ROUNDS           = 3
+CANCEL_RATIO        = 0.2
+FRONT_PORT          = 18090
+FIRST_NODE_PORT     = 18091
+# Ratio of the load sent before a node is drained
+DRAIN_AFTER         = 0.3
+
+
+def wait_server(uri, timeout = 30):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            if post_msg(uri, build_request_msg(TESTNET), timeout = 5)[0] == 200: return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('Server %s is not responding' % uri)
+
+
+def start_nodes(nb_nodes):
+    '''
+    Starts local seller nodes and returns a tuple (list of processes, dictionary of uris indexed by node id)
+    '''
+    procs, nodes = [], dict()
+    for i in range(nb_nodes):
+        node_id, port = 'n%d' % i, FIRST_NODE_PORT + i
+        procs.append(subprocess.Popen([sys.executable, '-m', 'benchmarks.run_server', 'flask', str(port), '0', node_id]))
+        nodes[node_id] = 'http://127.0.0.1:%d' % port
+    for uri in nodes.values(): wait_server(uri + '/bargain')
+    return (procs, nodes)
+
+
+def start_front(nodes):
+    args = ['%s=%s' % (node_id, uri) for (node_id, uri) in sorted(nodes.items())]
+    proc = subprocess.Popen([sys.executable, 'seller_router.py', str(FRONT_PORT)] + args)
+    wait_server('http://127.0.0.1:%d/bargain' % FRONT_PORT)
+    return proc
+
+
+def drain_node(node_id, delay, result):
+    time.sleep(delay)
+    # Nodes and front share the admin token file of the current directory
+    with open(ADMIN_TOKEN_PATH) as f:
+        headers = {ADMIN_TOKEN_HEADER: f.read().strip()}
+    req = urllib2.Request('http://127.0.0.1:%d/drain?node=%s' % (FRONT_PORT, node_id), '', headers)
+    start = time.time()
+    try:
+        result.update(json.loads(urllib2.urlopen(req).read()))
+    except Exception, e:
+        result['error'] = str(e)
+    result['duration'] = time.time() - start
+
+
+def bench(label, nb_nodes, nb_negos, concurrency, use_front = True, drain = False):
+    procs, nodes = start_nodes(nb_nodes)
+    try:
+        if use_front: procs.append(start_front(nodes))
+        uri = 'http://127.0.0.1:%d/bargain' % (FRONT_PORT if use_front else FIRST_NODE_PORT)
+        drained, drainer = dict(), None
+        if drain:
+            # Estimates the duration of the load with a short warm up run
+            estimate = run_load(HttpTransport(uri), concurrency * 2, concurrency, NB_ROUNDS, CANCEL_RATIO)
+            delay = nb_negos / estimate['negos_per_s'] * DRAIN_AFTER
+            drainer = threading.Thread(target = drain_node, args = ('n0', delay, drained))
+            drainer.start()
+        report = run_load(HttpTransport(uri), nb_negos, concurrency, NB_ROUNDS, CANCEL_RATIO)
+        if not (drainer is None): drainer.join()
+        errors = sum([n for (o, n) in report['outcomes'].items() if o.startswith('error')])
+        proposals = report['latencies'].get(TYPE_BARGAIN_PROPOSAL, {})
+        print '%-22s %8.1f negos/s  proposal p50 %7.1fms  p99 %7.1fms  errors %d' % \
+              (label, report['negos_per_s'], proposals.get('p50', 0), proposals.get('p99', 0), errors)
+        if drain:
+            print '%-22s handed off %s (kept %d) in %.2fs %s' % ('', drained.get('transferred', {}), len(drained.get('kept', [])),
+                                                                 drained.get('duration', 0), drained.get('error', ''))
+    finally:
+        for p in procs: p.terminate()
+        for p in procs: p.wait()
+
+
+if __name__ == '__main__':
+    nb_nodes    = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NODES
+    nb_negos    = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_NEGOS
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CONCURRENCY
+    bench('direct (1 node)', 1, nb_negos, concurrency, use_front = False)
+    bench('front (1 node)', 1, nb_negos, concurrency)
+    bench('front (%d nodes)' % nb_nodes, nb_nodes, nb_negos, concurrency)
+    if nb_nodes > 1: bench('front (%d nodes, drain)' % nb_nodes, nb_nodes, nb_negos, concurrency, drain = True)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+'''
+Microbenchmark of the per request overhead of seller_data
+    - outbound: seller_data built for each message (json) vs encoded once per negotiation (SellerDataCodec)
+    - inbound: seller_data parsed for each message (json) vs memoized decoding
+    - inbound: cost of a forged negotiation id (rejected by the token before any store lookup)
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_seller_data [nb_negos] [nb_msgs_per_nego]
+'''
+import sys
+import json
+import time
+import uuid
+from helpers.messages_helpers import build_seller_data, SellerDataCodec, SDATA_NEGO_ID
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NEGOS = 10000
+DEFAULT_NB_MSGS  = 6
+PRODUCT_ID       = 'bd-48t'
+
+
+def bench(func, args):
+    start = time.time()
+    for a in args: func(a)
+    return (time.time() - start) / len(args)
+
+
+def main(nb_negos, nb_msgs):
+    codec = SellerDataCodec('bench secret')
+    nids = [str(uuid.uuid4()) for i in range(nb_negos)]
+    # Each negotiation sends and receives nb_msgs messages (interleaved negotiations)
+    msgs = nids * nb_msgs
+
+    legacy_out = bench(lambda nid: build_seller_data(nid, PRODUCT_ID), msgs)
+    codec_out = bench(lambda nid: codec.encode(nid, PRODUCT_ID), msgs)
+
+    legacy_blobs = [build_seller_data(nid, PRODUCT_ID) for nid in msgs]
+    codec_blobs = [codec.encode(nid, PRODUCT_ID) for nid in msgs]
+    legacy_in = bench(lambda sdata: json.loads(sdata).get(SDATA_NEGO_ID, ''), legacy_blobs)
+    codec_in = bench(lambda sdata: codec.decode(sdata).get(SDATA_NEGO_ID, ''), codec_blobs)
+
+    forged = [json.dumps({SDATA_NEGO_ID: str(uuid.uuid4()), 'tok': '0' * 32}) for i in range(nb_negos)]
+    forged_in = bench(codec.decode, forged)
+    assert not any([codec.decode(f) for f in forged])
+
+    print 'Negotiations %d, messages per negotiation %d' % (nb_negos, nb_msgs)
+    print '%-32s %10s %10s' % ('', 'json us', 'codec us')
+    print '%-32s %10.2f %10.2f' % ('build seller_data (outbound)', legacy_out * 1e6, codec_out * 1e6)
+    print '%-32s %10.2f %10.2f' % ('parse seller_data (inbound)', legacy_in * 1e6, codec_in * 1e6)
+    print '%-32s %10s %10.2f' % ('forged nid (rejected)', '-', forged_in * 1e6)
+    print 'Codec stats: %s' % codec.get_stats()
+
+
+if __name__ == '__main__':
+    nb_negos = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    nb_msgs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NB_MSGS
+    main(nb_negos, nb_msgs)
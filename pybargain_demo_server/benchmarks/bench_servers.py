@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''
+Benchmark comparing the flask server (one thread per request) and the gevent server (one greenlet per request)
+Thousands of simulated buyers (greenlets) start a negotiation and send a proposal over http.
+Reports requests/s and p50/p99 latencies per server.
+
+Requires gevent. Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_servers [nb_buyers] [concurrency] [utxo_latency_ms]
+'''
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import time
+import subprocess
+from gevent.pool import Pool
+from pybargain_protocol.bargaining_message import BargainingMessage
+from pybargain_protocol.constants import TESTNET
+from benchmarks.buyer import build_request_msg, build_proposal_msg, post_msg
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_BUYERS   = 2000
+DEFAULT_CONCURRENCY = 1000
+DEFAULT_LATENCY_MS  = 50
+BUYER_OFFER         = 10000000
+PORTS               = {'flask': 18082, 'gevent': 18083}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else 0
+
+
+def wait_server(uri, timeout = 30):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            post_msg(uri, build_request_msg(TESTNET), timeout = 5)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError('Server %s is not responding' % uri)
+
+
+def run_buyer(uri, latencies, errors):
+    try:
+        start = time.time()
+        status, body = post_msg(uri, build_request_msg(TESTNET))
+        latencies.append(time.time() - start)
+        if status != 200 or not body:
+            errors.append(status)
+            return
+        ack = BargainingMessage.deserialize(body)
+        start = time.time()
+        status, body = post_msg(uri, build_proposal_msg(ack, BUYER_OFFER))
+        latencies.append(time.time() - start)
+        if status != 200: errors.append(status)
+    except Exception, e:
+        errors.append(str(e))
+
+
+def bench(mode, nb_buyers, concurrency, latency_ms):
+    port = PORTS[mode]
+    uri = 'http://127.0.0.1:%d/bargain' % port
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.run_server', mode, str(port), str(latency_ms)])
+    try:
+        wait_server(uri)
+        latencies, errors = [], []
+        pool = Pool(concurrency)
+        start = time.time()
+        for i in range(nb_buyers): pool.spawn(run_buyer, uri, latencies, errors)
+        pool.join()
+        elapsed = time.time() - start
+        print '%-8s %8.1f req/s  p50 %7.1fms  p99 %7.1fms  errors %d' % \
+              (mode, len(latencies) / elapsed, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, len(errors))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(nb_buyers, concurrency, latency_ms):
+    for mode in ['flask', 'gevent']: bench(mode, nb_buyers, concurrency, latency_ms)
+
+
+if __name__ == '__main__':
+    nb_buyers   = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_BUYERS
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CONCURRENCY
+    latency_ms  = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_LATENCY_MS
+    main(nb_buyers, concurrency, latency_ms)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+Microbenchmark of the ECDSA backends used to sign messages
+Measures signatures/sec per backend and checks that all backends produce the same signatures
+Then measures messages signed/sec through BargainingMessage.sign() with each installed backend
+and checks that the installed backend is the one called by BargainingMessage.sign()
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_signer [nb_signatures]
+'''
+import sys
+import time
+import bitcoin.main as btc
+from pybargain_protocol.constants import SIGN_ECDSA_SHA256, TYPE_BARGAIN_CANCELLATION
+from pybargain_protocol.bargaining_message import BargainingMessage
+from pybargain_protocol.bargaining_cancellation import BargainingCancellationDetails
+from services.signer_service import build_backend, install_backend, BACKENDS
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_SIGNATURES = 200
+PRIVKEY = btc.sha256('This is a private key used to sign messages sent by the seller')
+
+
+def bench(name, sign_func, msghashes):
+    start = time.time()
+    sigs = [sign_func(h, PRIVKEY) for h in msghashes]
+    elapsed = time.time() - start
+    print '%-10s %8.0f signatures/s' % (name, len(msghashes) / elapsed)
+    return sigs
+
+
+def main(nb_signatures):
+    msghashes = [btc.bin_sha256('Message %d' % i) for i in range(nb_signatures)]
+    ref_sigs = bench('default', btc.ecdsa_raw_sign, msghashes)
+    for name in sorted(BACKENDS.keys()):
+        backend = build_backend(name)
+        if backend is None:
+            print '%-10s not available' % name
+            continue
+        sigs = bench(name, backend.ecdsa_raw_sign, msghashes)
+        if sigs != ref_sigs: print '%-10s produces different signatures !' % name
+    print 'Through BargainingMessage.sign()'
+    pubkey = btc.privtopub(PRIVKEY)
+    msgs = [BargainingMessage(TYPE_BARGAIN_CANCELLATION, BargainingCancellationDetails(0L, '', '', 'Message %d' % i))
+            for i in range(nb_signatures)]
+    for name in ['default'] + sorted(BACKENDS.keys()):
+        installed = install_backend(name)
+        if installed != name:
+            print '%-10s not installed (BargainingMessage.sign uses %s)' % (name, installed)
+            continue
+        # First signature (table of the python backend, check of the backend) isn't measured
+        msgs[0].sign(None, SIGN_ECDSA_SHA256, pubkey, PRIVKEY)
+        start = time.time()
+        for msg in msgs: msg.sign(None, SIGN_ECDSA_SHA256, pubkey, PRIVKEY)
+        print '%-10s %8.0f messages/s' % (name, len(msgs) / (time.time() - start))
+    install_backend('default')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_SIGNATURES)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+'''
+Cold start benchmark of the seller
+Each measure is run in a fresh python process:
+    - import time of seller_demo without and with a keystore
+    - profile of the slowest imports (cumulative time)
+    - latency of the first requests without and with warm up
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_startup [nb_runs]
+'''
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_RUNS = 5
+NB_SLOWEST      = 15
+SERVER_DIR      = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measures the import time of seller_demo
+IMPORT_SCRIPT = '''
+import time, json
+start = time.time()
+import seller_demo
+print json.dumps(time.time() - start)
+'''
+
+# Measures the cumulative import time of each module
+PROFILE_SCRIPT = '''
+import time, json, __builtin__
+timings = {}
+original_import = __builtin__.__import__
+def timed_import(name, *args, **kwargs):
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        timings[name] = timings.get(name, 0) + time.time() - start
+__builtin__.__import__ = timed_import
+import seller_demo
+__builtin__.__import__ = original_import
+print json.dumps(sorted(timings.items(), key = lambda t: -t[1])[:%d])
+''' % NB_SLOWEST
+
+# Measures the latency of the first requests
+FIRST_REQUESTS_SCRIPT = '''
+import time, json, sys
+import seller_demo
+from benchmarks.buyer import build_request_msg
+from benchmarks.loadgen import TestClientTransport, stub_seller_utxos
+stub_seller_utxos(seller_demo)
+warm_up = {}
+if sys.argv[1] == 'warm':
+    warm_up = seller_demo.warm_up()
+transport = TestClientTransport(seller_demo.app)
+msgs = [build_request_msg(seller_demo.NETWORK) for i in range(3)]
+latencies = []
+for msg in msgs:
+    start = time.time()
+    transport.post(msg)
+    latencies.append(time.time() - start)
+print json.dumps({'latencies': latencies, 'warm_up': warm_up})
+'''
+
+
+def run(script, cwd, *args):
+    '''
+    Runs a script in a fresh python process and returns its json output
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SERVER_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    out = subprocess.check_output([sys.executable, '-c', script] + list(args), cwd = cwd, env = env)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(nb_runs):
+    # Processes run in a temporary directory (keystore and db files)
+    tmp_dir = tempfile.mkdtemp()
+    keystore = os.path.join(tmp_dir, 'seller_keys.json')
+    try:
+        no_keystore, with_keystore = [], []
+        for i in range(nb_runs):
+            if os.path.exists(keystore): os.remove(keystore)
+            no_keystore.append(run(IMPORT_SCRIPT, tmp_dir))
+            with_keystore.append(run(IMPORT_SCRIPT, tmp_dir))
+        print 'Import of seller_demo (best of %d runs)' % nb_runs
+        print '    without keystore %8.1f ms' % (min(no_keystore) * 1000)
+        print '    with keystore    %8.1f ms' % (min(with_keystore) * 1000)
+
+        print 'Slowest imports (cumulative)'
+        for (name, duration) in run(PROFILE_SCRIPT, tmp_dir):
+            print '    %-40s %8.1f ms' % (name, duration * 1000)
+
+        for mode in ['cold', 'warm']:
+            res = run(FIRST_REQUESTS_SCRIPT, tmp_dir, mode)
+            print 'First requests (%s) %s ms' % (mode, ' / '.join(['%.1f' % (l * 1000) for l in res['latencies']]))
+            for (step, duration) in sorted(res['warm_up'].items()):
+                print '    warm up %-12s %8.1f ms' % (step, duration * 1000)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    nb_runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_RUNS
+    main(nb_runs)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Benchmark of pricing strategies
+Measures offers/sec of the default strategy evaluated per call and in batch (NumPy, if installed)
+over synthetic histories of live negotiations
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_strategy [nb_negos]
+'''
+import sys
+import time
+import random
+from services.strategy_service import OfferHistory, RandomDiscountStrategy, np
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_NEGOS = 100000
+
+
+def build_histories(nb_negos, seed = 0):
+    '''
+    Builds synthetic histories (3 rounds, buyer offers between 10% and 100% of the seller offer)
+    '''
+    rnd = random.Random(seed)
+    histories = []
+    for i in xrange(nb_negos):
+        seller = [250000000]
+        buyer, fees = [], []
+        for r in range(3):
+            buyer.append(int(seller[-1] * (0.1 + 0.9 * rnd.random())))
+            fees.append(10000)
+            seller.append(max(buyer[-1], seller[-1] - rnd.randint(0, 20) * 1000000))
+        histories.append(OfferHistory(seller, buyer, fees))
+    return histories
+
+
+def check_offers(histories, offers):
+    '''
+    Checks that offers are between the last offers of the buyer and of the seller
+    '''
+    bounds = [sorted([h.get_seller_last_offer(), h.get_buyer_last_offer()]) for h in histories]
+    return all([b[0] <= o <= b[1] for (b, o) in zip(bounds, offers)])
+
+
+def bench(name, func, nb_negos):
+    start = time.time()
+    res = func()
+    elapsed = time.time() - start
+    print '%-28s %12.0f offers/s' % (name, nb_negos / elapsed)
+    return res
+
+
+def main(nb_negos):
+    histories = build_histories(nb_negos)
+    strategy = RandomDiscountStrategy(seed = 0)
+    offers = bench('per call', lambda: [strategy.compute_offer(h) for h in histories], nb_negos)
+    print 'Offers consistent: %s' % check_offers(histories, offers)
+    if np is None:
+        print 'NumPy is not installed. Batch evaluation falls back to per call evaluation.'
+        return
+    offers = bench('batch (histories)', lambda: strategy.compute_offers(histories), nb_negos)
+    print 'Offers consistent: %s' % check_offers(histories, offers)
+    seller = np.array([h.get_seller_last_offer() for h in histories], dtype = np.int64)
+    buyer  = np.array([h.get_buyer_last_offer() for h in histories], dtype = np.int64)
+    bench('batch (arrays)', lambda: strategy.compute_offers_array(seller, buyer), nb_negos)
+
+
+if __name__ == '__main__':
+    nb_negos = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_NEGOS
+    main(nb_negos)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+Benchmark of the computation of the sum of unspent inputs
+Compares uncached lookups with cached / batched lookups over a stub backend with simulated latency
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.bench_utxo [nb_txs] [latency_ms]
+'''
+import sys
+import time
+from pybargain_protocol.constants import TESTNET
+from services.utxo_service import UtxoService, StubUtxoBackend
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_NB_TXS     = 1000
+DEFAULT_LATENCY_MS = 5
+NB_INPUTS          = 3
+# Proportion of transactions spending the same outpoints (ie: retransmitted proposals)
+NB_DISTINCT_TXS    = 100
+
+
+def build_tx(i):
+    ins = [{'outpoint': {'hash': '%064x' % (i * NB_INPUTS + j), 'index': 0}} for j in range(NB_INPUTS)]
+    return {'ins': ins, 'outs': []}
+
+
+def bench(name, service, backend, txs):
+    start = time.time()
+    for tx in txs: service(tx, TESTNET)
+    elapsed = time.time() - start
+    print '%-10s %8.0f txs/s  backend queries %6d' % (name, len(txs) / elapsed, backend.nb_queries)
+
+
+def bench_prefetch(backend, txs):
+    service = UtxoService(backend, blocking = False)
+    start = time.time()
+    for tx in txs: service.prefetch(tx, TESTNET)
+    while not all([service.is_ready(tx, TESTNET) for tx in txs]): time.sleep(0.001)
+    elapsed = time.time() - start
+    print '%-10s %8.0f txs/s  backend queries %6d' % ('prefetch', len(txs) / elapsed, backend.nb_queries)
+
+
+def main(nb_txs, latency):
+    txs = [build_tx(i % NB_DISTINCT_TXS) for i in range(nb_txs)]
+    backend = StubUtxoBackend(latency = latency)
+    bench('uncached', UtxoService(backend, cache_size = 0), backend, txs)
+    backend = StubUtxoBackend(latency = latency)
+    bench('cached', UtxoService(backend), backend, txs)
+    distinct_txs = [build_tx(i) for i in range(nb_txs)]
+    bench_prefetch(StubUtxoBackend(latency = latency), distinct_txs)
+
+
+if __name__ == '__main__':
+    nb_txs  = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NB_TXS
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LATENCY_MS) / 1000.0
+    main(nb_txs, latency)
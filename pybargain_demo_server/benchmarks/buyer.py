@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+'''
+Helpers building messages sent by a synthetic buyer
+Used by the benchmarks to feed the seller with valid signed messages
+'''
+import urllib2
+import calendar
+from datetime import datetime
+from bitcoin.main import sha256, privtopub, pubtoaddr
+from bitcoin.transaction import mktx, sign, address_to_script
+from pybargain_protocol.constants import *
+from pybargain_protocol.bargaining_message import BargainingMessage
+from pybargain_protocol.bargaining_request import BargainingRequestDetails
+from pybargain_protocol.bargaining_proposal import BargainingProposalDetails
+from pybargain_protocol.bargaining_cancellation import BargainingCancellationDetails
+from helpers.nego_helpers import check_received_msg
+
+
+'''
+CONSTANTS
+'''
+BUYER_PRIVKEY = sha256('This is a private key used to sign messages sent by the benchmark buyer')
+BUYER_PUBKEY  = privtopub(BUYER_PRIVKEY)
+BUYER_SCRIPT  = address_to_script(pubtoaddr(BUYER_PUBKEY, MAGIC_BYTES_TESTNET))
+
+# Fake outpoint spent by the buyer (benchmarks must stub SUM_UNSPENT_FUNC)
+FAKE_OUTPOINT = '%064x:0' % 1
+FAKE_BALANCE  = 100000000000
+
+# Maximum number of redirects followed when a message is posted (see seller_router.py)
+MAX_REDIRECTS = 3
+
+
+def stub_sum_unspent(*args, **kwargs):
+    '''
+    Local stub of the function computing the sum of unspent inputs
+    Every input is considered as unspent and funded
+    '''
+    return FAKE_BALANCE
+
+
+'''
+MESSAGES
+'''
+def now():
+    return long(calendar.timegm(datetime.now().timetuple()))
+
+
+def build_request_msg(network, memo = 'Benchmark buyer'):
+    '''
+    Builds a signed BargainingRequest message
+
+    Parameters:
+        network = network used for the negotiation
+        memo    = memo sent to the seller
+    '''
+    dtls = BargainingRequestDetails(now(), 'bench', '', network, memo)
+    return _sign_msg(BargainingMessage(TYPE_BARGAIN_REQUEST, dtls), None)
+
+
+def build_proposal_msg(last_msg, amount, fees = 10000, memo = 'Benchmark offer'):
+    '''
+    Builds a signed BargainingProposal message
+    The transaction pays the amount to the outputs of the last seller message (pro rata)
+
+    Parameters:
+        last_msg = last message sent by the seller
+        amount   = amount offered by the buyer
+        fees     = fees paid by the buyer
+        memo     = memo sent to the seller
+    '''
+    outputs = last_msg.details.outputs
+    total   = sum([o['amount'] for o in outputs])
+    outs    = []
+    for (i, o) in enumerate(outputs):
+        value = amount - sum([out['value'] for out in outs]) if i == len(outputs) - 1 else amount * o['amount'] / total
+        outs.append({'script': o['script'], 'value': value})
+    tx = sign(mktx([FAKE_OUTPOINT], outs), 0, BUYER_PRIVKEY)
+    refund_to = [{'amount': 0, 'script': BUYER_SCRIPT}]
+    sdata = last_msg.details.seller_data
+    dtls = BargainingProposalDetails(now(), 'bench', sdata, [tx], memo, refund_to, amount, fees)
+    return _sign_msg(BargainingMessage(TYPE_BARGAIN_PROPOSAL, dtls), last_msg)
+
+
+def build_cancel_msg(last_msg, memo = 'Benchmark buyer leaves'):
+    '''
+    Builds a signed BargainingCancellation message
+
+    Parameters:
+        last_msg = last message sent by the seller
+        memo     = memo sent to the seller
+    '''
+    dtls = BargainingCancellationDetails(now(), 'bench', last_msg.details.seller_data, memo)
+    return _sign_msg(BargainingMessage(TYPE_BARGAIN_CANCELLATION, dtls), last_msg)
+
+
+def get_offer(msg):
+    '''
+    Returns the amount offered by the seller in a message (sum of outputs)
+
+    Parameters:
+        msg = message sent by the seller
+    '''
+    return sum([o['amount'] for o in msg.details.outputs])
+
+
+def _sign_msg(msg, last_msg):
+    msg.sign(last_msg, SIGN_ECDSA_SHA256, BUYER_PUBKEY, BUYER_PRIVKEY)
+    msg.pbuff = msg.serialize()
+    return msg
+
+
+'''
+SELLER SIDE
+'''
+def receive_msg(nego, msg, network, sum_unspent_func = stub_sum_unspent):
+    '''
+    Checks and appends a buyer message to a negotiation (as done by seller_demo.bargain)
+
+    Parameters:
+        nego             = negotiation
+        msg              = message sent by the buyer
+        network          = network used for the negotiation
+        sum_unspent_func = function computing the sum of unspent inputs
+    '''
+    check_received_msg(nego, msg, network, sum_unspent_func)
+    nego.append(msg)
+
+
+'''
+HTTP
+'''
+def post_msg(uri, msg, headers = None, timeout = 60):
+    '''
+    Posts a message to the seller over http (307 redirects of the routing front are followed)
+    Returns a tuple (http status, body of the response)
+
+    Parameters:
+        uri     = uri of the seller (ie: http://localhost:8082/bargain)
+        msg     = BargainingMessage
+        headers = additional http headers
+        timeout = timeout (in seconds)
+    '''
+    hdrs = {'Content-Type': 'application/bitcoin-%s' % msg.msg_type, 'Content-Transfer-Encoding': 'binary'}
+    hdrs.update(headers or {})
+    for i in range(MAX_REDIRECTS + 1):
+        try:
+            resp = urllib2.urlopen(urllib2.Request(uri, msg.pbuff, hdrs), timeout = timeout)
+            return (resp.getcode(), resp.read())
+        except urllib2.HTTPError, e:
+            # urllib2 doesn't follow redirects of POST requests
+            location = e.info().get('Location', '')
+            if e.code != 307 or not location: return (e.code, e.read())
+            uri = location
+    return (307, '')
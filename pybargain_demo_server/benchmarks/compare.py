@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+'''
+Compares two reports of the load generator and detects regressions
+Exits with status 1 if the throughput or a p99 latency degrades beyond the tolerance
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.compare <baseline.json> <current.json> [tolerance]
+'''
+import sys
+import json
+
+
+'''
+CONSTANTS
+'''
+DEFAULT_TOLERANCE = 0.1
+
+
+def compare(baseline, current, tolerance):
+    '''
+    Returns the list of regressions detected between 2 reports
+
+    Parameters:
+        baseline  = report used as a reference
+        current   = report to check
+        tolerance = tolerated degradation (ratio)
+    '''
+    regressions = []
+    if current['negos_per_s'] < baseline['negos_per_s'] * (1 - tolerance):
+        regressions.append('negos_per_s %.1f -> %.1f' % (baseline['negos_per_s'], current['negos_per_s']))
+    for (msg_type, lat) in baseline['latencies'].items():
+        cur = current['latencies'].get(msg_type, None)
+        if cur is None: continue
+        if cur['p99'] > lat['p99'] * (1 + tolerance):
+            regressions.append('%s p99 %.1fms -> %.1fms' % (msg_type, lat['p99'], cur['p99']))
+    return regressions
+
+
+def main(argv):
+    with open(argv[0]) as f: baseline = json.load(f)
+    with open(argv[1]) as f: current = json.load(f)
+    tolerance = float(argv[2]) if len(argv) > 2 else DEFAULT_TOLERANCE
+    regressions = compare(baseline, current, tolerance)
+    for r in regressions: print 'REGRESSION %s' % r
+    if not regressions: print 'No regression'
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+A local http server standing for buyers receiving asynchronous responses
+Records the messages it receives and can simulate delivery failures
+'''
+import random
+import threading
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class _ThreadingHttpServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HttpSink(object):
+
+    '''
+    ATTRIBUTES
+
+    received      = list of (path, content type, body) received by the sink
+    nb_failures   = number of simulated failures
+
+    _failure_rate = probability of a simulated failure (http 503)
+    _server       = http server
+    _thread       = thread running the http server
+    _lock         = lock protecting received messages
+    '''
+
+    def __init__(self, port = 0, failure_rate = 0):
+        '''
+        Constructor
+
+        Parameters:
+            port         = port listened by the sink (0 = random free port)
+            failure_rate = probability of a simulated failure (http 503)
+        '''
+        self.received      = []
+        self.nb_failures   = 0
+        self._failure_rate = failure_rate
+        self._lock         = threading.Lock()
+        self._server       = _ThreadingHttpServer(('127.0.0.1', port), self._build_handler())
+        self._thread       = None
+
+    @property
+    def uri(self):
+        return 'http://127.0.0.1:%d/callback' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever, name = 'http-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _build_handler(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with sink._lock:
+                    failure = random.random() < sink._failure_rate
+                    if failure: sink.nb_failures += 1
+                    else: sink.received.append((self.path, self.headers.get('Content-Type', ''), body))
+                self.send_response(503 if failure else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+'''
+Load generator driving the seller with synthetic buyers
+
+Each buyer runs a full negotiation: REQUEST -> REQUEST_ACK -> PROPOSAL -> PROPOSAL_ACK ... -> COMPLETION
+(or sends a CANCELLATION after the last proposal, depending on the cancel ratio).
+The seller is reached in process (flask test client of seller_demo.app, utxos and broadcasts provided by local stubs)
+or over http. The report (json) contains negotiations/s, latency histograms per message type,
+outcomes and memory growth. Reports can be compared with benchmarks/compare.py.
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.loadgen [options]   (see --help)
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from pybargain_protocol.constants import *
+from pybargain_protocol.bargaining_message import BargainingMessage
+from benchmarks.buyer import build_request_msg, build_proposal_msg, build_cancel_msg, get_offer, post_msg
+
+
+'''
+CONSTANTS
+'''
+NETWORK = TESTNET
+# Upper bounds (in ms) of the buckets of latency histograms
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+# Offer of the buyer during the negotiation (as a ratio of the first offer of the seller)
+LOWBALL_RATIO = 0.1
+# Messages rejected with these http statuses are sent again (ie: node drained, negotiation handed off to a peer)
+RETRY_STATUSES = [503]
+MAX_RETRIES    = 5
+RETRY_DELAY    = 0.2
+
+
+'''
+TRANSPORTS
+'''
+class TestClientTransport(object):
+    '''
+    Posts messages to seller_demo.app with the flask test client (one client per thread)
+    '''
+
+    def __init__(self, app, remote_addr = '127.0.0.1'):
+        self._app   = app
+        self._local = threading.local()
+        self._environ = {'REMOTE_ADDR': remote_addr}
+
+    def post(self, msg):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        resp = client.post('/bargain', data = msg.pbuff, content_type = 'application/bitcoin-%s' % msg.msg_type,
+                           headers = {'Content-Transfer-Encoding': 'binary'}, environ_base = self._environ)
+        return (resp.status_code, resp.data)
+
+
+class HttpTransport(object):
+    '''
+    Posts messages to a seller over http
+    '''
+
+    def __init__(self, uri):
+        self._uri = uri
+
+    def post(self, msg):
+        return post_msg(self._uri, msg)
+
+
+'''
+STATISTICS
+'''
+class LoadStats(object):
+    '''
+    Thread safe collector of latencies and outcomes
+    '''
+
+    def __init__(self):
+        self._latencies = dict()
+        self._outcomes  = dict()
+        self._lock      = threading.Lock()
+
+    def add_latency(self, msg_type, latency):
+        with self._lock:
+            self._latencies.setdefault(msg_type, []).append(latency)
+
+    def add_outcome(self, outcome):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+
+    def get_outcomes(self):
+        return dict(self._outcomes)
+
+    def get_latencies(self):
+        '''
+        Returns a summary of latencies (in ms) per message type
+        '''
+        res = dict()
+        for (msg_type, values) in self._latencies.items():
+            values = sorted([v * 1000 for v in values])
+            histogram = [len([v for v in values if v <= b]) for b in HISTOGRAM_BUCKETS]
+            histogram = [h - (histogram[i - 1] if i else 0) for (i, h) in enumerate(histogram)]
+            res[msg_type] = {'count'    : len(values),
+                             'mean'     : sum(values) / len(values),
+                             'p50'      : percentile(values, 50),
+                             'p90'      : percentile(values, 90),
+                             'p99'      : percentile(values, 99),
+                             'max'      : values[-1],
+                             'histogram': dict(zip([str(b) for b in HISTOGRAM_BUCKETS] + ['inf'],
+                                                   histogram + [len(values) - sum(histogram)]))}
+        return res
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))] if sorted_values else 0
+
+
+def get_rss(pid = None):
+    '''
+    Returns the resident memory (in bytes) of a process (current process by default). 0 if not available.
+    '''
+    try:
+        with open('/proc/%s/statm' % (pid or 'self')) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+'''
+SYNTHETIC BUYER
+'''
+def run_buyer(transport, stats, nb_rounds, cancel):
+    '''
+    Runs a negotiation
+    Returns the outcome of the negotiation ('completed', 'cancelled', 'error:<reason>')
+
+    Parameters:
+        transport = transport used to post messages
+        stats     = LoadStats
+        nb_rounds = number of proposals sent by the buyer
+        cancel    = flag indicating if the buyer cancels the negotiation after its last proposal
+    '''
+    def send(msg):
+        start = time.time()
+        status, body = transport.post(msg)
+        for i in range(MAX_RETRIES):
+            if not status in RETRY_STATUSES: break
+            time.sleep(RETRY_DELAY)
+            status, body = transport.post(msg)
+        stats.add_latency(msg.msg_type, time.time() - start)
+        if status != 200: raise ValueError('http_%d' % status)
+        return BargainingMessage.deserialize(body) if body else None
+
+    last_msg = send(build_request_msg(NETWORK))
+    if (last_msg is None) or (last_msg.msg_type != TYPE_BARGAIN_REQUEST_ACK): return 'error:no_request_ack'
+    lowball = int(get_offer(last_msg) * LOWBALL_RATIO)
+    for r in range(nb_rounds):
+        last_round = (r == nb_rounds - 1)
+        # Buyer accepts the offer of the seller during the last round (unless it cancels the negotiation)
+        amount = get_offer(last_msg) if (last_round and not cancel) else lowball
+        reply = send(build_proposal_msg(last_msg, amount))
+        if reply is None: return 'error:no_reply'
+        if reply.msg_type == TYPE_BARGAIN_COMPLETION: return 'completed'
+        if reply.msg_type == TYPE_BARGAIN_CANCELLATION: return 'cancelled_by_seller'
+        last_msg = reply
+    if cancel:
+        send(build_cancel_msg(last_msg))
+        return 'cancelled'
+    return 'error:not_completed'
+
+
+def run_load(transport, nb_negos, concurrency, nb_rounds, cancel_ratio, server_pid = None):
+    '''
+    Runs negotiations with concurrent buyers and returns a report (dictionary)
+
+    Parameters:
+        transport    = transport used to post messages
+        nb_negos     = number of negotiations
+        concurrency  = number of concurrent buyers
+        nb_rounds    = number of proposals per negotiation
+        cancel_ratio = ratio of negotiations cancelled by the buyer
+        server_pid   = pid of the server (used to measure memory growth over http)
+    '''
+    stats = LoadStats()
+    counter = iter(range(nb_negos))
+    lock = threading.Lock()
+    rnd = random.Random(0)
+    def worker():
+        while True:
+            with lock:
+                if next(counter, None) is None: return
+                cancel = rnd.random() < cancel_ratio
+            try:
+                stats.add_outcome(run_buyer(transport, stats, nb_rounds, cancel))
+            except Exception, e:
+                stats.add_outcome('error:%s' % e)
+    rss_start = get_rss(server_pid)
+    threads = [threading.Thread(target = worker) for i in range(concurrency)]
+    start = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.time() - start
+    rss_end = get_rss(server_pid)
+    return {'config'     : {'nb_negos': nb_negos, 'concurrency': concurrency, 'nb_rounds': nb_rounds,
+                            'cancel_ratio': cancel_ratio},
+            'duration'   : elapsed,
+            'negos_per_s': nb_negos / elapsed,
+            'outcomes'   : stats.get_outcomes(),
+            'latencies'  : stats.get_latencies(),
+            'memory'     : {'rss_start': rss_start, 'rss_end': rss_end, 'rss_growth': rss_end - rss_start,
+                            'growth_per_nego': (rss_end - rss_start) / float(nb_negos)}}
+
+
+def stub_seller_utxos(seller_demo, latency = 0):
+    '''
+    Replaces the utxo provider of seller_demo by a local stub
+
+    Parameters:
+        seller_demo = seller_demo module
+        latency     = simulated latency (in seconds) of utxo lookups
+    '''
+    from services.utxo_service import UtxoService, StubUtxoBackend
+    seller_demo.utxo_service = UtxoService(StubUtxoBackend(latency = latency))
+    seller_demo.SUM_UNSPENT_FUNC = seller_demo.utxo_service
+
+
+def stub_seller_broadcaster(seller_demo, latency = 0):
+    '''
+    Replaces the backend broadcasting transactions of completed negotiations by a local stub
+
+    Parameters:
+        seller_demo = seller_demo module
+        latency     = simulated latency (in seconds) of a batch
+    '''
+    from services.broadcast_service import BroadcastService, StubBroadcaster
+    seller_demo.broadcast_service.stop()
+    seller_demo.broadcaster = StubBroadcaster(latency)
+    seller_demo.broadcast_service = BroadcastService(seller_demo.broadcaster)
+    seller_demo.broadcast_service.start()
+
+
+def disable_admission(seller_demo):
+    '''
+    Removes the limits of admission control of seller_demo (synthetic buyers share the same address)
+
+    Parameters:
+        seller_demo = seller_demo module
+    '''
+    from services.admission_service import AdmissionService
+    seller_demo.admission = AdmissionService()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'Drives the seller with synthetic buyers')
+    parser.add_argument('--uri', help = 'uri of the seller (default: in process with the flask test client)')
+    parser.add_argument('--server-pid', type = int, help = 'pid of the server (memory growth over http)')
+    parser.add_argument('--negos', type = int, default = 200, help = 'number of negotiations')
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'number of concurrent buyers')
+    parser.add_argument('--rounds', type = int, default = 3, help = 'number of proposals per negotiation')
+    parser.add_argument('--cancel-ratio', type = float, default = 0.2, help = 'ratio of negotiations cancelled by buyers')
+    parser.add_argument('--utxo-latency', type = int, default = 0, help = 'latency (ms) of the utxo stub (in process only)')
+    parser.add_argument('--output', help = 'file where the json report is written (default: stdout)')
+    parser.add_argument('--capture', help = 'file where exchanges are captured (in process only, see benchmarks/replay.py)')
+    args = parser.parse_args(argv)
+
+    if args.uri:
+        transport = HttpTransport(args.uri)
+        mode = 'http'
+    else:
+        import seller_demo
+        stub_seller_utxos(seller_demo, args.utxo_latency / 1000.0)
+        stub_seller_broadcaster(seller_demo)
+        disable_admission(seller_demo)
+        if args.capture:
+            from helpers.capture_helpers import CaptureWriter
+            seller_demo.capture = CaptureWriter(args.capture)
+        transport = TestClientTransport(seller_demo.app)
+        mode = 'test_client'
+    report = run_load(transport, args.negos, args.concurrency, args.rounds, args.cancel_ratio, args.server_pid)
+    if args.capture and not args.uri: seller_demo.capture.close()
+    report['config']['mode'] = mode
+    out = json.dumps(report, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(out)
+    else:
+        print out
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
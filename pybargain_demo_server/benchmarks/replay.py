@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+'''
+Replays a capture of exchanges on /bargain (see CAPTURE_PATH in seller_demo.py) through seller_demo.app
+and checks that responses are equivalent to the captured ones.
+
+The replay is deterministic:
+    - records are posted in capture order (at the captured pace scaled by --speed, or as fast as possible)
+    - the clock of the seller is set to the time of each captured response (timestamp of the record if none)
+    - new negotiations get the ids found in the captured responses
+    - offers of the seller are the captured ones (the random strategy is replaced by a lookup
+      indexed by the history of offers, the fallback strategy is seeded)
+    - memos of the seller are the captured ones (lookup indexed by negotiation and number of offers of the seller,
+      the fallback generator of the negotiators is seeded)
+    - utxos and broadcasts are provided by local stubs and admission control is disabled
+Replayed messages of the seller must be the captured ones. The replay must use:
+    - the base url of the captured requests (--base-url, it's included in RequestACK messages)
+    - the secret of the tokens of seller data used by the captured seller (--seller-secret, see SELLER_DATA_SECRET_PATH)
+Responses are equivalent if they have the same http status, message type, offer and negotiation id
+(signatures, timestamps and memos aren't compared).
+
+Replayed messages of buyers are signed over the captured messages of the seller. They're only accepted
+(check of consistency) if the replayed messages of the seller are the captured ones. --roundtrip checks it:
+a negotiation run by a synthetic buyer is captured and replayed in process (exit code 1 on mismatch).
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.replay capture_file [--base-url https://seller.example.com/] [--seller-secret seller_data.secret] [options]
+    python -m benchmarks.replay --roundtrip
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import tempfile
+import seller_demo
+from functools import partial
+from pybargain_protocol.constants import *
+from pybargain_protocol.bargaining_message import BargainingMessage
+from helpers.capture_helpers import CaptureWriter, read_capture
+from helpers.nego_helpers import set_clock
+from helpers.keystore_helpers import load_secret
+from helpers.messages_helpers import get_seller_data, SDATA_NEGO_ID
+from services.nego_db_service import MemoryNegoDbService
+from services.response_cache_service import ResponseCacheService
+from services.negotiator_service import NegotiatorService
+from services.strategy_service import PricingStrategy, RandomDiscountStrategy, OfferHistory
+from benchmarks.loadgen import LoadStats, TestClientTransport, run_buyer, stub_seller_utxos, stub_seller_broadcaster, \
+                               disable_admission
+
+
+'''
+CONSTANTS
+'''
+# Messages of the seller carrying an offer
+OFFER_MSG_TYPES = [TYPE_BARGAIN_REQUEST_ACK, TYPE_BARGAIN_PROPOSAL_ACK]
+# Maximum number of mismatches detailed in the report
+DEFAULT_MAX_MISMATCHES = 20
+# Base url of replayed requests (default of the flask test client)
+DEFAULT_BASE_URL = 'http://localhost/'
+
+
+'''
+DETERMINISTIC SELLER
+'''
+class ReplayStrategy(PricingStrategy):
+    '''
+    Returns the offers of the seller found in the capture (indexed by history of offers)
+    '''
+
+    def __init__(self, offers, fallback):
+        '''
+        Constructor
+
+        Parameters:
+            offers   = dictionary of offers indexed by history key (see get_history_key)
+            fallback = PricingStrategy used for histories which aren't in the capture
+        '''
+        self._offers   = offers
+        self._fallback = fallback
+
+    def compute_offer(self, history):
+        offer = self._offers.get(get_history_key(history), None)
+        return self._fallback.compute_offer(history) if offer is None else offer
+
+
+class ReplayMemos(object):
+    '''
+    Returns the memos of the seller found in the capture (replaces NegotiatorService.select_memo)
+    '''
+
+    def __init__(self, memos, fallback):
+        '''
+        Constructor
+
+        Parameters:
+            memos    = dictionary of memos indexed by (negotiation id, number of offers of the seller)
+            fallback = function(nego, history) used for offers which aren't in the capture
+        '''
+        self._memos    = memos
+        self._fallback = fallback
+
+    def __call__(self, nego, history):
+        memo = self._memos.get((nego.nid, len(history.seller_offers)), None)
+        return self._fallback(nego, history) if memo is None else memo
+
+
+def get_history_key(history):
+    return (tuple(history.seller_offers), tuple(history.buyer_offers), tuple(history.buyer_fees))
+
+
+def parse_msg(pbuff):
+    '''
+    Returns the BargainingMessage serialized in a pbuff (None if the pbuff is empty or invalid)
+    '''
+    if not pbuff: return None
+    try:
+        return BargainingMessage.deserialize(pbuff)
+    except Exception:
+        return None
+
+
+def analyze_capture(records):
+    '''
+    Extracts the ids of new negotiations, the offers, the memos and the times of the messages of the seller from a capture
+    Returns a tuple (dictionary of nids indexed by index of record, dictionary of offers indexed by history key,
+                     dictionary of memos indexed by (nid, number of offers of the seller),
+                     dictionary of times of responses indexed by index of record)
+
+    Parameters:
+        records = list of CaptureRecord
+    '''
+    nids, offers, memos, times, histories, seen = dict(), dict(), dict(), dict(), dict(), set()
+    for (idx, rec) in enumerate(records):
+        resp = parse_msg(rec.response)
+        if resp is None: continue
+        times[idx] = getattr(resp.details, 'time', None)
+        nid = str(get_seller_data(resp).get(SDATA_NEGO_ID, ''))
+        if not nid: continue
+        # Retransmissions are answered from the response cache
+        key = hashlib.sha256(rec.request).digest()
+        if key in seen: continue
+        seen.add(key)
+        if rec.msg_type == TYPE_BARGAIN_REQUEST: nids[idx] = nid
+        history = histories.setdefault(nid, OfferHistory())
+        req = parse_msg(rec.request)
+        if not (req is None) and req.msg_type == TYPE_BARGAIN_PROPOSAL:
+            history.buyer_offers.append(req.details.amount)
+            history.buyer_fees.append(req.details.fees)
+        if resp.msg_type == TYPE_BARGAIN_PROPOSAL_ACK:
+            offers[get_history_key(history)] = resp.details.amount
+            memos[(nid, len(history.seller_offers))] = resp.details.memo
+        if resp.msg_type in OFFER_MSG_TYPES:
+            history.seller_offers.append(resp.details.amount)
+    return (nids, offers, memos, times)
+
+
+def compare_responses(rec, status, body):
+    '''
+    Returns the list of differences between a captured response and a replayed response
+    '''
+    diffs = []
+    if status != rec.status: diffs.append('status %d != %d' % (status, rec.status))
+    expected, actual = parse_msg(rec.response), parse_msg(body)
+    if (expected is None) != (actual is None):
+        diffs.append('response %s != %s' % (actual and actual.msg_type, expected and expected.msg_type))
+    elif not (expected is None):
+        if actual.msg_type != expected.msg_type:
+            diffs.append('message type %s != %s' % (actual.msg_type, expected.msg_type))
+        elif actual.msg_type in OFFER_MSG_TYPES and actual.details.amount != expected.details.amount:
+            diffs.append('offer %d != %d' % (actual.details.amount, expected.details.amount))
+        actual_nid = get_seller_data(actual).get(SDATA_NEGO_ID, '')
+        expected_nid = get_seller_data(expected).get(SDATA_NEGO_ID, '')
+        if actual_nid != expected_nid: diffs.append('nid %s != %s' % (actual_nid, expected_nid))
+    return diffs
+
+
+'''
+REPLAY
+'''
+def replay(records, speed = 0, check = True, max_mismatches = DEFAULT_MAX_MISMATCHES, base_url = DEFAULT_BASE_URL):
+    '''
+    Replays a capture through seller_demo.app and returns a report (dictionary)
+
+    Parameters:
+        records        = list of CaptureRecord
+        speed          = replay speed (1 = captured pace, 2 = twice faster, ... 0 = as fast as possible)
+        check          = flag indicating if responses are compared to the captured ones
+        max_mismatches = maximum number of mismatches detailed in the report
+        base_url       = base url of replayed requests (scheme and host of the captured seller)
+    '''
+    nids, offers, memos, times = analyze_capture(records)
+    # Deterministic seller (utxos, admission, clock, ids of negotiations, offers and memos)
+    stub_seller_utxos(seller_demo)
+    stub_seller_broadcaster(seller_demo)
+    disable_admission(seller_demo)
+    clock = [0]
+    set_clock(lambda: long(clock[0]))
+    next_nid = ['']
+    seller_demo.new_nego_id = lambda: next_nid[0]
+    for product in seller_demo.registry.get_products():
+        negotiator = seller_demo.registry.get_negotiator(product.pid)
+        negotiator.strategy = ReplayStrategy(offers, RandomDiscountStrategy(product.floor, seed = 0))
+        negotiator.rnd = random.Random(0)
+        negotiator.select_memo = ReplayMemos(memos, partial(NegotiatorService.select_memo, negotiator))
+
+    client = seller_demo.app.test_client()
+    stats = LoadStats()
+    mismatches, nb_mismatches = [], 0
+    t0 = records[0].timestamp if records else 0
+    start = time.time()
+    try:
+        for (idx, rec) in enumerate(records):
+            if speed > 0:
+                delay = start + (rec.timestamp - t0) / speed - time.time()
+                if delay > 0: time.sleep(delay)
+            clock[0] = times.get(idx, None) or rec.timestamp
+            next_nid[0] = nids.get(idx, None) or str(uuid.uuid4())
+            uri = '/bargain?' + rec.query if rec.query else '/bargain'
+            sent = time.time()
+            resp = client.post(uri, base_url = base_url, data = rec.request,
+                               content_type = 'application/bitcoin-%s' % rec.msg_type,
+                               headers = {'Content-Transfer-Encoding': 'binary'})
+            stats.add_latency(rec.msg_type, time.time() - sent)
+            if not check: continue
+            diffs = compare_responses(rec, resp.status_code, resp.data)
+            stats.add_outcome('mismatch' if diffs else 'match')
+            if diffs:
+                nb_mismatches += 1
+                if len(mismatches) < max_mismatches:
+                    mismatches.append({'record': idx, 'msg_type': rec.msg_type, 'diffs': diffs})
+    finally:
+        set_clock(None)
+    elapsed = time.time() - start
+    return {'config'       : {'nb_records': len(records), 'speed': speed, 'check': check, 'base_url': base_url},
+            'duration'     : elapsed,
+            'records_per_s': len(records) / elapsed if elapsed else 0,
+            'outcomes'     : stats.get_outcomes(),
+            'latencies'    : stats.get_latencies(),
+            'mismatches'   : nb_mismatches,
+            'examples'     : mismatches}
+
+
+def roundtrip(nb_rounds = 3):
+    '''
+    Captures a negotiation run by a synthetic buyer through seller_demo.app and replays it with an empty store
+    Returns the report of the replay (outcome of the captured negotiation in roundtrip)
+
+    Parameters:
+        nb_rounds = number of proposals of the buyer (the buyer accepts the last offer)
+    '''
+    stub_seller_utxos(seller_demo)
+    stub_seller_broadcaster(seller_demo)
+    disable_admission(seller_demo)
+    fd, path = tempfile.mkstemp(suffix = '.cap')
+    os.close(fd)
+    os.remove(path)
+    try:
+        seller_demo.capture = CaptureWriter(path)
+        try:
+            outcome = run_buyer(TestClientTransport(seller_demo.app), LoadStats(), nb_rounds, False)
+        finally:
+            seller_demo.capture.close()
+            seller_demo.capture = None
+        # Replayed negotiations get the captured ids (the store and the cache of responses must be empty)
+        seller_demo.nego_db_service = MemoryNegoDbService()
+        seller_demo.response_cache = ResponseCacheService(seller_demo.RESPONSE_CACHE_SIZE, seller_demo.RESPONSE_CACHE_TTL)
+        report = replay(list(read_capture(path)))
+    finally:
+        if os.path.exists(path): os.remove(path)
+    report['roundtrip'] = outcome
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'Replays a capture of exchanges through seller_demo.app')
+    parser.add_argument('capture', nargs = '?', help = 'capture file (see CAPTURE_PATH in seller_demo.py)')
+    parser.add_argument('--roundtrip', action = 'store_true',
+                        help = 'captures and replays a single negotiation (checks that replayed buyer messages are accepted)')
+    parser.add_argument('--speed', type = float, default = 0, help = 'replay speed (1 = captured pace, 0 = as fast as possible)')
+    parser.add_argument('--no-check', action = 'store_true', help = 'responses are not compared to the captured ones')
+    parser.add_argument('--max-mismatches', type = int, default = DEFAULT_MAX_MISMATCHES,
+                        help = 'maximum number of mismatches detailed in the report')
+    parser.add_argument('--base-url', default = DEFAULT_BASE_URL,
+                        help = 'scheme and host of the captured seller (ie: https://seller.example.com/)')
+    parser.add_argument('--seller-secret', help = 'secret file of seller data tokens of the captured seller (see SELLER_DATA_SECRET_PATH)')
+    parser.add_argument('--output', help = 'file where the json report is written (default: stdout)')
+    args = parser.parse_args(argv)
+
+    if args.roundtrip:
+        report = roundtrip()
+    elif args.capture:
+        if args.seller_secret: seller_demo.seller_data_codec.set_secret(load_secret(args.seller_secret))
+        report = replay(list(read_capture(args.capture)), args.speed, not args.no_check, args.max_mismatches, args.base_url)
+    else:
+        parser.error('a capture file or --roundtrip is required')
+    out = json.dumps(report, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(out)
+    else:
+        print out
+    return 1 if report['mismatches'] or report.get('roundtrip', 'completed') != 'completed' else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+'''
+Starts a seller server for benchmarks (utxos and broadcasts are provided by local stubs, no admission control)
+
+Usage (from pybargain_demo_server directory):
+    python -m benchmarks.run_server <flask|gevent> <port> [utxo_latency_ms] [node_id]
+'''
+import sys
+
+if __name__ == '__main__':
+    mode    = sys.argv[1]
+    port    = int(sys.argv[2])
+    latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 0) / 1000.0
+    if mode == 'gevent':
+        # Monkey patching must be done before anything else
+        import seller_demo_gevent
+    import seller_demo
+    if len(sys.argv) > 4: seller_demo.NODE_ID = sys.argv[4]
+    from services.utxo_service import UtxoService, StubUtxoBackend
+    from services.admission_service import AdmissionService
+    from benchmarks.loadgen import stub_seller_broadcaster
+    seller_demo.utxo_service = UtxoService(StubUtxoBackend(latency = latency))
+    seller_demo.SUM_UNSPENT_FUNC = seller_demo.utxo_service
+    seller_demo.admission = AdmissionService()
+    stub_seller_broadcaster(seller_demo)
+    if mode == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', port), seller_demo.app, log = None).serve_forever()
+    else:
+        seller_demo.app.run(port = port, threaded = True)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import time
+import threading
+from collections import OrderedDict
+
+
+'''
+LRU CACHE
+'''
+class LruCache(object):
+    '''
+    A thread safe cache with a bounded size (least recently used entries are evicted first)
+    and an optional time to live for its entries
+    '''
+
+    '''
+    ATTRIBUTES
+
+    hits      = number of successful lookups
+    misses    = number of failed lookups (unknown or expired keys)
+    evictions = number of entries evicted because the cache was full
+
+    _max_size = maximum number of entries
+    _ttl      = time to live (in seconds) of an entry (0 = no expiration)
+    _entries  = ordered dictionary of (value, expiry) indexed by key
+    _lock     = lock protecting the cache
+    '''
+
+    def __init__(self, max_size, ttl = 0):
+        '''
+        Constructor
+
+        Parameters:
+            max_size = maximum number of entries
+            ttl      = time to live (in seconds) of an entry (0 = no expiration)
+        '''
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._max_size = max_size
+        self._ttl      = ttl
+        self._entries  = OrderedDict()
+        self._lock     = threading.Lock()
+
+    def get(self, key, default = None):
+        '''
+        Gets the value associated to a key
+
+        Parameters:
+            key     = key
+            default = value returned if the key isn't found or has expired
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if (entry is None) or (entry[1] and entry[1] < time.time()):
+                self.misses += 1
+                return default
+            # Marks the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        '''
+        Stores a value in the cache
+
+        Parameters:
+            key   = key
+            value = value
+        '''
+        expiry = time.time() + self._ttl if self._ttl else 0
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expiry)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def contains(self, key):
+        '''
+        Checks if a valid entry is associated to a key (doesn't update hits/misses)
+
+        Parameters:
+            key = key
+        '''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            return (entry is not None) and not (entry[1] and entry[1] < time.time())
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        '''
+        Gets counters about the cache
+        '''
+        return {'size'     : len(self._entries),
+                'hits'     : self.hits,
+                'misses'   : self.misses,
+                'evictions': self.evictions}
+
+
+
+'''
+GENERATION CACHE
+'''
+class GenerationCache(object):
+    '''
+    A cache with a bounded size, cheaper than LruCache (plain dictionaries, no lock)
+    for values which can be rebuilt if they're lost (ie: memoization)
+    Entries are stored in a young generation. When it's full, it becomes the old generation
+    (the previous old generation is dropped). Entries found in the old generation are moved back to the young one.
+    Concurrent accesses may lose an entry or a hit/miss (counters are approximate).
+    '''
+
+    '''
+    ATTRIBUTES
+
+    hits      = number of successful lookups
+    misses    = number of failed lookups
+
+    _max_size = maximum number of entries of a generation
+    _young    = dictionary of recent entries
+    _old      = dictionary of previous entries
+    '''
+
+    def __init__(self, max_size):
+        '''
+        Constructor
+
+        Parameters:
+            max_size = maximum number of entries of a generation (at most 2 * max_size entries are stored)
+        '''
+        self.hits      = 0
+        self.misses    = 0
+        self._max_size = max_size
+        self._young    = dict()
+        self._old      = dict()
+
+    def get(self, key, default = None):
+        value = self._young.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._old.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.set(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        young = self._young
+        if len(young) >= self._max_size:
+            self._old, self._young = young, dict()
+            young = self._young
+        young[key] = value
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+    def get_stats(self):
+        '''
+        Gets counters about the cache
+        '''
+        return {'size'  : len(self),
+                'hits'  : self.hits,
+                'misses': self.misses}
+
+
+_MISSING = object()
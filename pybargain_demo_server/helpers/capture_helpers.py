@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import struct
+import threading
+
+
+'''
+CONSTANTS
+'''
+# Header of a capture file (format version 1)
+CAPTURE_MAGIC  = 'BGCAP\x01'
+# Header of a record (timestamp, http status, length of message type, length of query string,
+# length of request, length of response)
+CAPTURE_HEADER = struct.Struct('>dHHHII')
+
+
+'''
+CAPTURE OF EXCHANGES
+A capture file is a sequence of records (one per message received on /bargain):
+    header (see CAPTURE_HEADER) | message type | query string | request (pbuff) | response (pbuff or empty)
+'''
+class CaptureRecord(object):
+
+    __slots__ = ('timestamp', 'status', 'msg_type', 'query', 'request', 'response')
+
+    '''
+    ATTRIBUTES
+
+    timestamp = time of reception of the request
+    status    = http status of the response
+    msg_type  = type of the message (from Content-Type header)
+    query     = query string of the request
+    request   = protobuff message received
+    response  = protobuff message sent as a response ('' if none)
+    '''
+
+    def __init__(self, timestamp, status, msg_type, query, request, response):
+        self.timestamp = timestamp
+        self.status    = status
+        self.msg_type  = msg_type
+        self.query     = query
+        self.request   = request
+        self.response  = response
+
+
+
+class CaptureWriter(object):
+    '''
+    Appends records to a capture file (thread safe, buffered writes)
+    '''
+
+    '''
+    ATTRIBUTES
+
+    nb_records = number of records written
+    nb_failed  = number of records which couldn't be written (ie: query string too long, disk full)
+
+    _file      = capture file
+    _lock      = lock serializing writes
+    '''
+
+    def __init__(self, path, buffer_size = 64 * 1024):
+        '''
+        Constructor
+
+        Parameters:
+            path        = path of the capture file (records are appended to an existing file)
+            buffer_size = size (in bytes) of the write buffer
+        '''
+        self.nb_records = 0
+        self.nb_failed  = 0
+        self._file = open(path, 'ab', buffer_size)
+        self._lock = threading.Lock()
+        if self._file.tell() == 0: self._file.write(CAPTURE_MAGIC)
+
+    def write(self, timestamp, status, msg_type, query, request, response):
+        '''
+        Appends a record
+        Returns False if the record couldn't be written (never raises, the capture mustn't fail the request)
+
+        Parameters:
+            see CaptureRecord
+        '''
+        try:
+            header = CAPTURE_HEADER.pack(timestamp, status, len(msg_type), len(query), len(request), len(response))
+        except struct.error:
+            # Field too long for the format of records (ie: query string > 64KB)
+            header = None
+        with self._lock:
+            try:
+                if not (header is None): self._file.write(''.join([header, msg_type, query, request, response]))
+            except (IOError, ValueError):
+                # Disk full or file closed
+                header = None
+            if header is None:
+                self.nb_failed += 1
+                return False
+            self.nb_records += 1
+        return True
+
+    def get_stats(self):
+        '''
+        Gets counters about the capture
+        '''
+        return {'records': self.nb_records, 'failed': self.nb_failed}
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    '''
+    Reads a capture file
+    Returns a generator of CaptureRecord. A truncated last record (ie: crash during a write) is ignored.
+
+    Parameters:
+        path = path of the capture file
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC: raise ValueError('Invalid capture file %s' % path)
+        while True:
+            header = f.read(CAPTURE_HEADER.size)
+            if len(header) < CAPTURE_HEADER.size: return
+            timestamp, status, type_len, query_len, req_len, resp_len = CAPTURE_HEADER.unpack(header)
+            size = type_len + query_len + req_len + resp_len
+            data = f.read(size)
+            if len(data) < size: return
+            offset = type_len + query_len
+            yield CaptureRecord(timestamp, status, data[:type_len], data[type_len:offset],
+                                data[offset:offset + req_len], data[offset + req_len:])
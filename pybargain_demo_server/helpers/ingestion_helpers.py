@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+from pybargain_protocol.constants import *
+
+
+'''
+CONSTANTS
+'''
+# Maximum sizes (in bytes) of messages sent by buyers (proposals embed transactions)
+MAX_MSG_SIZES = {TYPE_BARGAIN_REQUEST     : 16 * 1024,
+                 TYPE_BARGAIN_PROPOSAL    : 256 * 1024,
+                 TYPE_BARGAIN_CANCELLATION: 16 * 1024}
+# Maximum size (in bytes) of other messages
+DEFAULT_MAX_MSG_SIZE = 64 * 1024
+
+# Reasons of rejection and associated http status
+REJECT_FORMAT        = 'format'
+REJECT_NO_LENGTH     = 'no_length'
+REJECT_TOO_LARGE     = 'too_large'
+REJECT_TRUNCATED     = 'truncated'
+REJECT_MALFORMED     = 'malformed'
+REJECT_TYPE_MISMATCH = 'type_mismatch'
+REJECT_UNKNOWN_PRODUCT = 'unknown_product'
+REJECT_UNKNOWN_NEGO  = 'unknown_nego'
+REJECT_CALLBACK      = 'invalid_callback'
+# Reasons of rejection by admission control (see admission_service.py)
+REJECT_OVERLOADED    = 'overloaded'
+REJECT_CLIENT_RATE   = 'client_rate'
+REJECT_GLOBAL_RATE   = 'global_rate'
+REJECT_LIVE_LIMIT    = 'live_limit'
+# Reasons of rejection during a handoff (see handoff_service.py)
+REJECT_DRAINING      = 'draining'
+REJECT_HANDED_OFF    = 'handed_off'
+REJECT_STATUS = {REJECT_FORMAT       : 400,
+                 REJECT_NO_LENGTH    : 411,
+                 REJECT_TOO_LARGE    : 413,
+                 REJECT_TRUNCATED    : 400,
+                 REJECT_MALFORMED    : 400,
+                 REJECT_TYPE_MISMATCH: 400,
+                 REJECT_UNKNOWN_PRODUCT: 404,
+                 REJECT_UNKNOWN_NEGO : 404,
+                 REJECT_CALLBACK     : 400,
+                 REJECT_OVERLOADED   : 503,
+                 REJECT_CLIENT_RATE  : 429,
+                 REJECT_GLOBAL_RATE  : 503,
+                 REJECT_LIVE_LIMIT   : 503,
+                 REJECT_DRAINING     : 503,
+                 REJECT_HANDED_OFF   : 503}
+
+# Protobuf wire types
+WIRE_VARINT    = 0
+WIRE_FIXED64   = 1
+WIRE_DELIMITED = 2
+WIRE_FIXED32   = 5
+MAX_TYPE_LENGTH = max([len(mt) for mt in MESSAGE_TYPES])
+
+
+'''
+INGESTION OF MESSAGES
+'''
+def read_msg(req, msg_type, max_sizes = MAX_MSG_SIZES):
+    '''
+    Reads the protobuff message of a http request
+    The size announced by the Content-Length header is checked before the body is read.
+    The body is read once from the input stream (no intermediate copy kept by the framework)
+    and its top level protobuf fields are scanned before the message is fully parsed.
+    Returns a tuple (protobuff message, reason of rejection). Reason is None if the message is accepted.
+
+    Parameters:
+        req       = http request
+        msg_type  = type of the message (from Content-Type header)
+        max_sizes = dictionary of maximum sizes (in bytes) indexed by message type
+    '''
+    length = req.content_length
+    if length is None: return (None, REJECT_NO_LENGTH)
+    if length > max_sizes.get(msg_type, DEFAULT_MAX_MSG_SIZE): return (None, REJECT_TOO_LARGE)
+    pbuff = req.stream.read(length)
+    if len(pbuff) != length: return (None, REJECT_TRUNCATED)
+    peeked_type = peek_msg_type(pbuff)
+    if peeked_type is None: return (None, REJECT_MALFORMED)
+    if peeked_type and peeked_type != msg_type: return (None, REJECT_TYPE_MISMATCH)
+    return (pbuff, None)
+
+
+def peek_msg_type(pbuff):
+    '''
+    Scans the top level fields of a protobuf message without parsing nested messages
+    Returns the message type found in a string field, '' if no message type is found, None if the message is malformed
+
+    Parameters:
+        pbuff = protobuff message
+    '''
+    msg_type = ''
+    size = len(pbuff)
+    offset = 0
+    try:
+        while offset < size:
+            key, offset = _read_varint(pbuff, offset)
+            wire_type = key & 0x7
+            if wire_type == WIRE_VARINT:
+                _, offset = _read_varint(pbuff, offset)
+            elif wire_type == WIRE_FIXED64:
+                offset += 8
+            elif wire_type == WIRE_FIXED32:
+                offset += 4
+            elif wire_type == WIRE_DELIMITED:
+                length, offset = _read_varint(pbuff, offset)
+                if (not msg_type) and length <= MAX_TYPE_LENGTH:
+                    value = pbuff[offset:offset + length]
+                    if value in MESSAGE_TYPES: msg_type = value
+                offset += length
+            else:
+                return None
+    except IndexError:
+        return None
+    return msg_type if offset == size else None
+
+
+def _read_varint(data, offset):
+    '''
+    Decodes a varint
+    Returns a tuple (value, offset of next byte)
+    '''
+    value = 0
+    for shift in range(0, 70, 7):
+        b = ord(data[offset])
+        offset += 1
+        value |= (b & 0x7f) << shift
+        if not b & 0x80: return (value, offset)
+    raise IndexError('Invalid varint')
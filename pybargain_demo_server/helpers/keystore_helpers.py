@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import hmac
+import json
+import hashlib
+from bitcoin.main import sha256, privtopub, pubtoaddr
+from bitcoin.transaction import address_to_script
+from pybargain_protocol.constants import *
+from helpers.messages_helpers import compare_tokens
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+'''
+KEYSTORE
+The public fields of keys derived from seeds (public key, address and output script) are cached in a json file
+(readable by owner only) so that they are not derived again (EC math) when a worker starts.
+Private keys are not stored. An entry is trusted after cheap checks:
+    - same network
+    - fingerprint of the private key (sha256 of the private key derived from the seed)
+    - mac of the entry keyed by the private key (a tampered entry can't be forged without the seed)
+Missing or invalid entries are derived again (libsecp256k1 if available) and replaced.
+'''
+# Fields of a key stored in the keystore (with its fingerprint and its mac)
+KEY_ENTRY_FIELDS = ['pubkey', 'address', 'script', 'network']
+
+
+def derive_key(seed, network):
+    '''
+    Derives a key from a seed
+    Returns a dictionary (privkey, pubkey, address, script, network)
+
+    Parameters:
+        seed    = seed of the private key
+        network = network used by the address
+    '''
+    return derive_privkey(sha256(seed), network)
+
+
+def derive_privkey(privkey, network):
+    '''
+    Derives the public fields of a private key
+    Returns a dictionary (privkey, pubkey, address, script, network)
+
+    Parameters:
+        privkey = private key (hex)
+        network = network used by the address
+    '''
+    magicbytes = MAGIC_BYTES_TESTNET if network == TESTNET else MAGIC_BYTES_MAINNET
+    if coincurve is None:
+        pubkey = privtopub(privkey)
+    else:
+        # Same encoding than privtopub (uncompressed, hex)
+        pubkey = coincurve.PrivateKey(privkey.decode('hex')).public_key.format(compressed = False).encode('hex')
+    address = pubtoaddr(pubkey, magicbytes)
+    return {'privkey': privkey, 'pubkey': pubkey, 'address': address,
+            'script': address_to_script(address), 'network': network}
+
+
+def derive_keys(seeds, network):
+    '''
+    Derives keys from seeds
+    Returns a dictionary of keys indexed by name
+
+    Parameters:
+        seeds   = dictionary of seeds indexed by name
+        network = network used by addresses
+    '''
+    return dict([(name, derive_key(seed, network)) for (name, seed) in seeds.items()])
+
+
+def get_key_entry(key):
+    '''
+    Returns the keystore entry of a key (public fields, fingerprint and mac, without the private key)
+
+    Parameters:
+        key = dictionary (privkey, pubkey, address, script, network)
+    '''
+    entry = dict([(k, key[k]) for k in KEY_ENTRY_FIELDS])
+    entry['fingerprint'] = sha256(key['privkey'])
+    entry['mac'] = get_key_mac(key['privkey'], entry)
+    return entry
+
+
+def get_key_mac(privkey, entry):
+    '''
+    Returns the mac of a keystore entry (hex, keyed by the private key)
+    '''
+    data = '\n'.join([str(entry.get(k, '')) for k in ['fingerprint'] + KEY_ENTRY_FIELDS])
+    return hmac.new(privkey.decode('hex'), data, hashlib.sha256).hexdigest()
+
+
+def check_key_entry(entry, privkey, network):
+    '''
+    Returns the key stored in a keystore entry (None if the entry is invalid)
+
+    Parameters:
+        entry   = entry read from the keystore
+        privkey = private key derived from the seed
+        network = network used by the address
+    '''
+    if not (isinstance(entry, dict) and entry.get('network') == network): return None
+    if entry.get('fingerprint') != sha256(privkey): return None
+    try:
+        if not compare_tokens(str(entry.get('mac', '')), get_key_mac(privkey, entry)): return None
+        key = dict([(k, str(entry.get(k, ''))) for k in KEY_ENTRY_FIELDS])
+    except UnicodeEncodeError:
+        # Non ascii values (tampered entry)
+        return None
+    key['privkey'] = privkey
+    return key
+
+
+def load_keys(path, seeds, network):
+    '''
+    Loads keys from a keystore file
+    Missing or invalid entries are derived and the keystore is saved (other entries of the keystore are kept)
+    Returns a dictionary of keys indexed by name
+
+    Parameters:
+        path    = path of the keystore file (None = keys are derived)
+        seeds   = dictionary of seeds indexed by name
+        network = network used by addresses
+    '''
+    if not path: return derive_keys(seeds, network)
+    # Keystores created by previous versions may be readable by other users
+    if os.path.exists(path) and os.stat(path).st_mode & 0077: os.chmod(path, 0600)
+    try:
+        with open(path) as f:
+            store = json.load(f)
+    except (IOError, ValueError):
+        store = dict()
+    keys = dict()
+    updated = False
+    for (name, seed) in seeds.items():
+        keys[name] = check_key_entry(store.get(name, None), sha256(seed), network)
+        if keys[name] is None:
+            keys[name] = derive_key(seed, network)
+            store[name] = get_key_entry(keys[name])
+            updated = True
+    if updated: save_keys(path, store)
+    return keys
+
+
+def save_keys(path, keys):
+    '''
+    Writes keys in a keystore file (readable by owner only, atomic replacement)
+
+    Parameters:
+        path = path of the keystore file
+        keys = dictionary of keys indexed by name
+    '''
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(keys, f, indent = 2, sort_keys = True)
+    os.rename(tmp_path, path)
+
+
+'''
+SECRETS
+'''
+def load_secret(path, size = 32):
+    '''
+    Loads a secret from a file (hex, readable by owner only)
+    A random secret is generated and saved if the file doesn't exist (workers sharing the file share the secret)
+    Returns a string
+
+    Parameters:
+        path = path of the secret file
+        size = size (in bytes) of a new secret
+    '''
+    if not os.path.exists(path):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(size).encode('hex'))
+        try:
+            # Fails if the file has been created concurrently by another worker (its secret is kept)
+            os.link(tmp_path, path)
+        except OSError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path) as f:
+        try:
+            secret = f.read().strip().decode('hex')
+        except TypeError:
+            secret = ''
+    if len(secret) < 16: raise ValueError('Invalid secret file %s' % path)
+    return secret
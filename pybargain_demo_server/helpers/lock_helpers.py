@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import zlib
+import threading
+
+
+'''
+STRIPED LOCKS
+'''
+class StripedLocks(object):
+    '''
+    A fixed set of locks shared by keys (ie: negotiation ids)
+    A key is always associated to the same lock, so operations on a key are serialized
+    while operations on keys associated to different locks can run in parallel.
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_NB_STRIPES = 1024
+
+    '''
+    ATTRIBUTES
+
+    _locks = list of locks
+    '''
+
+    def __init__(self, nb_stripes = DEFAULT_NB_STRIPES):
+        '''
+        Constructor
+
+        Parameters:
+            nb_stripes = number of locks
+        '''
+        self._locks = [threading.Lock() for i in range(nb_stripes)]
+
+    def get_lock(self, key):
+        '''
+        Returns the lock associated to a key
+
+        Parameters:
+            key = key (ie: negotiation id)
+        '''
+        return self._locks[(zlib.crc32(str(key)) & 0xffffffff) % len(self._locks)]
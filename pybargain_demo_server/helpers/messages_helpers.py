@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 
+import hmac
 import json
+import socket
+import struct
+import hashlib
+import urlparse
 from flask.helpers import make_response
 from pybargain_protocol.constants import MESSAGE_TYPES
+from helpers.cache_helpers import GenerationCache
 
 
 '''
@@ -14,6 +20,21 @@ VALID_MEDIA_TYPES = ['application/bitcoin-' + mt for mt in MESSAGE_TYPES]
 # seller_data keys
 SDATA_PRODUCT_ID = 'pid'
 SDATA_NEGO_ID    = 'nid'
+SDATA_TOKEN      = 'tok'
+# Size (in hex characters) of the token authenticating the negotiation id of seller_data
+SDATA_TOKEN_SIZE = 32
+
+# Http header used by the buyer to provide the uri where asynchronous responses are sent
+CALLBACK_URI_HEADER = 'X-Bargain-Callback'
+# Timeout (in seconds) of asynchronous responses
+SEND_TIMEOUT = 10
+# Schemes of callback uris
+CALLBACK_SCHEMES = ['http', 'https']
+# Networks which can't be reached by callbacks (loopback, private, link-local, multicast and reserved addresses)
+PRIVATE_IPV4_NETS = ['0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12',
+                     '192.0.0.0/24', '192.168.0.0/16', '198.18.0.0/15', '224.0.0.0/4', '240.0.0.0/4']
+# Http header authenticating requests sent to admin end points (see seller_demo.py)
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
 
 
 '''
@@ -32,6 +53,18 @@ def check_req_format(req):
     return valid_content_type and valid_encoding
 
 
+def get_req_msg_type(req):
+    '''
+    Returns the message type announced by the Content-Type header of a http request ('' if not valid)
+    
+    Parameters:
+        req = http request
+    '''
+    for ct in req.headers.get('Content-Type','').split(';'):
+        if ct in VALID_MEDIA_TYPES: return ct[len('application/bitcoin-'):]
+    return ''
+
+
 def send_msg_sync(msg, next_msg_types):
     '''
     Sends a BargainingMessage as a synchronous response to a received http request
@@ -43,14 +76,143 @@ def send_msg_sync(msg, next_msg_types):
     '''
     if (msg is None) or (not msg.pbuff): return None
     
-    resp = make_response(msg.pbuff)
-    resp.headers['Content-Type'] = 'application/bitcoin-%s' % msg.msg_type 
-    resp.headers['Content-Transfer-Encoding'] = 'binary'
-    next_msg_types = ['application/bitcoin-' + nmt for nmt in next_msg_types]
-    resp.headers['Accept'] = ','.join(next_msg_types)
+    return send_pbuff_sync(msg.pbuff, build_msg_headers(msg, next_msg_types))
+
+
+def send_pbuff_sync(pbuff, headers):
+    '''
+    Sends a serialized message as a synchronous response to a received http request
+    Returns the response
+    
+    Parameters:
+        pbuff   = protobuff message to be sent
+        headers = dictionary of http headers
+    '''
+    resp = make_response(pbuff)
+    for (k, v) in headers.items(): resp.headers[k] = v
     return resp
 
 
+def send_msg_async(msg, next_msg_types, uri, allowed_hosts = None):
+    '''
+    Sends a BargainingMessage in a http POST request (asynchronous response)
+    Raises an exception if the message can't be delivered
+    
+    Parameters:
+        msg            = BargainingMessage to be sent
+        next_msg_types = list of expected message types for the next message
+        uri            = uri where the message is sent
+        allowed_hosts  = list of hosts allowed in callback uris (None = any host with a public address)
+    '''
+    if (msg is None) or (not msg.pbuff): return
+    # The uri is checked again with the addresses of the host (names may resolve to internal addresses)
+    if not check_callback_uri(uri, allowed_hosts, resolve = True): raise ValueError('Invalid callback uri %s' % uri)
+    # Imported on demand (startup time)
+    import urllib2
+    req = urllib2.Request(uri, msg.pbuff, build_msg_headers(msg, next_msg_types))
+    _get_callback_opener().open(req, timeout = SEND_TIMEOUT).close()
+
+
+def check_callback_uri(uri, allowed_hosts = None, resolve = False):
+    '''
+    Checks if a callback uri provided by a buyer can be used to send asynchronous responses
+    (http or https, host in allowed_hosts or a public address)
+
+    Parameters:
+        uri           = callback uri
+        allowed_hosts = list of allowed hosts (None or empty = any host with a public address)
+        resolve       = flag indicating if the addresses of the host are checked (dns query)
+                        otherwise only ip literals and local names are checked
+    '''
+    try:
+        parts = urlparse.urlsplit(uri)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return False
+    if not (parts.scheme in CALLBACK_SCHEMES) or not host: return False
+    if allowed_hosts: return host in allowed_hosts
+    if host == 'localhost' or host.endswith('.localhost'): return False
+    if not resolve: return is_public_addr(host) or not is_ip_addr(host)
+    try:
+        addrs = [ai[4][0] for ai in socket.getaddrinfo(host, port or 80, 0, socket.SOCK_STREAM)]
+    except socket.error:
+        return False
+    return bool(addrs) and all([is_public_addr(a) for a in addrs])
+
+
+def is_ip_addr(addr):
+    for family in [socket.AF_INET, socket.AF_INET6]:
+        try:
+            socket.inet_pton(family, addr)
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+def is_public_addr(addr):
+    '''
+    Checks if an ip address (v4 or v6) is a public address
+    '''
+    try:
+        ip = struct.unpack('>I', socket.inet_pton(socket.AF_INET, addr))[0]
+        return not any([(ip & mask) == net for (net, mask) in _PRIVATE_IPV4_NETS])
+    except (socket.error, ValueError):
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, addr)
+    except (socket.error, ValueError):
+        return False
+    # Ipv4 mapped addresses
+    if packed[:12] == '\x00' * 10 + '\xff\xff': return is_public_addr(socket.inet_ntop(socket.AF_INET, packed[12:]))
+    first, second = ord(packed[0]), ord(packed[1])
+    # Unspecified, loopback, multicast, unique local and link-local addresses
+    if packed[:15] == '\x00' * 15: return False
+    if first == 0xff or (first & 0xfe) == 0xfc: return False
+    if first == 0xfe and (second & 0xc0) == 0x80: return False
+    return True
+
+
+def _parse_net(cidr):
+    net, bits = cidr.split('/')
+    mask = (0xffffffff << (32 - int(bits))) & 0xffffffff
+    return (struct.unpack('>I', socket.inet_aton(net))[0] & mask, mask)
+
+_PRIVATE_IPV4_NETS = [_parse_net(n) for n in PRIVATE_IPV4_NETS]
+
+
+_callback_opener = None
+
+def _get_callback_opener():
+    '''
+    Returns the url opener sending asynchronous responses (redirects aren't followed)
+    '''
+    global _callback_opener
+    if _callback_opener is None:
+        # Imported on demand (startup time)
+        import urllib2
+        class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+            def redirect_request(self, req, fp, code, msg, headers, newurl):
+                return None
+        _callback_opener = urllib2.build_opener(NoRedirectHandler)
+    return _callback_opener
+
+
+def build_msg_headers(msg, next_msg_types):
+    '''
+    Builds the http headers of a message
+    Returns a dictionary
+    
+    Parameters:
+        msg            = BargainingMessage to be sent
+        next_msg_types = list of expected message types for the next message
+    '''
+    next_msg_types = ['application/bitcoin-' + nmt for nmt in next_msg_types]
+    return {'Content-Type': 'application/bitcoin-%s' % msg.msg_type,
+            'Content-Transfer-Encoding': 'binary',
+            'Accept': ','.join(next_msg_types)}
+
+
 '''
 SELLER DATA
 '''
@@ -81,5 +243,138 @@ def build_seller_data(nid = '', pid = ''):
     return json.dumps(sdata)
 
 
+def compare_tokens(a, b):
+    '''
+    Compares two strings in constant time (hmac.compare_digest isn't available before python 2.7.7)
+
+    Parameters:
+        a, b = strings
+    '''
+    if len(a) != len(b): return False
+    res = 0
+    for (x, y) in zip(a, b): res |= ord(x) ^ ord(y)
+    return res == 0
+
+
+class SellerDataCodec(object):
+    '''
+    Encodes and decodes the seller_data of messages
+    The negotiation id is authenticated by a token (hmac of nid and pid) so that buyers can't forge it
+    (seller_data with an invalid token are ignored before any access to the store).
+    Encoded seller_data are cached per negotiation (built once) and decoded seller_data are memoized
+    (the seller_data echoed by buyers are found without json parsing nor hmac).
+    Decoded dictionaries are shared and must not be modified.
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_CACHE_SIZE = 100000
+
+    '''
+    ATTRIBUTES
+
+    _hmac       = hmac keyed with the secret of the tokens (copied for each token)
+    _cache_size = maximum number of seller_data stored in a generation of caches
+    _encoded = GenerationCache of seller_data indexed by nid (a negotiation is associated to a single product)
+    _decoded = GenerationCache of decoded seller_data (dictionaries) indexed by seller_data
+    '''
+
+    def __init__(self, secret, cache_size = DEFAULT_CACHE_SIZE):
+        '''
+        Constructor
+
+        Parameters:
+            secret     = secret key of the tokens (shared by all workers)
+            cache_size = maximum number of seller_data stored in a generation of caches
+        '''
+        self._cache_size = cache_size
+        self.set_secret(secret)
+
+    def set_secret(self, secret):
+        '''
+        Replaces the secret key of the tokens (ie: replay of traffic captured with the secret of another host)
+        Cached seller_data are dropped
+
+        Parameters:
+            secret = secret key of the tokens
+        '''
+        self._hmac    = hmac.new(secret, digestmod = hashlib.sha256)
+        self._encoded = GenerationCache(self._cache_size)
+        self._decoded = GenerationCache(self._cache_size)
+
+    def encode(self, nid = '', pid = ''):
+        '''
+        Builds and serializes the seller_data structure (with a token if nid is set)
+
+        Parameters:
+            nid = negotiation id
+            pid = product id
+        '''
+        sdata = self._encoded.get(nid) if nid else None
+        if sdata is None:
+            values = dict()
+            if nid:
+                values[SDATA_NEGO_ID] = nid
+                values[SDATA_TOKEN] = self._get_token(nid, pid)
+            if pid: values[SDATA_PRODUCT_ID] = pid
+            sdata = json.dumps(values)
+            if nid: self._encoded.set(nid, sdata)
+            self._decoded.set(sdata, values)
+        return sdata
+
+    def decode(self, sdata):
+        '''
+        Parses a seller_data and returns a dictionary
+        Returns an empty dictionary if the seller_data is invalid (format or token)
+
+        Parameters:
+            sdata = serialized seller_data
+        '''
+        if not sdata: return {}
+        values = self._decoded.get(sdata)
+        if not (values is None): return values
+        try:
+            values = json.loads(sdata)
+        except ValueError:
+            return {}
+        if not isinstance(values, dict): return {}
+        nid = values.get(SDATA_NEGO_ID, '')
+        if nid:
+            token = values.get(SDATA_TOKEN, '')
+            if not (isinstance(nid, basestring) and isinstance(token, basestring)): return {}
+            pid = values.get(SDATA_PRODUCT_ID, '')
+            try:
+                if not compare_tokens(str(token), self._get_token(str(nid), str(pid))): return {}
+            except UnicodeEncodeError:
+                return {}
+            # Only authenticated seller_data are memoized (junk can't fill the cache)
+            self._decoded.set(sdata, values)
+        return values
+
+    def decode_msg(self, msg):
+        '''
+        Extracts the seller data from a BargainingMessage and returns a dictionary (see decode)
+
+        Parameters:
+            msg = BargainingMessage
+        '''
+        if msg is None or msg.details is None: return {}
+        return self.decode(msg.details.seller_data)
+
+    def get_stats(self):
+        '''
+        Gets counters about caches (hits and misses of decoding)
+        '''
+        stats = self._decoded.get_stats()
+        stats['encoded'] = len(self._encoded)
+        return stats
+
+    def _get_token(self, nid, pid):
+        mac = self._hmac.copy()
+        mac.update('%s\x00%s' % (nid, pid))
+        return mac.hexdigest()[:SDATA_TOKEN_SIZE]
+
+
 
     
\ No newline at end of file
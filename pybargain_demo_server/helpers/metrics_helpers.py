@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+import time
+import bisect
+import threading
+
+
+'''
+CONSTANTS
+'''
+# Names of metrics
+STAGE_METRIC    = 'bargain_stage_seconds'
+REQUEST_METRIC  = 'bargain_request_seconds'
+OUTCOME_METRIC  = 'bargain_requests_total'
+ERROR_METRIC    = 'bargain_errors_total'
+REJECT_METRIC   = 'bargain_rejected_total'
+
+# Upper bounds (in seconds) of the buckets of histograms
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+'''
+METRICS
+'''
+class Metrics(object):
+    '''
+    Thread safe registry of counters and histograms, rendered in Prometheus text format
+    Labels are tuples of (name, value) pairs.
+    A disabled registry ignores all updates (timers are a shared no-op object).
+    '''
+
+    '''
+    ATTRIBUTES
+
+    enabled     = flag indicating if metrics are collected
+
+    _buckets    = upper bounds (in seconds) of the buckets of histograms
+    _counters   = dictionary of counter values indexed by (name, labels)
+    _histograms = dictionary of [bucket counts, sum, count] indexed by (name, labels)
+    _collectors = list of (prefix, function returning a dictionary of gauges) rendered with the metrics
+    _lock       = lock protecting counters and histograms
+    '''
+
+    def __init__(self, enabled = True, buckets = DEFAULT_BUCKETS):
+        '''
+        Constructor
+
+        Parameters:
+            enabled = flag indicating if metrics are collected
+            buckets = upper bounds (in seconds) of the buckets of histograms
+        '''
+        self.enabled     = enabled
+        self._buckets    = tuple(buckets)
+        self._counters   = dict()
+        self._histograms = dict()
+        self._collectors = []
+        self._lock       = threading.Lock()
+
+    def incr(self, name, labels = (), value = 1):
+        '''
+        Increments a counter
+
+        Parameters:
+            name   = name of the counter
+            labels = tuple of (name, value) pairs
+            value  = increment
+        '''
+        if not self.enabled: return
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, duration):
+        '''
+        Adds an observation to a histogram
+
+        Parameters:
+            name     = name of the histogram
+            labels   = tuple of (name, value) pairs
+            duration = observed duration (in seconds)
+        '''
+        if not self.enabled: return
+        key = (name, labels)
+        idx = bisect.bisect_left(self._buckets, duration)
+        with self._lock:
+            hist = self._histograms.get(key, None)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            hist[0][idx] += 1
+            hist[1] += duration
+            hist[2] += 1
+
+    def timer(self, name, labels = ()):
+        '''
+        Returns a context manager adding the duration of its block to a histogram
+
+        Parameters:
+            name   = name of the histogram
+            labels = tuple of (name, value) pairs
+        '''
+        return _Timer(self, name, labels) if self.enabled else _NO_TIMER
+
+    def stage(self, stage, msg_type):
+        '''
+        Returns a context manager timing a stage of the processing of a message
+
+        Parameters:
+            stage    = name of the stage (ie: 'deserialize', 'sign')
+            msg_type = type of the processed message
+        '''
+        return _Timer(self, STAGE_METRIC, (('stage', stage), ('msg_type', msg_type))) if self.enabled else _NO_TIMER
+
+    def add_collector(self, prefix, func):
+        '''
+        Adds a function providing gauges (ie: stats of a service) rendered with the metrics
+
+        Parameters:
+            prefix = prefix of the names of the gauges
+            func   = function returning a dictionary of numeric values indexed by name
+        '''
+        self._collectors.append((prefix, func))
+
+    def get_counter(self, name, labels = ()):
+        return self._counters.get((name, labels), 0)
+
+    def get_histogram(self, name, labels = ()):
+        '''
+        Returns a tuple (bucket counts, sum, count) or None if no observation has been made
+        '''
+        with self._lock:
+            hist = self._histograms.get((name, labels), None)
+            return (list(hist[0]), hist[1], hist[2]) if hist else None
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        '''
+        Returns the metrics in Prometheus text format
+        '''
+        with self._lock:
+            counters   = sorted(self._counters.items())
+            histograms = sorted([(k, (list(h[0]), h[1], h[2])) for (k, h) in self._histograms.items()])
+        lines = []
+        names = set()
+        for ((name, labels), value) in counters:
+            if not name in names:
+                lines.append('# TYPE %s counter' % name)
+                names.add(name)
+            lines.append('%s%s %s' % (name, _format_labels(labels), value))
+        for ((name, labels), (buckets, total, count)) in histograms:
+            if not name in names:
+                lines.append('# TYPE %s histogram' % name)
+                names.add(name)
+            cumul = 0
+            for (bound, nb) in zip(self._buckets + ('+Inf',), buckets):
+                cumul += nb
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', str(bound)),)), cumul))
+            lines.append('%s_sum%s %.9f' % (name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+        for (prefix, func) in self._collectors:
+            try:
+                gauges = func()
+            except Exception:
+                continue
+            for (k, v) in sorted(gauges.items()):
+                name = '%s_%s' % (prefix, k)
+                lines.append('# TYPE %s gauge' % name)
+                lines.append('%s %s' % (name, v))
+        return '\n'.join(lines) + '\n'
+
+
+
+class _Timer(object):
+    '''
+    Context manager adding the duration of its block to a histogram
+    '''
+
+    __slots__ = ('_metrics', '_name', '_labels', '_start')
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name    = name
+        self._labels  = labels
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._metrics.observe(self._name, self._labels, time.time() - self._start)
+        return False
+
+
+
+class _NoTimer(object):
+    '''
+    Context manager doing nothing (disabled metrics)
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+# Disabled registry (default of services which can be instrumented)
+NO_METRICS = Metrics(enabled = False)
+
+
+def _format_labels(labels):
+    if not labels: return ''
+    values = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (k, v) in labels]
+    return '{%s}' % ','.join(['%s="%s"' % (k, v) for (k, v) in values])
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+import json
+import struct
+import calendar
+from datetime import datetime
+from pybargain_protocol.constants import *
+from pybargain_protocol.negotiation import Negotiation
+from pybargain_protocol.bargaining_message import BargainingMessage
+from helpers.metrics_helpers import NO_METRICS
+
+
+'''
+CONSTANTS
+'''
+# Header of a serialized message (length of metadata, length of pbuff)
+MSG_RECORD_HEADER = struct.Struct('>II')
+
+
+'''
+SERIALIZATION OF NEGOTIATIONS
+A negotiation is stored as its chain of messages.
+Each message is stored as a record : header + metadata (json) + pbuff
+Metadata keep the status and errors computed by the seller when the message was checked.
+'''
+def serialize_msg(msg):
+    '''
+    Serializes a BargainingMessage into a binary record
+
+    Parameters:
+        msg = BargainingMessage
+    '''
+    pbuff = msg.pbuff if getattr(msg, 'pbuff', None) else msg.serialize()
+    meta  = json.dumps([msg.status, list(msg.errors)])
+    return MSG_RECORD_HEADER.pack(len(meta), len(pbuff)) + meta + pbuff
+
+
+def serialize_nego(nego, start_idx = 0):
+    '''
+    Serializes the chain of messages of a negotiation
+    Returns a string
+
+    Parameters:
+        nego      = Negotiation
+        start_idx = index of the first message to serialize
+    '''
+    return ''.join([serialize_msg(nego.get_msg_at_idx(idx)) for idx in range(start_idx, nego.length())])
+
+
+def iter_msg_records(data):
+    '''
+    Iterates over the records stored in a serialized chain
+    Yields tuples (status, errors, pbuff)
+
+    Parameters:
+        data = serialized chain of messages
+    '''
+    data   = str(data)
+    offset = 0
+    while offset < len(data):
+        len_meta, len_pbuff = MSG_RECORD_HEADER.unpack_from(data, offset)
+        offset += MSG_RECORD_HEADER.size
+        status, errors = json.loads(data[offset:offset + len_meta])
+        offset += len_meta
+        pbuff = data[offset:offset + len_pbuff]
+        offset += len_pbuff
+        yield (status, errors, pbuff)
+
+
+def deserialize_msg(status, errors, pbuff):
+    '''
+    Rebuilds a BargainingMessage from a record
+
+    Parameters:
+        status = status of the message
+        errors = list of errors logged on the message
+        pbuff  = protobuff message
+    '''
+    msg = BargainingMessage.deserialize(pbuff)
+    msg.pbuff  = pbuff
+    msg.status = status
+    msg.errors = list(errors)
+    return msg
+
+
+def deserialize_nego(nid, network, data):
+    '''
+    Rebuilds a Negotiation from a serialized chain of messages
+
+    Parameters:
+        nid     = id of the negotiation
+        network = network used for the negotiation
+        data    = serialized chain of messages
+    '''
+    nego = Negotiation(nid, ROLE_SELLER, network)
+    for (status, errors, pbuff) in iter_msg_records(data):
+        nego.append(deserialize_msg(status, errors, pbuff))
+    return nego
+
+
+'''
+EXPIRATION OF NEGOTIATIONS
+'''
+def get_current_time():
+    '''
+    Returns current time (computed as done for the time field of messages)
+    '''
+    return _clock()
+
+
+def set_clock(clock = None):
+    '''
+    Replaces the clock returning the current time (ie: replay of captured traffic)
+
+    Parameters:
+        clock = function returning the current time (None = system clock)
+    '''
+    global _clock
+    _clock = clock if clock else _system_clock
+
+
+def _system_clock():
+    return long(calendar.timegm(datetime.now().timetuple()))
+
+_clock = _system_clock
+
+
+def is_nego_finished(nego):
+    '''
+    Checks if a negotiation has reached a final state
+
+    Parameters:
+        nego = Negotiation
+    '''
+    return nego.status in [NEGO_STATUS_COMPLETED, NEGO_STATUS_CANCELLED]
+
+
+def get_nego_expiry(nego, ttl, finished_ttl):
+    '''
+    Returns the time after which a negotiation can be removed from db
+    A finished negotiation is kept finished_ttl seconds.
+    Other negotiations expire at the time set by the seller in the RequestACK message
+    (or ttl seconds after now if this message has not been sent yet).
+
+    Parameters:
+        nego         = Negotiation
+        ttl          = time to live (in seconds) of a negotiation without RequestACK message
+        finished_ttl = time to live (in seconds) of a finished negotiation
+    '''
+    now = get_current_time()
+    if is_nego_finished(nego): return now + finished_ttl
+    # RequestACK is the second message of the chain
+    if nego.length() > 1:
+        msg = nego.get_msg_at_idx(1)
+        if msg.msg_type == TYPE_BARGAIN_REQUEST_ACK and msg.details.expires:
+            return msg.details.expires
+    return now + ttl
+
+
+'''
+CHECKS OF RECEIVED MESSAGES
+'''
+def check_received_msg(nego, msg, network, sum_unspent_func):
+    '''
+    Checks a message received for an existing negotiation
+    (transactions if message is a PROPOSAL, then format and consistency with negotiation if valid format)
+    Returns the status of the message
+
+    Parameters:
+        nego             = Negotiation
+        msg              = received BargainingMessage
+        network          = network used for the negotiation
+        sum_unspent_func = function computing the sum of unspent inputs of transactions
+    '''
+    # If message is a PROPOSAL, prechecks the transactions
+    if msg.msg_type == TYPE_BARGAIN_PROPOSAL:
+        nego.precheck_txs(msg, nego.get_last_msg(), sum_unspent_func)
+    # Checks message format (and consistency with negotiation if valid format)
+    check_msg_fmt_and_consistency(nego, msg, network)
+    return msg.status
+
+
+def check_msg_fmt_and_consistency(nego, msg, network, metrics = NO_METRICS):
+    '''
+    Checks the format of a message and its consistency with negotiation if valid format
+    Returns True if the format is valid
+    
+    Parameters:
+        nego    = Negotiation
+        msg     = received BargainingMessage
+        network = network used for the negotiation
+        metrics = Metrics timing the checks
+    '''
+    with metrics.stage('check_msg_fmt', msg.msg_type):
+        fmt_ok = msg.check_msg_fmt(network)
+    if fmt_ok:
+        with metrics.stage('check_consistency', msg.msg_type):
+            nego.check_consistency(msg)
+        return True
+    return False
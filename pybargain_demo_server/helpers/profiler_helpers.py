@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+
+
+'''
+SAMPLING PROFILER
+'''
+class SamplingProfiler(object):
+    '''
+    A statistical profiler which can be started and stopped at runtime
+    A background thread periodically samples the stacks of all other threads.
+    Samples are aggregated as collapsed stacks (one line per stack: "frame;frame;... count"),
+    the input format of flame graph tools.
+    Note: only native threads are sampled (greenlets of the gevent server are seen through their hub thread).
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    # Default delay (in seconds) between two samples
+    DEFAULT_INTERVAL = 0.005
+    # Maximum depth of sampled stacks
+    MAX_DEPTH = 64
+
+    '''
+    ATTRIBUTES
+
+    nb_samples = number of samples taken since last reset
+
+    _interval  = delay (in seconds) between two samples
+    _stacks    = dictionary of counts indexed by collapsed stack
+    _thread    = sampling thread
+    _stop      = event stopping the sampling thread
+    _lock      = lock protecting the samples
+    '''
+
+    def __init__(self, interval = DEFAULT_INTERVAL):
+        '''
+        Constructor
+
+        Parameters:
+            interval = delay (in seconds) between two samples
+        '''
+        self.nb_samples = 0
+        self._interval  = interval
+        self._stacks    = dict()
+        self._thread    = None
+        self._stop      = threading.Event()
+        self._lock      = threading.Lock()
+
+    def start(self):
+        '''
+        Starts sampling (does nothing if the profiler is already running)
+        '''
+        with self._lock:
+            if self.is_running(): return
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = 'sampling-profiler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        '''
+        Stops sampling (samples are kept until reset)
+        '''
+        self._stop.set()
+        if not self._thread is None: self._thread.join()
+        self._thread = None
+
+    def is_running(self):
+        return (not self._thread is None) and self._thread.is_alive()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.nb_samples = 0
+
+    def get_collapsed_stacks(self):
+        '''
+        Returns the samples as collapsed stacks (most frequent first)
+        '''
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key = lambda s: -s[1])
+        return '\n'.join(['%s %d' % s for s in stacks]) + '\n'
+
+    def _run(self):
+        own_id = threading.current_thread().ident
+        while not self._stop.wait(self._interval):
+            self._sample(own_id)
+
+    def _sample(self, own_id):
+        samples = []
+        for (thread_id, frame) in sys._current_frames().items():
+            if thread_id == own_id: continue
+            stack = []
+            while (not frame is None) and len(stack) < SamplingProfiler.MAX_DEPTH:
+                code = frame.f_code
+                stack.append('%s:%s:%d' % (code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            samples.append(';'.join(reversed(stack)))
+        with self._lock:
+            for s in samples: self._stacks[s] = self._stacks.get(s, 0) + 1
+            self.nb_samples += 1
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import re
+import uuid
+import struct
+
+
+'''
+CONSTANTS
+'''
+# Separator between the id of the owner node and the uuid of a negotiation id
+NID_SEPARATOR = '.'
+# Valid ids of nodes
+NODE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+# Negotiation id (with an owner node) found in the seller_data of a protobuff message (see peek_nego_id)
+NID_PATTERN = re.compile(r'"nid": "([A-Za-z0-9_-]{1,32}\.[0-9a-f-]{36})"')
+# Header of a negotiation transferred between nodes (length of nid, length of network, length of chain)
+HANDOFF_HEADER = struct.Struct('>HHI')
+
+
+'''
+NEGOTIATION IDS
+A negotiation id is built as <id of the owner node>.<uuid> (or <uuid> for a single node).
+The owner node holds the negotiation in memory. Continuations are routed to it by the routing front (see seller_router.py).
+'''
+def build_nego_id(node_id = ''):
+    '''
+    Builds a new negotiation id owned by a node
+
+    Parameters:
+        node_id = id of the owner node ('' = single node)
+    '''
+    if not node_id: return str(uuid.uuid4())
+    return '%s%s%s' % (node_id, NID_SEPARATOR, uuid.uuid4())
+
+
+def get_nego_owner(nid):
+    '''
+    Returns the id of the owner node encoded in a negotiation id ('' if none)
+
+    Parameters:
+        nid = negotiation id
+    '''
+    if not nid: return ''
+    node_id, sep, _ = nid.partition(NID_SEPARATOR)
+    return node_id if sep else ''
+
+
+def check_node_id(node_id):
+    if node_id and not NODE_ID_PATTERN.match(node_id): raise ValueError('Invalid node id %s' % node_id)
+    return node_id
+
+
+def peek_nego_id(pbuff):
+    '''
+    Returns the id of the negotiation of a protobuff message ('' if none or if the id has no owner node)
+    The raw message is searched for the negotiation id of the seller_data (no parsing).
+    A buyer can only misroute its own messages (negotiation ids are authenticated by the owner node).
+
+    Parameters:
+        pbuff = protobuff message
+    '''
+    match = NID_PATTERN.search(pbuff)
+    return match.group(1) if match else ''
+
+
+'''
+HANDOFF OF NEGOTIATIONS
+Negotiations are transferred between nodes as a sequence of records:
+    header (see HANDOFF_HEADER) | nid | network | serialized chain (see nego_helpers.serialize_nego)
+'''
+def pack_negos(negos):
+    '''
+    Serializes a list of negotiations
+    Returns a string
+
+    Parameters:
+        negos = list of tuples (nid, network, serialized chain)
+    '''
+    return ''.join([HANDOFF_HEADER.pack(len(nid), len(network), len(chain)) + nid + network + chain
+                    for (nid, network, chain) in negos])
+
+
+def unpack_negos(data):
+    '''
+    Parses a list of serialized negotiations
+    Returns a list of tuples (nid, network, serialized chain)
+
+    Parameters:
+        data = string built by pack_negos
+    '''
+    negos = []
+    offset = 0
+    while offset < len(data):
+        nid_len, network_len, chain_len = HANDOFF_HEADER.unpack_from(data, offset)
+        offset += HANDOFF_HEADER.size
+        nid = data[offset:offset + nid_len]
+        offset += nid_len
+        network = data[offset:offset + network_len]
+        offset += network_len
+        chain = data[offset:offset + chain_len]
+        offset += chain_len
+        if len(chain) != chain_len: raise ValueError('Truncated handoff data')
+        negos.append((nid, network, chain))
+    return negos
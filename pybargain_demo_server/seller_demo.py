@@ -1,18 +1,37 @@
 #!/usr/bin/env python
 
-import uuid
+import time
+import json
+import atexit
 from datetime import datetime
-from functools import update_wrapper
-from flask import Flask
+from functools import update_wrapper, partial
+from flask import Flask, g
 from flask.globals import request
 from flask.helpers import make_response, url_for
 from pybargain_protocol.constants import *
 from pybargain_protocol.negotiation import Negotiation
 from pybargain_protocol.bargaining_message import BargainingMessage
-from pybargain_protocol.helpers.bc_api import blockr_sum_unspent_inputs
-from helpers.messages_helpers import check_req_format, get_seller_data, send_msg_sync, SDATA_NEGO_ID
-from services.negotiator_service import NegotiatorService
-from services.nego_db_service import NegoDbService
+from helpers.messages_helpers import check_req_format, get_req_msg_type, SellerDataCodec, send_msg_sync, send_pbuff_sync, send_msg_async, check_callback_uri, compare_tokens, SDATA_NEGO_ID, SDATA_PRODUCT_ID, CALLBACK_URI_HEADER, ADMIN_TOKEN_HEADER
+from helpers.nego_helpers import check_received_msg
+from helpers.lock_helpers import StripedLocks
+from helpers.metrics_helpers import Metrics, REQUEST_METRIC, OUTCOME_METRIC, ERROR_METRIC, REJECT_METRIC
+from helpers.ingestion_helpers import read_msg, REJECT_FORMAT, REJECT_UNKNOWN_PRODUCT, REJECT_UNKNOWN_NEGO, REJECT_CALLBACK, REJECT_DRAINING, REJECT_HANDED_OFF, REJECT_STATUS
+from helpers.profiler_helpers import SamplingProfiler
+from helpers.capture_helpers import CaptureWriter
+from helpers.keystore_helpers import load_secret
+from helpers.routing_helpers import build_nego_id, check_node_id
+from services.negotiator_registry_service import NegotiatorRegistryService
+from services.nego_db_service import MemoryNegoDbService
+from services.executor_nego_db_service import wrap_store
+from services.reaper_service import ReaperService
+from services.utxo_service import UtxoService, BlockrUtxoBackend, StubUtxoBackend
+from services.broadcast_service import BroadcastService, BlockrBroadcaster, RpcBroadcaster, StubBroadcaster
+from services.async_response_service import AsyncResponseService
+from services.signer_service import install_backend
+from services.checker_service import CheckerService
+from services.response_cache_service import ResponseCacheService
+from services.admission_service import AdmissionService
+from services.handoff_service import HandoffService
 
 
 
@@ -20,7 +39,100 @@ from services.nego_db_service import NegoDbService
 CONSTANTS
 '''
 NETWORK = TESTNET
-SUM_UNSPENT_FUNC = blockr_sum_unspent_inputs
+
+# Id of this node encoded in the ids of its negotiations ('' = single node)
+# Set a distinct id per node when several nodes run behind the routing front (see seller_router.py)
+NODE_ID = ''
+# Addresses of routing fronts allowed to set the address of the buyer (X-Forwarded-For header)
+TRUSTED_PROXIES = []
+
+# Keystore of the keys derived by negotiators (None = keys are derived at each start)
+# Created readable by owner only. Use a path outside of the working copy in production.
+KEYSTORE_PATH = 'seller_keys.json'
+# Catalog of products sold by the seller (None = the product of the demo, see negotiator_registry_service)
+CATALOG_PATH = None
+# Secret key of the tokens authenticating negotiation ids in seller data (must be shared by all workers and nodes)
+# None = random secret generated once and kept in SELLER_DATA_SECRET_PATH (readable by owner only)
+SELLER_DATA_SECRET      = None
+SELLER_DATA_SECRET_PATH = 'seller_data.secret'
+# Name of the query parameter selecting the product of a new negotiation (if not set in the seller data)
+PRODUCT_ARG = 'pid'
+# ECDSA backend used to sign messages ('auto', 'coincurve', 'python' or 'default')
+SIGNER_BACKEND = 'auto'
+# Number of processes checking received messages (0 = messages are checked by the request thread)
+CHECKER_NB_PROCESSES = 0
+# Number of locks serializing the processing of messages of a negotiation
+NB_NEGO_LOCKS = 1024
+# Size and time to live (in seconds) of the cache of responses (used to answer retransmitted messages)
+RESPONSE_CACHE_SIZE = 10000
+RESPONSE_CACHE_TTL  = 1200
+
+# Backend providing values of utxos ('blockr' or 'stub' for offline tests)
+UTXO_BACKEND    = 'blockr'
+UTXO_CACHE_SIZE = 100000
+UTXO_CACHE_TTL  = 60
+# Flag indicating if utxos are fetched in background (proposals are marked as undetermined meanwhile)
+UTXO_ASYNC      = False
+
+# Backend broadcasting the transactions of completed negotiations ('blockr', 'rpc' or 'stub' for offline tests)
+BROADCAST_BACKEND      = 'blockr'
+# Json-rpc interface of the bitcoind node used by the 'rpc' backend
+BROADCAST_RPC_URL      = 'http://127.0.0.1:18332'
+BROADCAST_RPC_USER     = ''
+BROADCAST_RPC_PASSWORD = ''
+# Maximum number of transactions per batch, maximum delay (in seconds) waited to fill a batch and retries of a batch
+BROADCAST_BATCH_SIZE   = 50
+BROADCAST_MAX_DELAY    = 0.05
+BROADCAST_MAX_RETRIES  = 5
+
+# Backend used to store negotiations ('memory', 'compact', 'sqlite' or 'sharded')
+# Use 'compact' to reduce the memory used by live negotiations (chains are deserialized on demand)
+# Use 'sqlite' or 'sharded' to run several worker processes
+NEGO_DB_BACKEND = 'memory'
+NEGO_DB_PATH    = 'negos.db'
+NEGO_DB_SHARDS  = 4
+# Flag indicating if sqlite backends only write the messages appended since the last update
+NEGO_DB_APPEND_ONLY = True
+
+# Time to live (in seconds) of negotiations without RequestACK message and of finished negotiations
+NEGO_TTL          = 1200
+NEGO_FINISHED_TTL = 60
+# Period (in seconds) between two removals of finished and expired negotiations
+REAPER_PERIOD     = 30
+
+# Number of workers processing negotiations and sending responses asynchronously
+ASYNC_NB_WORKERS  = 4
+ASYNC_MAX_RETRIES = 5
+# Hosts allowed in callback uris (X-Bargain-Callback header). Empty = any host with a public address
+# (loopback, private and link-local addresses are always refused)
+CALLBACK_ALLOWED_HOSTS = []
+
+# Flag indicating if timers and counters of the processing of messages are collected (see /metrics)
+METRICS_ENABLED   = True
+# Delay (in seconds) between two samples of the profiler (started and stopped at runtime, see /profiler)
+PROFILER_INTERVAL = 0.005
+# Addresses allowed to call admin end points (/profiler, /handoff)
+ADMIN_ADDRS       = ['127.0.0.1', '::1']
+# File of the token authenticating admin requests (X-Admin-Token header, random token generated on first start)
+# Must be shared with the routing front (see seller_router.py)
+ADMIN_TOKEN_PATH  = 'seller_admin.secret'
+# File where the messages received on /bargain and the responses are captured (None = no capture)
+# Captures can be replayed offline (see benchmarks/replay.py)
+CAPTURE_PATH      = None
+
+# Admission control (None = no limit). Rejected requests get a http 429 or 503 before the message is read.
+# Number of new negotiations per second (all clients) and maximum burst
+ADMISSION_RATE          = 200
+ADMISSION_BURST         = 400
+# Number of new negotiations per second and per client address and maximum burst
+ADMISSION_CLIENT_RATE   = 2
+ADMISSION_CLIENT_BURST  = 10
+# Maximum number of requests processed concurrently (any message type)
+ADMISSION_MAX_IN_FLIGHT = 256
+# Maximum number of live negotiations stored in db
+MAX_LIVE_NEGOS          = 100000
+# Delay (in seconds) sent to shed clients (Retry-After header of 503 responses)
+ADMISSION_RETRY_AFTER   = 1
 
 
 '''
@@ -28,11 +140,162 @@ INITIALIZATION
 '''
 # Initializes the flask app
 app = Flask(__name__)
+# Timers and counters of the processing of messages
+metrics = Metrics(METRICS_ENABLED)
+# Sampling profiler (stopped by default)
+profiler = SamplingProfiler(PROFILER_INTERVAL)
+# Capture of exchanges (disabled by default)
+capture = CaptureWriter(CAPTURE_PATH) if CAPTURE_PATH else None
+if not (capture is None): atexit.register(capture.close)
 
 # Initializes services to access databases or services
-# For this toy project we use fake dbs storing data in memory
-nego_db_service = NegoDbService()
-negotiator = NegotiatorService(NETWORK)
+# By default, for this toy project, we use fake dbs storing data in memory
+# Other backends are imported on demand (startup time)
+if NEGO_DB_BACKEND == 'sqlite':
+    from services.sqlite_nego_db_service import SqliteNegoDbService
+    nego_db_service = SqliteNegoDbService(NEGO_DB_PATH, NEGO_DB_APPEND_ONLY, ttl = NEGO_TTL, finished_ttl = NEGO_FINISHED_TTL)
+elif NEGO_DB_BACKEND == 'sharded':
+    from services.sqlite_nego_db_service import SqliteNegoDbService
+    from services.sharded_nego_db_service import ShardedNegoDbService
+    nego_db_service = ShardedNegoDbService([SqliteNegoDbService('%s.%d' % (NEGO_DB_PATH, i), NEGO_DB_APPEND_ONLY,
+                                                                ttl = NEGO_TTL, finished_ttl = NEGO_FINISHED_TTL)
+                                            for i in range(NEGO_DB_SHARDS)])
+elif NEGO_DB_BACKEND == 'compact':
+    from services.compact_nego_db_service import CompactNegoDbService
+    nego_db_service = CompactNegoDbService(NEGO_TTL, NEGO_FINISHED_TTL)
+else:
+    nego_db_service = MemoryNegoDbService(NEGO_TTL, NEGO_FINISHED_TTL)
+nego_db_service.max_live = MAX_LIVE_NEGOS
+# Blocking db accesses are run by a pool of native threads with the cooperative server (see seller_demo_gevent.py)
+if not NEGO_DB_BACKEND in ['memory', 'compact']: nego_db_service = wrap_store(nego_db_service)
+# Computes the sum of unspent inputs of transactions (cached)
+utxo_backend = StubUtxoBackend() if UTXO_BACKEND == 'stub' else BlockrUtxoBackend()
+utxo_service = UtxoService(utxo_backend, UTXO_CACHE_SIZE, UTXO_CACHE_TTL, not UTXO_ASYNC)
+SUM_UNSPENT_FUNC = utxo_service
+# Broadcasts the transactions of completed negotiations in background (batches)
+if BROADCAST_BACKEND == 'stub': broadcaster = StubBroadcaster()
+elif BROADCAST_BACKEND == 'rpc': broadcaster = RpcBroadcaster(BROADCAST_RPC_URL, BROADCAST_RPC_USER, BROADCAST_RPC_PASSWORD)
+else: broadcaster = BlockrBroadcaster()
+broadcast_service = BroadcastService(broadcaster, BROADCAST_BATCH_SIZE, BROADCAST_MAX_DELAY, BROADCAST_MAX_RETRIES)
+broadcast_service.start()
+# Removes finished and expired negotiations in background
+reaper = ReaperService(nego_db_service, REAPER_PERIOD)
+reaper.start()
+# Replaces the ECDSA implementation of pybitcointools by a faster one ('default' if BargainingMessage.sign doesn't use it)
+# The table of the python backend is built by the first signature (see warm_up)
+signer_backend = install_backend(SIGNER_BACKEND)
+# Encodes seller data once per negotiation and authenticates negotiation ids received from buyers
+if not (SELLER_DATA_SECRET or SELLER_DATA_SECRET_PATH): raise ValueError('SELLER_DATA_SECRET or SELLER_DATA_SECRET_PATH must be set')
+seller_data_codec = SellerDataCodec(SELLER_DATA_SECRET or load_secret(SELLER_DATA_SECRET_PATH))
+# Negotiators of products (built on first use)
+registry = NegotiatorRegistryService(NETWORK, CATALOG_PATH, KEYSTORE_PATH, metrics, seller_data_codec)
+# Negotiator of the default product
+negotiator = registry.get_negotiator()
+# Checks received messages (format, signature, consistency)
+checker_service = CheckerService(NETWORK, CHECKER_NB_PROCESSES, metrics)
+# Locks serializing the processing of messages of a negotiation (get, check, append, update)
+nego_locks = StripedLocks(NB_NEGO_LOCKS)
+# Stores the responses sent for received messages
+response_cache = ResponseCacheService(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+# Sheds requests before they're read (rate of new negotiations, concurrent requests, live negotiations)
+admission = AdmissionService(ADMISSION_RATE, ADMISSION_BURST, ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST,
+                             ADMISSION_MAX_IN_FLIGHT, nego_db_service)
+# Token authenticating admin requests
+admin_token = load_secret(ADMIN_TOKEN_PATH).encode('hex')
+# Transfers live negotiations to a peer before shutdown (driven by the routing front)
+handoff = HandoffService(nego_db_service, nego_locks)
+
+
+'''
+ASYNCHRONOUS PROCESSING
+'''
+def broadcast_completion(nego, new_msg):
+    '''
+    Queues the transactions of a COMPLETION message (broadcast in background, retransmissions are deduplicated)
+    '''
+    if new_msg.msg_type == TYPE_BARGAIN_COMPLETION:
+        broadcast_service.submit(new_msg.details.transactions, nego.network)
+
+
+def get_nego_product_id(nego):
+    '''
+    Returns the product id stored in the seller data of the messages of a negotiation ('' = default product)
+    '''
+    for idx in range(nego.length() - 1, -1, -1):
+        pid = seller_data_codec.decode_msg(nego.get_msg_at_idx(idx)).get(SDATA_PRODUCT_ID, '')
+        if pid: return pid
+    return ''
+
+
+def get_stored_reply(nego, msg):
+    '''
+    Returns the reply of the seller to a message already appended to a negotiation
+    Returns a tuple (reply, expected types of next message) or None if the reply isn't the last message of the negotiation
+    '''
+    for idx in range(nego.length() - 2, -1, -1):
+        if nego.get_msg_at_idx(idx).pbuff == msg.pbuff:
+            if idx + 2 != nego.length(): return None
+            return (nego.get_msg_at_idx(idx + 1), nego.get_next_msg_types())
+    return None
+
+
+def process_async(nid, msg, bargain_uri = ''):
+    '''
+    Processes a negotiation outside of the http request thread
+    Returns a tuple (new message, expected types of next message) or None if nothing has to be sent
+    Raises an exception if processing must be retried
+    
+    Parameters:
+        nid         = id of the negotiation
+        msg         = received message which couldn't be validated synchronously (optional)
+        bargain_uri = bargain uri of the seller (built from the http request)
+    '''
+    with nego_locks.get_lock(nid):
+        nego = nego_db_service.get_nego_by_id(nid)
+        if nego is None: return None
+        appended = not (msg is None) and nego.already_received(msg)
+        if appended:
+            # Message appended but not answered yet (ie: previous attempt failed in the negotiator). It's answered below.
+            unanswered = (nego.get_last_msg().pbuff == msg.pbuff) and (nego.get_next_active_role() == ROLE_SELLER)
+            # Retransmission (or message answered by a concurrent request). The stored reply is sent again.
+            if not unanswered: return get_stored_reply(nego, msg)
+        if not (msg is None or appended):
+            # Checks the message again
+            if check_received_msg(nego, msg, NETWORK, SUM_UNSPENT_FUNC) == MSG_STATUS_UND:
+                raise ValueError('Message cannot be validated yet')
+            nego.append(msg)
+            nego_db_service.update_nego(nid, nego)
+        if nego.status in [NEGO_STATUS_COMPLETED, NEGO_STATUS_CANCELLED]: return None
+        # Nothing to do if the last message has already been answered
+        if nego.get_next_active_role() != ROLE_SELLER: return None
+        # Asks negotiator of the product to build the next message
+        negotiator = registry.get_negotiator(get_nego_product_id(nego))
+        if negotiator is None: raise ValueError('Unknown product')
+        if bargain_uri: negotiator.bargain_uri = bargain_uri
+        new_msg = negotiator.process(nego)
+        if new_msg is None: raise ValueError('Negotiator failed to build the next message')
+        nego.append(new_msg)
+        nego_db_service.update_nego(nid, nego)
+        broadcast_completion(nego, new_msg)
+        next_msg_types = nego.get_next_msg_types()
+        # Retransmissions of the received message will get the same response synchronously
+        if not (msg is None): response_cache.set_response(msg.pbuff, new_msg, next_msg_types)
+        return (new_msg, next_msg_types)
+
+async_service = AsyncResponseService(process_async, partial(send_msg_async, allowed_hosts = CALLBACK_ALLOWED_HOSTS),
+                                     nb_workers = ASYNC_NB_WORKERS, max_retries = ASYNC_MAX_RETRIES)
+async_service.start()
+
+# Exposes the stats of services with the metrics
+metrics.add_collector('nego_db', lambda: nego_db_service.get_stats())
+metrics.add_collector('utxo_cache', lambda: utxo_service.get_stats())
+metrics.add_collector('response_cache', lambda: response_cache.get_stats())
+metrics.add_collector('async', lambda: async_service.get_stats())
+metrics.add_collector('broadcast', lambda: broadcast_service.get_stats())
+metrics.add_collector('admission', lambda: admission.get_stats())
+metrics.add_collector('seller_data', lambda: seller_data_codec.get_stats())
+metrics.add_collector('handoff', lambda: handoff.get_stats())
+metrics.add_collector('capture', lambda: capture.get_stats() if capture else {})
 
 
 '''
@@ -50,23 +313,172 @@ def nocache(f):
     return update_wrapper(add_nocache, f)
 
 
+def new_nego_id():
+    '''
+    Returns the id of a new negotiation (replaced by replays of captured traffic)
+    '''
+    return build_nego_id(check_node_id(NODE_ID))
+
+
+def get_client_addr():
+    '''
+    Returns the address of the buyer (set by the routing front if the request has been forwarded)
+    '''
+    if request.remote_addr in TRUSTED_PROXIES:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded: return forwarded.split(',')[-1].strip()
+    return request.remote_addr
+
+
+def is_admin_request(addrs = None):
+    '''
+    Checks if a request can call admin end points (allowed address and valid admin token)
+    The address alone isn't enough (ie: requests sent by the server itself to a forged callback uri)
+    '''
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not request.remote_addr in (addrs or ADMIN_ADDRS): return False
+    try:
+        return compare_tokens(str(token), admin_token)
+    except UnicodeEncodeError:
+        # Non ascii header (can't be a valid token)
+        return False
+
+
+def get_outcome(response, status):
+    '''
+    Returns the outcome of the processing of a message (label of metrics)
+    '''
+    if status == 200: return 'response' if response else 'ack'
+    elif status == 500: return 'error'
+    else: return 'rejected'
+
+
 '''
 END POINTS
 '''
 @app.route('/bargain', methods=['POST'])
 @nocache
 def bargain():
+    # Type of the message (from the http header, only valid types are used as labels)
+    msg_type = get_req_msg_type(request) or 'unknown'
+    # Sheds the request before it's read if the server is saturated
+    reason = admission.admit(get_client_addr(), msg_type)
+    if reason:
+        response, status = reject(msg_type, reason)
+        metrics.incr(OUTCOME_METRIC, (('msg_type', msg_type), ('outcome', 'shed')))
+        return response, status, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    start = time.time()
+    try:
+        response, status = process_bargain_request(msg_type)
+    finally:
+        admission.release()
+    metrics.observe(REQUEST_METRIC, (('msg_type', msg_type),), time.time() - start)
+    metrics.incr(OUTCOME_METRIC, (('msg_type', msg_type), ('outcome', get_outcome(response, status))))
+    # Captures the exchange (only messages which have been read). Failures are counted by the capture.
+    pbuff = getattr(g, 'pbuff', None)
+    if not (capture is None or pbuff is None):
+        capture.write(start, status, msg_type, request.query_string, pbuff, getattr(response, 'data', response))
+    # The buyer retries later (ie: through the routing front once the negotiation has been handed off)
+    if status == 503: return response, status, {'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    return response, status
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    '''
+    Returns the metrics in Prometheus text format
+    '''
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.route('/profiler', methods=['GET', 'POST'])
+def control_profiler():
+    '''
+    Controls the sampling profiler
+        POST ?action=start|stop|reset
+        GET  = returns the samples as collapsed stacks
+    '''
+    if not is_admin_request(): return '', 403
+    if request.method == 'POST':
+        action = request.args.get('action', '')
+        if action == 'start': profiler.start()
+        elif action == 'stop': profiler.stop()
+        elif action == 'reset': profiler.reset()
+        else: return '', 400
+        return '', 200
+    return profiler.get_collapsed_stacks(), 200, {'Content-Type': 'text/plain'}
+
+
+@app.route('/handoff', methods=['POST'])
+def control_handoff():
+    '''
+    Transfers live negotiations between nodes (see handoff_service.py, driven by the routing front)
+        POST ?action=export[&max=n] = returns the exported negotiations
+        POST ?action=import         = stores the negotiations sent in the body, returns the ids of imported negotiations (json)
+        POST ?action=commit         = deletes the exported negotiations listed in the body (json, empty = all)
+        POST ?action=abort
+    '''
+    if not is_admin_request(ADMIN_ADDRS + TRUSTED_PROXIES): return '', 403
+    action = request.args.get('action', '')
+    if action == 'export':
+        data = handoff.export_negos(request.args.get('max', 0, type = int))
+        return data, 200, {'Content-Type': 'application/octet-stream'}
+    elif action == 'import': return json.dumps(handoff.import_negos(request.get_data())), 200
+    elif action == 'commit':
+        # The body lists the negotiations accepted by the peer (empty = all exported negotiations)
+        data = request.get_data()
+        return str(handoff.commit(json.loads(data) if data else None)), 200
+    elif action == 'abort': handoff.abort()
+    else: return '', 400
+    return '', 200
+
+
+def reject(msg_type, reason):
+    '''
+    Rejects a request before the message is parsed
+    Returns a tuple (empty response, http status)
+
+    Parameters:
+        msg_type = type of the message (label of metrics)
+        reason   = reason of the rejection
+    '''
+    metrics.incr(REJECT_METRIC, (('msg_type', msg_type), ('reason', reason)))
+    return '', REJECT_STATUS[reason]
+
+
+def process_bargain_request(msg_type):
+    '''
+    Processes a message received on /bargain
+    Returns a tuple (response, http status)
+
+    Parameters:
+        msg_type = type of the message (label of metrics)
+    '''
+    lock = None
     try:
     
         nego = None
         nid  = ''   
+        negotiator = None
         
         # Checks format of http request
-        if not check_req_format(request): return '', 400
-        # Gets the protobuff message (TODO Checks message size ?)
-        pbuff = request.data
+        if not check_req_format(request): return reject(msg_type, REJECT_FORMAT)
+        # Checks the uri of asynchronous responses (no internal address)
+        callback_uri = request.headers.get(CALLBACK_URI_HEADER, '')
+        bargain_uri = url_for('bargain', _external=True)
+        if callback_uri and not check_callback_uri(callback_uri, CALLBACK_ALLOWED_HOSTS): return reject(msg_type, REJECT_CALLBACK)
+        # Gets the protobuff message (size and type are checked before parsing)
+        pbuff, reason = read_msg(request, msg_type)
+        if reason: return reject(msg_type, reason)
+        g.pbuff = pbuff
+        # Checks if this message has already been answered (retransmission)
+        cached = response_cache.get_response(pbuff)
+        if not (cached is None): return send_pbuff_sync(*cached), 200
         # Deserializes the message
-        msg = BargainingMessage.deserialize(pbuff)
+        with metrics.stage('deserialize', msg_type):
+            msg = BargainingMessage.deserialize(pbuff)
+            # Received bytes (detection of retransmissions, ie: LazyNegotiation.already_received)
+            msg.pbuff = pbuff
         
         '''
         Processes the received message
@@ -75,18 +487,24 @@ def bargain():
             '''
             Let's start a new negotiation
             '''
-            # Checks message format
-            if msg.check_msg_fmt(NETWORK): 
-                # Builds a new negotiation object
-                nid = str(uuid.uuid4())
-                nego = Negotiation(nid, ROLE_SELLER, NETWORK)  
-                # Checks message / negotiation consistency
-                nego.check_consistency(msg)
+            # New negotiations are refused while the node is drained
+            if handoff.draining: return reject(msg_type, REJECT_DRAINING)
+            # Gets the negotiator of the product (from seller data or from the query string)
+            pid = seller_data_codec.decode_msg(msg).get(SDATA_PRODUCT_ID, '') or request.args.get(PRODUCT_ARG, '')
+            negotiator = registry.get_negotiator(pid)
+            if negotiator is None: return reject(msg_type, REJECT_UNKNOWN_PRODUCT)
+            # Builds a new negotiation object
+            nid = new_nego_id()
+            nego = Negotiation(nid, ROLE_SELLER, NETWORK)  
+            # Checks message format (and message / negotiation consistency if valid format)
+            if checker_service.check_msg(nego, msg, pbuff): 
                 # Appends the message to the chain
                 nego.append(msg)
                 # Writes negotiation into db
-                nego_db_service.create_nego(nid, nego)
+                with metrics.stage('db_create', msg_type):
+                    nego_db_service.create_nego(nid, nego)
             else:
+                nego = None
                 # Invalid message format. Sets an error on the message.
                 # It will trigger the sending of a CANCEL message. 
                 msg.log_error("Invalid message format")   
@@ -94,29 +512,40 @@ def bargain():
             '''
             Let's continue an existing negotiation
             '''
-            # Extracts negotiation id from the message
-            sdata = get_seller_data(msg)
+            # Extracts negotiation id from the message (ignored if its token is invalid)
+            sdata = seller_data_codec.decode_msg(msg)
             nid = sdata.get(SDATA_NEGO_ID, '') 
+            # Gets the negotiator of the product
+            negotiator = registry.get_negotiator(sdata.get(SDATA_PRODUCT_ID, ''))
+            if negotiator is None: return reject(msg_type, REJECT_UNKNOWN_PRODUCT)
+            # Serializes the processing of messages of this negotiation (until the response is built)
+            lock = nego_locks.get_lock(nid)
+            lock.acquire()
+            # The negotiation has been transferred to a peer (the buyer retries through the routing front)
+            if handoff.is_exported(nid): return reject(msg_type, REJECT_HANDED_OFF)
             # Gets the negotiation from db
-            nego = nego_db_service.get_nego_by_id(nid)
-            if nego is None: 
-                # Sets an error on the message if nego wasn't found
-                # It will trigger the sending of a CANCEL message. 
-                msg.log_error("Negotiation cannot be found")
+            with metrics.stage('db_get', msg_type):
+                nego = nego_db_service.get_nego_by_id(nid)
+            # Unknown negotiation (expired and reaped, or invalid token in seller data). Nothing can be answered.
+            if nego is None: return reject(msg_type, REJECT_UNKNOWN_NEGO)
+            # Checks message has not already been received
+            # (the response may have been built by a concurrent request processing the same message)
+            if nego.already_received(msg):
+                cached = response_cache.get_response(pbuff)
+                return (send_pbuff_sync(*cached), 200) if cached else ('', 200)
+            if msg.msg_type == TYPE_BARGAIN_PROPOSAL and not utxo_service.is_blocking() \
+               and not utxo_service.is_ready(msg.details.transactions, NETWORK):
+                # Utxos are fetched in background. The message will be checked later.
+                msg.status = MSG_STATUS_UND
             else:
-                # Checks message has not already been received
-                if nego.already_received(msg): return '', 200        
-                # If message is a PROPOSAL, prechecks the transactions
-                if msg.msg_type == TYPE_BARGAIN_PROPOSAL:
-                    last_msg = nego.get_last_msg()
-                    nego.precheck_txs(msg, last_msg, SUM_UNSPENT_FUNC)  
-                # Checks message format (and consistency with negotiation if valid format)
-                if msg.check_msg_fmt(NETWORK): 
-                    nego.check_consistency(msg)    
+                # Checks the message (transactions, format and consistency)
+                checker_service.check_received_msg(nego, msg, pbuff, SUM_UNSPENT_FUNC)
+            if msg.status != MSG_STATUS_UND:
                 # Appends the message to the chain
                 nego.append(msg)
                 # Writes negotiation into db
-                nego_db_service.update_nego(nid, nego)    
+                with metrics.stage('db_update', msg_type):
+                    nego_db_service.update_nego(nid, nego)
         
         '''
         Builds and sends a response
@@ -124,7 +553,13 @@ def bargain():
         # Checks message status
         if msg.status == MSG_STATUS_UND:
             # We were unable to validate the message.
-            # Response will be sent asynchronously (not implemented in demo)
+            # Message will be checked again and response will be sent asynchronously
+            job = lambda: async_service.submit(nid, callback_uri, msg, bargain_uri)
+            if msg.msg_type == TYPE_BARGAIN_PROPOSAL:
+                # Submits the job once utxos are available
+                utxo_service.prefetch(msg.details.transactions, NETWORK, job)
+            else:
+                job()
             return '', 200
         
         # Checks if negotiation has reached a final state
@@ -133,35 +568,65 @@ def bargain():
             return '', 200        
         # Asks negotiator to build the next message (applying a very basic strategy)
         if not (nego is None):
-            negotiator.bargain_uri = url_for('bargain', _external=True) 
-            new_msg = negotiator.process(nego) 
+            negotiator.bargain_uri = bargain_uri
+            with metrics.stage('process', msg_type):
+                new_msg = negotiator.process(nego)
             if not (new_msg is None):
                 # Appends the new message to the chain
                 nego.append(new_msg)
-                nego_db_service.update_nego(nid, nego)             
+                with metrics.stage('db_update', msg_type):
+                    nego_db_service.update_nego(nid, nego)
+                broadcast_completion(nego, new_msg)
                 # Sends the new message as a http response
                 next_msg_types = nego.get_next_msg_types()
+                response_cache.set_response(pbuff, new_msg, next_msg_types)
                 response = send_msg_sync(new_msg, next_msg_types)
                 return response, 200
             else:
                 # Something went wrong on our side
-                # Returns an http ack for now. Response will be sent asynchronously (not implemented in demo)
+                # Returns an http ack for now. Response will be sent asynchronously
+                async_service.submit(nid, callback_uri, bargain_uri = bargain_uri)
                 return '', 200
         else:
             # Something went wrong on our side. We don't find the negotiation
             return '', 400
         
-        '''
-        Cleaning (for demo purpose)
-        '''
-        # Removes completed negos from memory
-        if nego.status in [NEGO_STATUS_COMPLETED, NEGO_STATUS_CANCELLED]:
-            nego_db_service.delete_nego(nid)
+        # Note: Completed and cancelled negos are removed from db by the reaper
+        # once NEGO_FINISHED_TTL is elapsed (allows the processing of retransmitted messages)
     
     except Exception, e:
+        # Counts errors by class and logs them (the buyer only gets a http 500)
+        metrics.incr(ERROR_METRIC, (('error', e.__class__.__name__),))
+        app.logger.exception('Error while processing a %s message' % msg_type)
         return '', 500
+    finally:
+        if not (lock is None): lock.release()
+
+'''
+WARM UP
+'''
+def warm_up():
+    '''
+    Primes the lazy initializations paid by the first requests (url map, message classes, signature, flask)
+    Must be called before the worker takes traffic (ie: post_fork hook of gunicorn)
+    Returns a dictionary of durations (in seconds) per step
+    '''
+    def build_url():
+        with app.test_request_context():
+            url_for('bargain', _external=True)
+    steps = [('url_map', build_url),
+             ('messages', negotiator.warm_up),
+             ('flask', lambda: app.test_client().get('/metrics'))]
+    timings = dict()
+    for (name, func) in steps:
+        start = time.time()
+        func()
+        timings[name] = time.time() - start
+    return timings
+
 
 if __name__ == '__main__':
+    warm_up()
     # Comment/uncomment following lines to switch "production" / debug mode
     #app.run(host='0.0.0.0', port=8082)
     app.run(debug=True, port=8082)
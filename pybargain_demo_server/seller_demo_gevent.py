@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+'''
+Cooperative entry point of the seller server (gevent)
+
+Serves the same flask app as seller_demo.py (same /bargain protocol, headers and checks)
+with a gevent server: each in-flight negotiation is a greenlet instead of a thread.
+    - network accesses (ie: lookups of utxos) yield to other greenlets (monkey patching)
+    - signatures and accesses to sqlite dbs are run by a pool of native threads
+'''
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPool
+from services.executor_nego_db_service import set_default_executor
+
+
+
+'''
+CONSTANTS
+'''
+PORT = 8082
+# Number of native threads computing signatures and accessing dbs
+NB_EXECUTOR_THREADS = 4
+
+
+'''
+INITIALIZATION
+'''
+executor = ThreadPool(NB_EXECUTOR_THREADS)
+# The store must be wrapped before seller_demo passes it to other services (reaper, admission control, handoff)
+set_default_executor(executor)
+import seller_demo
+seller_demo.registry.set_sign_executor(executor)
+app = seller_demo.app
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    seller_demo.warm_up()
+    # Comment/uncomment following lines to switch "production" / local mode
+    #server = WSGIServer(('0.0.0.0', port), app)
+    server = WSGIServer(('127.0.0.1', port), app, log = None)
+    server.serve_forever()
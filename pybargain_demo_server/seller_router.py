@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Routing front of several seller nodes (see seller_demo.py)
+
+Each node holds its live negotiations in memory and encodes its id in the ids of its negotiations (NODE_ID).
+The front reads the negotiation id of each message (without parsing it) and:
+    - forwards the message to the node owning the negotiation (ROUTING_MODE = 'forward')
+    - or redirects the buyer to this node with a 307 (ROUTING_MODE = 'redirect')
+New negotiations are spread over the active nodes.
+
+Before a node is stopped, POST /drain?node=<id> transfers its live negotiations to the other nodes
+(see handoff_service.py). Buyers retry messages rejected with a 503 during the transfer.
+
+Usage (from pybargain_demo_server directory):
+    python seller_router.py [port] node_id=uri [node_id=uri ...]   (ie: a=http://127.0.0.1:8091)
+'''
+import sys
+import json
+from flask import Flask
+from flask.globals import request
+from helpers.messages_helpers import get_req_msg_type, compare_tokens, ADMIN_TOKEN_HEADER
+from helpers.ingestion_helpers import read_msg, REJECT_STATUS
+from helpers.routing_helpers import peek_nego_id
+from helpers.keystore_helpers import load_secret
+from services.router_service import RouterService
+
+
+
+'''
+CONSTANTS
+'''
+PORT = 8090
+# Routing mode ('forward' or 'redirect')
+ROUTING_MODE = RouterService.FORWARD
+# Addresses allowed to drain nodes
+ADMIN_ADDRS = ['127.0.0.1', '::1']
+# File of the token authenticating admin requests (X-Admin-Token header), shared with the nodes (see seller_demo.py)
+ADMIN_TOKEN_PATH = 'seller_admin.secret'
+# Http headers of buyers forwarded to nodes (Host is kept so that nodes build uris of the front)
+FORWARDED_HEADERS = ['Content-Type', 'Content-Transfer-Encoding', 'Accept', 'X-Bargain-Callback', 'Host']
+# Http headers of nodes sent back to buyers
+RETURNED_HEADERS = ['Content-Type', 'Content-Transfer-Encoding', 'Retry-After']
+
+
+'''
+INITIALIZATION
+'''
+app = Flask(__name__)
+admin_token = load_secret(ADMIN_TOKEN_PATH).encode('hex')
+router = RouterService(mode = ROUTING_MODE, admin_token = admin_token)
+
+
+'''
+END POINTS
+'''
+@app.route('/bargain', methods=['POST'])
+def bargain():
+    msg_type = get_req_msg_type(request)
+    pbuff, reason = read_msg(request, msg_type)
+    if reason: return '', REJECT_STATUS[reason]
+    node_id = router.route(peek_nego_id(pbuff))
+    if node_id is None: return '', 503
+    if router.mode == RouterService.REDIRECT:
+        return '', 307, {'Location': router.get_uri(node_id, '/bargain', request.query_string)}
+    headers = dict([(h, request.headers[h]) for h in FORWARDED_HEADERS if h in request.headers])
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    headers['X-Forwarded-For'] = '%s, %s' % (forwarded, request.remote_addr) if forwarded else request.remote_addr
+    status, body, resp_headers = router.forward(node_id, pbuff, headers, request.query_string)
+    resp_headers = dict([(h, v) for (h, v) in resp_headers.items() if h.title() in RETURNED_HEADERS])
+    return body, status, resp_headers
+
+
+@app.route('/drain', methods=['POST'])
+def drain():
+    '''
+    Transfers the live negotiations of a node to the other nodes
+        POST ?node=<id> = returns the numbers of negotiations transferred per peer (json)
+    '''
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not request.remote_addr in ADMIN_ADDRS: return '', 403
+    try:
+        if not compare_tokens(str(token), admin_token): return '', 403
+    except UnicodeEncodeError:
+        # Non ascii header (can't be a valid token)
+        return '', 403
+    try:
+        transferred = router.drain(request.args.get('node', ''))
+    except ValueError, e:
+        return str(e), 400
+    return json.dumps(transferred), 200, {'Content-Type': 'application/json'}
+
+
+@app.route('/nodes', methods=['GET'])
+def get_nodes():
+    '''
+    Returns the nodes and the counters of the front (json)
+    '''
+    return json.dumps({'nodes': router.get_nodes(), 'stats': router.get_stats()}), 200, {'Content-Type': 'application/json'}
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    port = int(args.pop(0)) if args and not '=' in args[0] else PORT
+    for arg in args:
+        node_id, uri = arg.split('=', 1)
+        router.add_node(node_id, uri)
+    app.run(port = port, threaded = True)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+'''
+A class deciding if a request is processed or shed (admission control)
+Decisions are taken from the http headers (client address, message type), before the message is read.
+
+    - requests are shed when too many requests are processed concurrently (any message type)
+    - new negotiations (BargainingRequest) are limited by a token bucket per client and by a global token bucket
+    - new negotiations are refused when the store holds too many live negotiations (see NegoDbService.max_live)
+
+Messages of existing negotiations are not rate limited (buyers would be unable to complete their negotiations).
+'''
+import time
+import threading
+from pybargain_protocol.constants import *
+from helpers.cache_helpers import LruCache
+from helpers.ingestion_helpers import REJECT_OVERLOADED, REJECT_CLIENT_RATE, REJECT_GLOBAL_RATE, REJECT_LIVE_LIMIT
+
+
+
+class TokenBucket(object):
+    '''
+    A token bucket refilled at a constant rate
+    '''
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    '''
+    ATTRIBUTES
+
+    rate   = number of tokens added per second
+    burst  = maximum number of tokens
+    tokens = number of available tokens
+    stamp  = time of the last refill
+    '''
+
+    def __init__(self, rate, burst, now):
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = float(burst)
+        self.stamp  = now
+
+    def take(self, now):
+        '''
+        Takes a token if one is available
+        Returns True if a token has been taken
+
+        Parameters:
+            now = current time
+        '''
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp  = now
+        if self.tokens < 1: return False
+        self.tokens -= 1
+        return True
+
+
+
+class AdmissionService(object):
+
+    '''
+    CONSTANTS
+    '''
+    # Default maximum number of clients tracked (least recently seen clients are forgotten first)
+    DEFAULT_MAX_CLIENTS  = 100000
+    # Default period (in seconds) between two checks of the number of live negotiations
+    DEFAULT_LIVE_REFRESH = 0.5
+
+    '''
+    ATTRIBUTES
+
+    _rate          = number of new negotiations per second (all clients). None = no limit
+    _client_rate   = number of new negotiations per second and per client. None = no limit
+    _client_burst  = maximum burst of new negotiations per client
+    _max_in_flight = maximum number of requests processed concurrently. None = no limit
+    _store         = NegoDbService checked for the limit of live negotiations (None = no limit)
+    _live_refresh  = period (in seconds) between two checks of the number of live negotiations
+    _bucket        = global TokenBucket
+    _clients       = LruCache of TokenBucket indexed by client address
+    _in_flight     = number of requests being processed
+    _full          = flag indicating if the store is full (last check)
+    _full_checked  = time of the last check of the store
+    _admitted      = number of admitted requests
+    _rejected      = dictionary of numbers of rejected requests indexed by reason
+    _lock          = lock protecting buckets and counters
+    '''
+
+    def __init__(self, rate = None, burst = 0, client_rate = None, client_burst = 0, max_in_flight = None,
+                 store = None, max_clients = DEFAULT_MAX_CLIENTS, live_refresh = DEFAULT_LIVE_REFRESH):
+        '''
+        Constructor
+
+        Parameters:
+            rate          = number of new negotiations per second (all clients). None = no limit
+            burst         = maximum burst of new negotiations (all clients)
+            client_rate   = number of new negotiations per second and per client. None = no limit
+            client_burst  = maximum burst of new negotiations per client
+            max_in_flight = maximum number of requests processed concurrently. None = no limit
+            store         = NegoDbService checked for the limit of live negotiations (None = no limit)
+            max_clients   = maximum number of clients tracked
+            live_refresh  = period (in seconds) between two checks of the number of live negotiations
+        '''
+        now = time.time()
+        self._rate          = rate
+        self._client_rate   = client_rate
+        self._client_burst  = max(1, client_burst)
+        self._max_in_flight = max_in_flight
+        self._store         = store
+        self._live_refresh  = live_refresh
+        self._bucket        = None if rate is None else TokenBucket(rate, max(1, burst), now)
+        self._clients       = LruCache(max_clients)
+        self._in_flight     = 0
+        self._full          = False
+        self._full_checked  = 0
+        self._admitted      = 0
+        self._rejected      = dict()
+        self._lock          = threading.Lock()
+
+    def admit(self, client, msg_type):
+        '''
+        Decides if a request is processed
+        Returns None if the request is admitted (release() must be called once it's processed)
+        or the reason of the rejection
+
+        Parameters:
+            client   = address of the client
+            msg_type = type of the message (from Content-Type header)
+        '''
+        now = time.time()
+        if msg_type == TYPE_BARGAIN_REQUEST: self._refresh_full(now)
+        with self._lock:
+            reason = self._check(client, msg_type, now)
+            if reason:
+                self._rejected[reason] = self._rejected.get(reason, 0) + 1
+            else:
+                self._in_flight += 1
+                self._admitted  += 1
+            return reason
+
+    def release(self):
+        '''
+        Signals the end of the processing of an admitted request
+        '''
+        with self._lock:
+            self._in_flight -= 1
+
+    def get_stats(self):
+        '''
+        Gets counters about admission control
+            admitted      = number of admitted requests
+            in_flight     = number of requests being processed
+            clients       = number of clients tracked
+            full          = 1 if the store is full (last check)
+            rejected_xxx  = number of requests rejected for reason xxx
+        '''
+        with self._lock:
+            stats = {'admitted' : self._admitted,
+                     'in_flight': self._in_flight,
+                     'clients'  : len(self._clients),
+                     'full'     : int(self._full)}
+            for (reason, count) in self._rejected.items(): stats['rejected_' + reason] = count
+            return stats
+
+    def _check(self, client, msg_type, now):
+        if not (self._max_in_flight is None) and self._in_flight >= self._max_in_flight: return REJECT_OVERLOADED
+        if msg_type != TYPE_BARGAIN_REQUEST: return None
+        # Per client limit is checked first (a flooding client doesn't consume global tokens)
+        if not (self._client_rate is None):
+            bucket = self._clients.get(client)
+            if bucket is None:
+                bucket = TokenBucket(self._client_rate, self._client_burst, now)
+                self._clients.set(client, bucket)
+            if not bucket.take(now): return REJECT_CLIENT_RATE
+        if self._full: return REJECT_LIVE_LIMIT
+        if not (self._bucket is None) and not self._bucket.take(now): return REJECT_GLOBAL_RATE
+        return None
+
+    def _refresh_full(self, now):
+        # The number of live negotiations is checked periodically (counting may be expensive, ie: sqlite)
+        # The store is queried without holding the lock (admission of other requests isn't blocked).
+        # Only one thread queries the store, others use the result of the last check meanwhile.
+        if self._store is None: return
+        with self._lock:
+            if now - self._full_checked < self._live_refresh: return
+            self._full_checked = now
+        full = self._store.is_full()
+        with self._lock:
+            self._full = full
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''
+A class processing negotiations outside of http request threads and sending responses asynchronously
+(ie: messages which couldn't be validated synchronously or negotiator failures)
+
+Jobs are dispatched over a pool of workers. All jobs of a negotiation are processed by the same worker
+so that messages of a negotiation are processed (and sent) in order.
+Processing and sending are retried with an exponential backoff. A job waiting for a retry is kept in a heap
+of delayed jobs of its worker (the worker processes other negotiations meanwhile). Following jobs of the same
+negotiation are held until it's done.
+'''
+import time
+import zlib
+import heapq
+import threading
+from Queue import Queue, Empty
+from helpers.messages_helpers import send_msg_async
+
+
+class AsyncResponseService(object):
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_NB_WORKERS  = 4
+    DEFAULT_MAX_RETRIES = 5
+    # Delay (in seconds) before the first retry (doubled after each retry)
+    DEFAULT_BACKOFF     = 0.5
+
+    '''
+    ATTRIBUTES
+
+    _process_func = function(nid, msg, bargain_uri) processing a negotiation.
+                    Returns a tuple (message to send, expected types of next message) or None if nothing has to be sent.
+                    Raises an exception if processing must be retried.
+    _send_func    = function(msg, next_msg_types, uri) sending a message
+    _max_retries  = maximum number of retries of processing and sending
+    _backoff      = delay (in seconds) before the first retry
+    _queues       = list of job queues (one per worker)
+    _threads      = list of workers
+    _nb_delayed   = number of jobs waiting for a retry or held behind a retried job
+    _counters     = dictionary of counters
+    _lock         = lock protecting the counters
+    '''
+
+    def __init__(self, process_func, send_func = send_msg_async, nb_workers = DEFAULT_NB_WORKERS,
+                 max_retries = DEFAULT_MAX_RETRIES, backoff = DEFAULT_BACKOFF):
+        '''
+        Constructor
+
+        Parameters:
+            process_func = function(nid, msg, bargain_uri) processing a negotiation
+            send_func    = function(msg, next_msg_types, uri) sending a message
+            nb_workers   = number of workers
+            max_retries  = maximum number of retries of processing and sending
+            backoff      = delay (in seconds) before the first retry
+        '''
+        self._process_func = process_func
+        self._send_func    = send_func
+        self._max_retries  = max_retries
+        self._backoff      = backoff
+        self._queues       = [Queue() for i in range(nb_workers)]
+        self._threads      = []
+        self._nb_delayed   = 0
+        self._counters     = dict([(k, 0) for k in ['submitted', 'processed', 'sent', 'retries', 'failed', 'undeliverable']])
+        self._lock         = threading.Lock()
+
+    def start(self):
+        '''
+        Starts the workers
+        '''
+        if self._threads: return
+        for (i, queue) in enumerate(self._queues):
+            thread = threading.Thread(target = self._run, args = (queue,), name = 'async-response-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        '''
+        Stops the workers once pending jobs have been processed
+        '''
+        for queue in self._queues: queue.put(None)
+        for thread in self._threads: thread.join()
+        self._threads = []
+
+    def submit(self, nid, callback_uri, msg = None, bargain_uri = ''):
+        '''
+        Submits a job
+
+        Parameters:
+            nid          = id of the negotiation
+            callback_uri = uri where the response is sent
+            msg          = received message to check and append to the negotiation (optional)
+            bargain_uri  = bargain uri of the seller (built from the http request)
+        '''
+        self._incr('submitted')
+        self._queues[(zlib.crc32(str(nid)) & 0xffffffff) % len(self._queues)].put((nid, callback_uri, msg, bargain_uri))
+
+    def get_nb_pending(self):
+        '''
+        Gets the number of pending jobs
+        '''
+        return sum([q.qsize() for q in self._queues]) + self._nb_delayed
+
+    def get_stats(self):
+        '''
+        Gets counters about jobs
+        '''
+        with self._lock:
+            stats = dict(self._counters)
+        stats['pending'] = self.get_nb_pending()
+        return stats
+
+    def _run(self, queue):
+        # Jobs waiting for a retry (heap of (due time, sequence number, job)) and lists of jobs held behind them
+        # indexed by negotiation id. Both are only accessed by this worker.
+        delayed, held = [], dict()
+        seq, stopping = 0, False
+        while True:
+            if delayed and delayed[0][0] <= time.time():
+                job = heapq.heappop(delayed)[2]
+                self._add_delayed(-1)
+            elif stopping:
+                # Pending retries are processed before the worker stops
+                if not delayed: return
+                time.sleep(max(0, delayed[0][0] - time.time()))
+                continue
+            else:
+                try:
+                    job = queue.get(True, max(0, delayed[0][0] - time.time())) if delayed else queue.get()
+                except Empty:
+                    continue
+                if job is None:
+                    stopping = True
+                    continue
+                job = list(job) + [None, 0]
+                if job[0] in held:
+                    held[job[0]].append(job)
+                    self._add_delayed(1)
+                    continue
+            delay = self._process(job)
+            nid = job[0]
+            if not (delay is None):
+                held.setdefault(nid, [])
+                heapq.heappush(delayed, (time.time() + delay, seq, job))
+                seq += 1
+                self._add_delayed(1)
+            elif nid in held:
+                # Releases the next job of the negotiation (processed without delay)
+                if held[nid]:
+                    heapq.heappush(delayed, (0, seq, held[nid].pop(0)))
+                    seq += 1
+                else:
+                    del held[nid]
+
+    def _process(self, job):
+        '''
+        Processes a job and sends its response
+        Returns the delay (in seconds) before the job is retried (None = job done or failed)
+
+        Parameters:
+            job = list (nid, callback_uri, msg, bargain_uri, response (None = not processed yet), number of retries)
+        '''
+        nid, callback_uri, msg, bargain_uri, response, nb_retries = job
+        try:
+            if response is None:
+                response = self._process_func(nid, msg, bargain_uri)
+                self._incr('processed')
+                if response is None: return None
+                if not callback_uri:
+                    self._incr('undeliverable')
+                    return None
+                # Sending is retried independently of processing
+                job[4], job[5] = response, 0
+                nb_retries = 0
+            new_msg, next_msg_types = response
+            self._send_func(new_msg, next_msg_types, callback_uri)
+            self._incr('sent')
+            return None
+        except Exception:
+            if nb_retries >= self._max_retries:
+                self._incr('failed')
+                return None
+            self._incr('retries')
+            job[5] = nb_retries + 1
+            return self._backoff * (2 ** nb_retries)
+
+    def _add_delayed(self, value):
+        with self._lock:
+            self._nb_delayed += value
+
+    def _incr(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
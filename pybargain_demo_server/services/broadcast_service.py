@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+'''
+A class broadcasting the transactions of completed negotiations (outside of http request threads)
+
+Transactions are broadcast by a pluggable backend:
+    - BlockrBroadcaster = transactions pushed to blockr.io (one query per transaction)
+    - RpcBroadcaster    = transactions sent to a bitcoind node (one json-rpc batch query per batch)
+    - StubBroadcaster   = local stub (offline tests and load benchmarks)
+
+Transactions are deduplicated (retransmitted COMPLETION messages, transactions shared by negotiations),
+queued and broadcast in batches by a background thread. Batches are retried with an exponential backoff.
+'''
+import json
+import time
+import random
+import hashlib
+import threading
+from Queue import Queue, Empty
+from pybargain_protocol.constants import TESTNET
+from helpers.cache_helpers import LruCache
+
+
+
+class Broadcaster(object):
+    '''
+    Interface of a backend broadcasting transactions
+    '''
+
+    def broadcast(self, txs, network):
+        '''
+        Broadcasts a batch of transactions
+        Returns a dictionary of flags indexed by transaction (False = transaction rejected by the network, not retried)
+        Raises an exception if the batch must be retried (ie: backend unreachable)
+
+        Parameters:
+            txs     = list of transactions (hex)
+            network = network
+        '''
+        raise NotImplementedError()
+
+
+
+class BlockrBroadcaster(Broadcaster):
+    '''
+    Pushes transactions to blockr.io (the api accepts a single transaction per query)
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    API_URLS    = {TESTNET: 'http://tbtc.blockr.io/api/v1/tx/push'}
+    DEFAULT_URL = 'http://btc.blockr.io/api/v1/tx/push'
+    TIMEOUT     = 10
+
+    def broadcast(self, txs, network):
+        # Imported on demand (startup time of workers using another backend)
+        import urllib2
+        url = BlockrBroadcaster.API_URLS.get(network, BlockrBroadcaster.DEFAULT_URL)
+        res = dict()
+        for tx in txs:
+            req = urllib2.Request(url, json.dumps({'hex': tx}), {'Content-Type': 'application/json'})
+            try:
+                resp = json.load(urllib2.urlopen(req, timeout = BlockrBroadcaster.TIMEOUT))
+                res[tx] = resp.get('status', '') == 'success'
+            except urllib2.HTTPError, e:
+                # Transaction rejected (invalid or already spent). Server errors are retried.
+                if e.code >= 500: raise
+                res[tx] = False
+        return res
+
+
+
+class RpcBroadcaster(Broadcaster):
+    '''
+    Sends transactions to a bitcoind node (sendrawtransaction, one json-rpc batch query per batch)
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    TIMEOUT = 10
+    # Error code returned for transactions already in the blockchain (considered as broadcast)
+    RPC_VERIFY_ALREADY_IN_CHAIN = -27
+
+    '''
+    ATTRIBUTES
+
+    _url     = url of the json-rpc interface of the node (ie: http://127.0.0.1:18332)
+    _headers = http headers of queries (authentication)
+    '''
+
+    def __init__(self, url, user = '', password = ''):
+        '''
+        Constructor
+
+        Parameters:
+            url      = url of the json-rpc interface of the node
+            user     = rpc user
+            password = rpc password
+        '''
+        self._url     = url
+        self._headers = {'Content-Type': 'application/json'}
+        if user: self._headers['Authorization'] = 'Basic ' + ('%s:%s' % (user, password)).encode('base64').strip()
+
+    def broadcast(self, txs, network):
+        import urllib2
+        query = [{'jsonrpc': '1.0', 'id': i, 'method': 'sendrawtransaction', 'params': [tx]} for (i, tx) in enumerate(txs)]
+        req = urllib2.Request(self._url, json.dumps(query), self._headers)
+        resp = json.load(urllib2.urlopen(req, timeout = RpcBroadcaster.TIMEOUT))
+        res = dict([(tx, False) for tx in txs])
+        for r in resp:
+            error = r.get('error', None)
+            res[txs[r['id']]] = (error is None) or (error.get('code', 0) == RpcBroadcaster.RPC_VERIFY_ALREADY_IN_CHAIN)
+        return res
+
+
+
+class StubBroadcaster(Broadcaster):
+    '''
+    Local stub accepting every transaction
+    '''
+
+    '''
+    ATTRIBUTES
+
+    nb_batches    = number of batches received by the backend
+    times         = dictionary of times of broadcast indexed by transaction
+
+    _latency      = simulated latency (in seconds) of a batch
+    _failure_rate = ratio of batches failing (retried by the service)
+    _random       = random generator (failures)
+    _lock         = lock protecting the counters
+    '''
+
+    def __init__(self, latency = 0, failure_rate = 0, seed = 0):
+        '''
+        Constructor
+
+        Parameters:
+            latency      = simulated latency (in seconds) of a batch
+            failure_rate = ratio of batches failing
+            seed         = seed of the random generator
+        '''
+        self.nb_batches    = 0
+        self.times         = dict()
+        self._latency      = latency
+        self._failure_rate = failure_rate
+        self._random       = random.Random(seed)
+        self._lock         = threading.Lock()
+
+    def broadcast(self, txs, network):
+        if self._latency: time.sleep(self._latency)
+        with self._lock:
+            self.nb_batches += 1
+            if self._random.random() < self._failure_rate: raise IOError('Simulated failure')
+            now = time.time()
+            for tx in txs: self.times.setdefault(tx, now)
+        return dict([(tx, True) for tx in txs])
+
+
+
+class BroadcastService(object):
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_BATCH_SIZE  = 50
+    # Maximum delay (in seconds) waited to fill a batch
+    DEFAULT_MAX_DELAY   = 0.05
+    DEFAULT_MAX_RETRIES = 5
+    # Delay (in seconds) before the first retry (doubled after each retry)
+    DEFAULT_BACKOFF     = 0.5
+    # Number of transactions remembered to detect duplicates
+    DEFAULT_DEDUP_SIZE  = 100000
+
+    '''
+    ATTRIBUTES
+
+    _broadcaster = Broadcaster
+    _batch_size  = maximum number of transactions per batch
+    _max_delay   = maximum delay (in seconds) waited to fill a batch
+    _max_retries = maximum number of retries of a batch
+    _backoff     = delay (in seconds) before the first retry
+    _seen        = LruCache of transactions already submitted indexed by (network, hash of transaction)
+    _queue       = queue of transactions to broadcast (network, transaction, time of submission)
+    _thread      = background thread broadcasting batches
+    _counters    = dictionary of counters
+    _lock        = lock protecting the counters and the detection of duplicates
+    '''
+
+    def __init__(self, broadcaster, batch_size = DEFAULT_BATCH_SIZE, max_delay = DEFAULT_MAX_DELAY,
+                 max_retries = DEFAULT_MAX_RETRIES, backoff = DEFAULT_BACKOFF, dedup_size = DEFAULT_DEDUP_SIZE):
+        '''
+        Constructor
+
+        Parameters:
+            broadcaster = Broadcaster
+            batch_size  = maximum number of transactions per batch
+            max_delay   = maximum delay (in seconds) waited to fill a batch
+            max_retries = maximum number of retries of a batch
+            backoff     = delay (in seconds) before the first retry
+            dedup_size  = number of transactions remembered to detect duplicates
+        '''
+        self._broadcaster = broadcaster
+        self._batch_size  = batch_size
+        self._max_delay   = max_delay
+        self._max_retries = max_retries
+        self._backoff     = backoff
+        self._seen        = LruCache(dedup_size)
+        self._queue       = Queue()
+        self._thread      = None
+        self._counters    = dict([(k, 0) for k in ['submitted', 'duplicates', 'batches', 'broadcast', 'rejected',
+                                                   'retries', 'failed', 'latency_sum', 'latency_max']])
+        self._lock        = threading.Lock()
+
+    def start(self):
+        '''
+        Starts the background thread
+        '''
+        if not (self._thread is None) and self._thread.is_alive(): return
+        self._thread = threading.Thread(target = self._run, name = 'broadcast')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the background thread once pending transactions have been broadcast
+        '''
+        if self._thread is None: return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, txs, network):
+        '''
+        Queues transactions (never blocks)
+        Returns the number of transactions queued (duplicates are ignored)
+
+        Parameters:
+            txs     = list of transactions (hex)
+            network = network
+        '''
+        now = time.time()
+        nb_queued = 0
+        for tx in txs:
+            key = (network, hashlib.sha256(tx).digest())
+            with self._lock:
+                if self._seen.contains(key):
+                    self._counters['duplicates'] += 1
+                    continue
+                self._seen.set(key, True)
+                self._counters['submitted'] += 1
+            self._queue.put((network, tx, now))
+            nb_queued += 1
+        return nb_queued
+
+    def get_nb_pending(self):
+        '''
+        Gets the number of transactions waiting to be broadcast
+        '''
+        return self._queue.qsize()
+
+    def get_stats(self):
+        '''
+        Gets counters about broadcasts (latencies in seconds, from submission to broadcast)
+        '''
+        with self._lock:
+            stats = dict(self._counters)
+        stats['pending'] = self.get_nb_pending()
+        stats['latency_mean'] = stats['latency_sum'] / stats['broadcast'] if stats['broadcast'] else 0
+        return stats
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None: return
+            # Waits for more transactions to fill the batch (at most max_delay)
+            jobs = [job]
+            deadline = time.time() + self._max_delay
+            stop = False
+            try:
+                while len(jobs) < self._batch_size:
+                    job = self._queue.get(True, max(0, deadline - time.time())) if self._max_delay else self._queue.get_nowait()
+                    if job is None:
+                        stop = True
+                        break
+                    jobs.append(job)
+            except Empty:
+                pass
+            for network in set([j[0] for j in jobs]):
+                self._broadcast([j for j in jobs if j[0] == network], network)
+            if stop: return
+
+    def _broadcast(self, jobs, network):
+        '''
+        Broadcasts a batch of transactions (retried with an exponential backoff)
+        '''
+        txs = [tx for (_, tx, _) in jobs]
+        delay = self._backoff
+        for i in range(self._max_retries + 1):
+            try:
+                res = self._broadcaster.broadcast(txs, network)
+                break
+            except Exception:
+                if i == self._max_retries:
+                    # Failed transactions can be submitted again
+                    keys = [(network, hashlib.sha256(tx).digest()) for tx in txs]
+                    with self._lock:
+                        for key in keys: self._seen.delete(key)
+                    self._incr('failed', len(txs))
+                    return
+                self._incr('retries')
+                time.sleep(delay)
+                delay *= 2
+        now = time.time()
+        with self._lock:
+            self._counters['batches'] += 1
+            for (_, tx, submitted) in jobs:
+                if res.get(tx, False):
+                    latency = now - submitted
+                    self._counters['broadcast'] += 1
+                    self._counters['latency_sum'] += latency
+                    self._counters['latency_max'] = max(self._counters['latency_max'], latency)
+                else:
+                    self._counters['rejected'] += 1
+
+    def _incr(self, counter, value = 1):
+        with self._lock:
+            self._counters[counter] += value
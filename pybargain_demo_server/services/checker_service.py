@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+'''
+A class checking the format of received messages and their consistency with negotiations
+(including the verification of signatures).
+
+These checks are CPU bound. They can be run by a pool of processes so that concurrent requests
+are checked in parallel. A worker process only receives the message and what the check of consistency needs:
+the last message of the negotiation (signatures are chained to it), the status and the network of the negotiation.
+The size of a job doesn't depend on the length of the negotiation.
+The worker returns the result of its parsing and checks (format ok, status and errors of the message),
+which is applied on the message of the calling process. Negotiations are never modified by worker processes.
+'''
+import os
+import threading
+from pybargain_protocol.constants import *
+from pybargain_protocol.negotiation import Negotiation
+from helpers.nego_helpers import serialize_nego, deserialize_nego, deserialize_msg, check_msg_fmt_and_consistency
+from helpers.metrics_helpers import NO_METRICS
+
+
+class CheckerService(object):
+
+    '''
+    ATTRIBUTES
+
+    _network      = network used for negotiations
+    _metrics      = Metrics timing the checks
+    _nb_processes = number of worker processes (0 = messages are checked in the calling thread)
+    _pool         = pool of worker processes
+    _pid          = id of the process which has created the pool
+    _lock         = lock protecting the creation of the pool
+    '''
+
+    def __init__(self, network, nb_processes = 0, metrics = NO_METRICS):
+        '''
+        Constructor
+
+        Parameters:
+            network      = network used for negotiations
+            nb_processes = number of worker processes (0 = messages are checked in the calling thread)
+            metrics      = Metrics timing the checks
+        '''
+        self._network      = network
+        self._metrics      = metrics
+        self._nb_processes = nb_processes
+        self._pool         = None
+        self._pid          = None
+        self._lock         = threading.Lock()
+
+    def check_received_msg(self, nego, msg, pbuff, sum_unspent_func):
+        '''
+        Checks a message received for an existing negotiation (see nego_helpers.check_received_msg)
+        Transactions are prechecked in the calling thread (values of inputs are cached by this process)
+        Returns the status of the message
+
+        Parameters:
+            nego             = Negotiation
+            msg              = received BargainingMessage
+            pbuff            = protobuff message
+            sum_unspent_func = function computing the sum of unspent inputs of transactions
+        '''
+        if msg.msg_type == TYPE_BARGAIN_PROPOSAL:
+            with self._metrics.stage('precheck_txs', msg.msg_type):
+                nego.precheck_txs(msg, nego.get_last_msg(), sum_unspent_func)
+        self.check_msg(nego, msg, pbuff)
+        return msg.status
+
+    def check_msg(self, nego, msg, pbuff):
+        '''
+        Checks the format of a message and its consistency with negotiation if valid format
+        Returns True if the format is valid
+
+        Parameters:
+            nego  = Negotiation
+            msg   = received BargainingMessage
+            pbuff = protobuff message
+        '''
+        if not self._nb_processes:
+            return check_msg_fmt_and_consistency(nego, msg, self._network, self._metrics)
+        length = nego.length()
+        # Record of the last message only (see nego_helpers.serialize_nego)
+        last_record = serialize_nego(nego, length - 1) if length else ''
+        args = (pbuff, msg.status, list(msg.errors), nego.nid, nego.network, nego.status, last_record)
+        # Worker processes don't report metrics. The whole round trip is timed.
+        with self._metrics.stage('check_pool', msg.msg_type):
+            fmt_ok, status, errors = self._get_pool().apply(_check_msg_job, args)
+        if nego.length() != length:
+            # Negotiation has been modified in the meantime. Checks the message again.
+            return check_msg_fmt_and_consistency(nego, msg, self._network, self._metrics)
+        msg.status = status
+        msg.errors = errors
+        return fmt_ok
+
+    def close(self):
+        '''
+        Terminates the worker processes
+        '''
+        if self._pool is None: return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def _get_pool(self):
+        '''
+        Returns the pool of processes (created lazily, once per process)
+        '''
+        with self._lock:
+            if (self._pool is None) or (self._pid != os.getpid()):
+                # Imported on demand (startup time of workers without pool)
+                from multiprocessing import Pool
+                self._pool = Pool(self._nb_processes)
+                self._pid  = os.getpid()
+            return self._pool
+
+
+
+'''
+WORKER PROCESSES
+'''
+def _check_msg_job(pbuff, status, errors, nid, network, nego_status, last_record):
+    '''
+    Checks a message in a worker process
+    The negotiation is rebuilt from its last message and its status
+    Returns a tuple (format is valid, status, errors)
+    '''
+    nego = deserialize_nego(nid, network, last_record) if last_record else Negotiation(nid, ROLE_SELLER, network)
+    nego.status = nego_status
+    msg = deserialize_msg(status, errors, pbuff)
+    fmt_ok = check_msg_fmt_and_consistency(nego, msg, network)
+    return (fmt_ok, msg.status, list(msg.errors))
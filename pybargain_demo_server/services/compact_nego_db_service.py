@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+'''
+A class storing Negotiations in memory as compact records.
+
+A live negotiation is stored as a NegoRecord (summary fields + serialized chain of messages)
+instead of a Negotiation holding deserialized messages, details and errors.
+get_nego_by_id() returns a LazyNegotiation answering cheap queries (status, length, next role, ...)
+from the record. The full chain is deserialized only when another method is called (ie: check_consistency).
+Updates only serialize the messages appended since the negotiation has been loaded.
+'''
+from pybargain_protocol.constants import *
+from helpers.nego_helpers import serialize_nego, deserialize_nego
+from services.nego_db_service import MemoryNegoDbService, NegoDbService
+
+
+
+class NegoRecord(object):
+    '''
+    Compact summary of a negotiation (immutable)
+    '''
+
+    __slots__ = ('nid', 'network', 'status', 'next_role', 'seller_offer', 'buyer_offer',
+                 'expiry', 'length', 'last_buyer_pbuff', 'chain')
+
+    '''
+    ATTRIBUTES
+
+    nid              = id of the negotiation
+    network          = network used for the negotiation
+    status           = status of the negotiation
+    next_role        = role expected to send the next message
+    seller_offer     = last amount offered by the seller (None if no offer)
+    buyer_offer      = last amount offered by the buyer (None if no offer)
+    expiry           = time after which the negotiation can be removed from db
+    length           = number of messages
+    last_buyer_pbuff = protobuff of the last message received from the buyer ('' if none)
+    chain            = serialized chain of messages (see nego_helpers.serialize_nego)
+    '''
+
+    def __init__(self, nid, network, status, next_role, seller_offer, buyer_offer, expiry, length, last_buyer_pbuff, chain):
+        self.nid              = nid
+        self.network          = network
+        self.status           = status
+        self.next_role        = next_role
+        self.seller_offer     = seller_offer
+        self.buyer_offer      = buyer_offer
+        self.expiry           = expiry
+        self.length           = length
+        self.last_buyer_pbuff = last_buyer_pbuff
+        self.chain            = chain
+
+
+def build_record(nid, nego, expiry, prev_record = None):
+    '''
+    Builds the record of a negotiation
+    Only the messages appended since the previous record are serialized
+
+    Parameters:
+        nid         = id of the negotiation
+        nego        = Negotiation (or LazyNegotiation)
+        expiry      = time after which the negotiation can be removed from db
+        prev_record = previous record of the negotiation (None for a new negotiation)
+    '''
+    start = 0 if prev_record is None else prev_record.length
+    chain = '' if prev_record is None else prev_record.chain
+    seller_offer = None if prev_record is None else prev_record.seller_offer
+    buyer_offer  = None if prev_record is None else prev_record.buyer_offer
+    buyer_pbuff  = '' if prev_record is None else prev_record.last_buyer_pbuff
+    for idx in range(start, nego.length()):
+        msg = nego.get_msg_at_idx(idx)
+        if msg.msg_type in (TYPE_BARGAIN_REQUEST_ACK, TYPE_BARGAIN_PROPOSAL_ACK): seller_offer = msg.details.amount
+        elif msg.msg_type == TYPE_BARGAIN_PROPOSAL: buyer_offer = msg.details.amount
+        # Messages alternate between the buyer (even indices, starting with the request) and the seller
+        if idx % 2 == 0: buyer_pbuff = getattr(msg, 'pbuff', None) or ''
+    return NegoRecord(nid, nego.network, nego.status, nego.get_next_active_role(), seller_offer, buyer_offer,
+                      expiry, nego.length(), buyer_pbuff, chain + serialize_nego(nego, start))
+
+
+
+class LazyNegotiation(object):
+    '''
+    Negotiation loaded from a record
+    Cheap queries are answered by the record until the chain is materialized.
+    Any other attribute materializes the chain and is delegated to the Negotiation.
+    '''
+
+    def __init__(self, record):
+        self._record = record
+        self._nego   = None
+
+    @property
+    def record(self):
+        return self._record
+
+    @property
+    def nid(self):
+        return self._record.nid
+
+    @property
+    def network(self):
+        return self._record.network
+
+    @property
+    def status(self):
+        return self._record.status if self._nego is None else self._nego.status
+
+    def is_materialized(self):
+        return not self._nego is None
+
+    def length(self):
+        return self._record.length if self._nego is None else self._nego.length()
+
+    def get_next_active_role(self):
+        return self._record.next_role if self._nego is None else self._nego.get_next_active_role()
+
+    def already_received(self, msg):
+        # Retransmission of the last message of the buyer (the usual case) doesn't require the chain
+        pbuff = getattr(msg, 'pbuff', None)
+        if (self._nego is None) and pbuff and (pbuff == self._record.last_buyer_pbuff): return True
+        return self._materialize().already_received(msg)
+
+    def __getattr__(self, name):
+        return getattr(self._materialize(), name)
+
+    def _materialize(self):
+        if self._nego is None:
+            self._nego = deserialize_nego(self._record.nid, self._record.network, self._record.chain)
+        return self._nego
+
+
+
+class CompactNegoDbService(MemoryNegoDbService):
+    '''
+    Negotiations stored in memory as NegoRecord (single process only)
+    '''
+
+    def __init__(self, ttl = NegoDbService.DEFAULT_TTL, finished_ttl = NegoDbService.DEFAULT_FINISHED_TTL):
+        super(CompactNegoDbService, self).__init__(ttl, finished_ttl)
+
+    def create_nego(self, nid, nego):
+        # Checks parameter
+        if not (nid and self._check_nego(nego)):
+            return False
+        with self._lock:
+            if nid in self._negos_by_id: return False
+            self._store(nid, nego, None)
+            return True
+
+    def update_nego(self, nid, nego):
+        # Checks parameter
+        if not (nid and self._check_nego(nego)):
+            return False
+        with self._lock:
+            prev_record = self._negos_by_id.get(nid, None)
+            if prev_record is None: return False
+            # Nothing has changed if the chain hasn't been materialized
+            if isinstance(nego, LazyNegotiation) and not nego.is_materialized(): return True
+            self._store(nid, nego, prev_record if nego.length() >= prev_record.length else None)
+            return True
+
+    def get_nego_by_id(self, nid):
+        record = self.get_record(nid)
+        return None if record is None else LazyNegotiation(record)
+
+    def get_all_negos(self):
+        return [LazyNegotiation(r) for r in self._negos_by_id.values()]
+
+    def get_record(self, nid):
+        '''
+        Gets the record (summary) of a negotiation without materializing its chain
+
+        Parameters:
+            nid = id of the negotiation
+        '''
+        return self._negos_by_id.get(nid, None) if nid else None
+
+    def _store(self, nid, nego, prev_record):
+        expiry = self._get_expiry(nego)
+        self._negos_by_id[nid] = build_record(nid, nego, expiry, prev_record)
+        self._index_expiry(nid, expiry)
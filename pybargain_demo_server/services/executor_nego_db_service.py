@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''
+A class running the calls to a NegoDbService in an executor (ie: a pool of native threads)
+Used by the cooperative server (seller_demo_gevent.py) so that blocking db accesses don't block the event loop.
+'''
+from services.nego_db_service import NegoDbService
+
+
+'''
+DEFAULT EXECUTOR
+Set by seller_demo_gevent.py before seller_demo is imported so that the store is wrapped
+before it's passed to other services (reaper, admission control, handoff).
+'''
+_default_executor = None
+
+def set_default_executor(executor):
+    global _default_executor
+    _default_executor = executor
+
+
+def wrap_store(store):
+    '''
+    Returns the store wrapped in an ExecutorNegoDbService if a default executor is set (the store otherwise)
+    '''
+    return store if _default_executor is None else ExecutorNegoDbService(store, _default_executor)
+
+
+class ExecutorNegoDbService(NegoDbService):
+
+    '''
+    ATTRIBUTES
+
+    _store    = wrapped NegoDbService
+    _executor = executor (object providing apply(func, args))
+    '''
+
+    def __init__(self, store, executor):
+        '''
+        Constructor
+
+        Parameters:
+            store    = wrapped NegoDbService
+            executor = executor (object providing apply(func, args))
+        '''
+        self._store    = store
+        self._executor = executor
+
+    @property
+    def max_live(self):
+        return self._store.max_live
+
+    @max_live.setter
+    def max_live(self, value):
+        self._store.max_live = value
+
+    def create_nego(self, nid, nego):
+        return self._executor.apply(self._store.create_nego, (nid, nego))
+
+    def update_nego(self, nid, nego):
+        return self._executor.apply(self._store.update_nego, (nid, nego))
+
+    def delete_nego(self, nid):
+        return self._executor.apply(self._store.delete_nego, (nid,))
+
+    def get_nego_by_id(self, nid):
+        return self._executor.apply(self._store.get_nego_by_id, (nid,))
+
+    def get_all_negos(self):
+        return self._executor.apply(self._store.get_all_negos, ())
+
+    def count_negos(self):
+        return self._executor.apply(self._store.count_negos, ())
+
+    def is_full(self):
+        return self._executor.apply(self._store.is_full, ())
+
+    def reap_negos(self, now = None):
+        return self._executor.apply(self._store.reap_negos, (now,))
+
+    def get_stats(self):
+        return self._executor.apply(self._store.get_stats, ())
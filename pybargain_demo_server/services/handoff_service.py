@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+A class transferring the live negotiations of a node to a peer (drain before shutdown)
+
+Protocol (driven by the routing front, see RouterService.drain):
+    1. export = the node stops accepting new negotiations and returns its live negotiations not yet exported.
+                Exported negotiations are frozen: their messages are answered with a 503 (the buyer retries through the front)
+    2. import = the peer stores the negotiations
+    3. the front routes the exported negotiations to the peer
+    4. commit = the node deletes the exported negotiations accepted by the peer (late messages are still answered with a 503)
+                Negotiations refused by the peer (ie: store full, id already used) are unfrozen and kept by the node
+Steps 1 to 3 are repeated until the node has no more live negotiations (negotiations created concurrently).
+abort = exported negotiations are unfrozen and the node accepts new negotiations again.
+
+Finished negotiations are not transferred (they're kept by the node until it stops).
+'''
+import threading
+from helpers.nego_helpers import serialize_nego, deserialize_nego, is_nego_finished
+from helpers.routing_helpers import pack_negos, unpack_negos
+
+
+class HandoffService(object):
+
+    '''
+    ATTRIBUTES
+
+    draining     = flag indicating if the node refuses new negotiations
+
+    _store       = NegoDbService storing the negotiations of the node
+    _locks       = StripedLocks serializing the processing of messages of a negotiation
+    _exported    = set of ids of exported negotiations (frozen until commit or abort)
+    _handed_off  = set of ids of negotiations deleted by a commit
+    _kept        = set of ids of negotiations refused by peers (not exported again until abort)
+    _nb_exported = number of negotiations exported
+    _nb_imported = number of negotiations imported
+    _lock        = lock protecting the set of exported negotiations
+    '''
+
+    def __init__(self, store, locks):
+        '''
+        Constructor
+
+        Parameters:
+            store = NegoDbService storing the negotiations of the node
+            locks = StripedLocks serializing the processing of messages of a negotiation
+        '''
+        self.draining     = False
+        self._store       = store
+        self._locks       = locks
+        self._exported    = set()
+        self._handed_off  = set()
+        self._kept        = set()
+        self._nb_exported = 0
+        self._nb_imported = 0
+        self._lock        = threading.Lock()
+
+    def is_exported(self, nid):
+        '''
+        Checks if a negotiation has been exported (its messages must not be processed)
+
+        Parameters:
+            nid = id of the negotiation
+        '''
+        return (nid in self._exported) or (nid in self._handed_off)
+
+    def export_negos(self, max_negos = 0):
+        '''
+        Stops accepting new negotiations and exports live negotiations which haven't been exported yet
+        Returns a string (see routing_helpers.pack_negos). Empty string if there's nothing left to export.
+
+        Parameters:
+            max_negos = maximum number of negotiations exported (0 = no limit)
+        '''
+        self.draining = True
+        negos = []
+        for nego in self._store.get_all_negos():
+            nid = nego.nid
+            if self.is_exported(nid) or (nid in self._kept): continue
+            # Waits for the processing of the current message of the negotiation
+            with self._locks.get_lock(nid):
+                nego = self._store.get_nego_by_id(nid)
+                if (nego is None) or is_nego_finished(nego): continue
+                with self._lock:
+                    self._exported.add(nid)
+                negos.append((str(nid), str(nego.network), serialize_nego(nego)))
+            if max_negos and len(negos) >= max_negos: break
+        self._nb_exported += len(negos)
+        return pack_negos(negos)
+
+    def import_negos(self, data):
+        '''
+        Stores negotiations exported by a peer
+        Returns the list of ids of imported negotiations (negotiations refused by the store aren't in the list)
+
+        Parameters:
+            data = string built by export_negos
+        '''
+        imported = []
+        for (nid, network, chain) in unpack_negos(data):
+            with self._locks.get_lock(nid):
+                if self._store.create_nego(nid, deserialize_nego(nid, network, chain)): imported.append(nid)
+        self._nb_imported += len(imported)
+        return imported
+
+    def commit(self, nids = None):
+        '''
+        Deletes the exported negotiations accepted by the peer (they're now routed to the peer)
+        Other exported negotiations are unfrozen and kept by the node
+        Returns the number of deleted negotiations
+
+        Parameters:
+            nids = list of ids of negotiations imported by the peer (None = all exported negotiations)
+        '''
+        with self._lock:
+            exported, self._exported = self._exported, set()
+            accepted = exported if nids is None else exported & set(nids)
+            self._kept.update(exported - accepted)
+            self._handed_off.update(accepted)
+        for nid in accepted: self._store.delete_nego(nid)
+        return len(accepted)
+
+    def abort(self):
+        '''
+        Unfreezes the exported negotiations and accepts new negotiations again
+        '''
+        with self._lock:
+            self._exported = set()
+            self._kept = set()
+        self.draining = False
+
+    def get_stats(self):
+        '''
+        Gets counters about handoffs
+        '''
+        return {'draining'  : int(self.draining),
+                'frozen'    : len(self._exported),
+                'handed_off': len(self._handed_off),
+                'kept'      : len(self._kept),
+                'exported'  : self._nb_exported,
+                'imported'  : self._nb_imported}
@@ -1,15 +1,58 @@
 #!/usr/bin/env python
 '''
 A class simulating a wrapper to access a database storing Negotiations.
-For this toy project, we store Negotiations in memory.
+
+NegoDbService defines the interface shared by all backends:
+    - MemoryNegoDbService  = negotiations stored in memory (single process only)
+    - CompactNegoDbService = negotiations stored in memory as compact records (see compact_nego_db_service.py)
+    - SqliteNegoDbService  = negotiations stored in a sqlite db (see sqlite_nego_db_service.py)
+    - ShardedNegoDbService = negotiations spread over several stores (see sharded_nego_db_service.py)
+
+Each backend maintains an expiry index ordered by expiration time of negotiations.
+Finished and expired negotiations are removed by reap_negos() (see reaper_service.py).
+The number of live negotiations can be capped with max_live (checked by is_full(), see admission_service.py).
 '''
+import heapq
+import threading
+from helpers.nego_helpers import get_current_time, get_nego_expiry, is_nego_finished
+
 
 class NegoDbService(object):
-    
-    def __init__(self):
-        # Initializes some dictionaries to store negotiations
-        self._negos_by_id = dict()
-                
+
+    '''
+    CONSTANTS
+    '''
+    # Default time to live (in seconds) of a negotiation without RequestACK message
+    DEFAULT_TTL          = 1200
+    # Default time to live (in seconds) of a finished negotiation (allows the processing of retransmitted messages)
+    DEFAULT_FINISHED_TTL = 60
+    # Maximum number of live negotiations (None = no limit, can be set per instance)
+    max_live             = None
+
+    '''
+    ATTRIBUTES
+
+    max_live      = maximum number of live negotiations (None = no limit)
+
+    _ttl          = time to live (in seconds) of a negotiation without RequestACK message
+    _finished_ttl = time to live (in seconds) of a finished negotiation
+    _nb_expired   = number of expired negotiations removed from db
+    _nb_finished  = number of finished negotiations removed from db
+    '''
+
+    def __init__(self, ttl = DEFAULT_TTL, finished_ttl = DEFAULT_FINISHED_TTL):
+        '''
+        Constructor
+
+        Parameters:
+            ttl          = time to live (in seconds) of a negotiation without RequestACK message
+            finished_ttl = time to live (in seconds) of a finished negotiation
+        '''
+        self._ttl          = ttl
+        self._finished_ttl = finished_ttl
+        self._nb_expired   = 0
+        self._nb_finished  = 0
+
     def create_nego(self, nid, nego):
         '''
         Create a nego entry in db
@@ -17,17 +60,8 @@ class NegoDbService(object):
             nid  = id of the negotiation
             nego = nego object to store in db
         '''
-        # Checks parameter
-        if not self._check_nego(nego):
-            return False
-        # Checks that a nego with same id has not already been stored in db
-        if self.get_nego_by_id(nid) is None:
-            # Creates the user in db
-            self._negos_by_id[nid] = nego
-            return True
-        else:
-            return False  
-            
+        raise NotImplementedError()
+
     def update_nego(self, nid, nego):
         '''
         Update a nego entry in db
@@ -35,46 +69,161 @@ class NegoDbService(object):
             nid  = id of the negotiation
             nego = nego object to update in db
         '''
-        # Checks parameter
-        if not self._check_nego(nego):
-            return False
-        # Checks that a nego with same id exists in db
-        if not (self.get_nego_by_id(nid) is None):
-            # Updates the nego in db
-            self._negos_by_id[nid] = nego
-            return True
-        else:
-            return False  
-        
+        raise NotImplementedError()
+
     def delete_nego(self, nid):
         '''
         Delete a nego entry from db
         Parameters:
             nid = id of the negotiation
         '''
-        # Checks parameter
-        if not nid: return False
-        # Checks that a nego with same id exists in db
-        if not (self.get_nego_by_id(nid) is None):
-            del self._negos_by_id[nid]
-            return True
-        else:
-            return False
-        
+        raise NotImplementedError()
+
     def get_nego_by_id(self, nid):
         '''
         Gets a nego associated to a given id
         Parameters:
             nid = id of the negotiation
         '''
-        return self._negos_by_id.get(nid, None) if nid else None   
-        
+        raise NotImplementedError()
+
     def get_all_negos(self):
         '''
         Gets a list of all negotiations
         '''
-        return self._negos_by_id.values()
-        
+        raise NotImplementedError()
+
+    def count_negos(self):
+        '''
+        Gets the number of negotiations stored in db
+        '''
+        raise NotImplementedError()
+
+    def is_full(self):
+        '''
+        Checks if the maximum number of live negotiations is reached
+        '''
+        return not (self.max_live is None) and self.count_negos() >= self.max_live
+
+    def reap_negos(self, now = None):
+        '''
+        Removes finished and expired negotiations from db
+        Returns the number of removed negotiations
+        Parameters:
+            now = current time (defaults to current time)
+        '''
+        raise NotImplementedError()
+
+    def get_stats(self):
+        '''
+        Gets counters about negotiations
+            live     = number of negotiations stored in db
+            expired  = number of expired negotiations removed from db
+            finished = number of finished negotiations removed from db
+            reaped   = number of negotiations removed from db (expired + finished)
+        '''
+        return {'live'    : self.count_negos(),
+                'expired' : self._nb_expired,
+                'finished': self._nb_finished,
+                'reaped'  : self._nb_expired + self._nb_finished}
+
+    def _get_expiry(self, nego):
+        return get_nego_expiry(nego, self._ttl, self._finished_ttl)
+
+    def _count_reaped(self, finished):
+        if finished: self._nb_finished += 1
+        else: self._nb_expired += 1
+
     def _check_nego(self, nego):
         if nego is None: return False
-        else: return True     
+        else: return True
+
+
+
+class MemoryNegoDbService(NegoDbService):
+    '''
+    For this toy project, we store Negotiations in memory.
+    Negotiations are lost on restart and can't be shared between processes.
+    The expiry index is a heap of (expiry, nid). Outdated entries are skipped when popped.
+    '''
+
+    def __init__(self, ttl = NegoDbService.DEFAULT_TTL, finished_ttl = NegoDbService.DEFAULT_FINISHED_TTL):
+        super(MemoryNegoDbService, self).__init__(ttl, finished_ttl)
+        # Initializes some dictionaries to store negotiations
+        self._negos_by_id  = dict()
+        self._expiry_by_id = dict()
+        self._expiry_heap  = []
+        # Protects the negotiations and the expiry index (shared with the reaper thread)
+        self._lock         = threading.RLock()
+
+    def create_nego(self, nid, nego):
+        # Checks parameter
+        if not self._check_nego(nego):
+            return False
+        # Checks that a nego with same id has not already been stored in db
+        with self._lock:
+            if self.get_nego_by_id(nid) is None:
+                # Creates the user in db
+                self._negos_by_id[nid] = nego
+                self._set_expiry(nid, nego)
+                return True
+            else:
+                return False
+
+    def update_nego(self, nid, nego):
+        # Checks parameter
+        if not self._check_nego(nego):
+            return False
+        # Checks that a nego with same id exists in db
+        with self._lock:
+            if not (self.get_nego_by_id(nid) is None):
+                # Updates the nego in db
+                self._negos_by_id[nid] = nego
+                self._set_expiry(nid, nego)
+                return True
+            else:
+                return False
+
+    def delete_nego(self, nid):
+        # Checks parameter
+        if not nid: return False
+        # Checks that a nego with same id exists in db
+        with self._lock:
+            if not (self.get_nego_by_id(nid) is None):
+                del self._negos_by_id[nid]
+                del self._expiry_by_id[nid]
+                return True
+            else:
+                return False
+
+    def get_nego_by_id(self, nid):
+        return self._negos_by_id.get(nid, None) if nid else None
+
+    def get_all_negos(self):
+        return self._negos_by_id.values()
+
+    def count_negos(self):
+        return len(self._negos_by_id)
+
+    def reap_negos(self, now = None):
+        now = get_current_time() if now is None else now
+        nb_reaped = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expiry, nid = heapq.heappop(self._expiry_heap)
+                # Skips outdated entries (expiry updated or nego deleted)
+                if self._expiry_by_id.get(nid, None) != expiry: continue
+                nego = self._negos_by_id[nid]
+                self.delete_nego(nid)
+                self._count_reaped(is_nego_finished(nego))
+                nb_reaped += 1
+        return nb_reaped
+
+    def _set_expiry(self, nid, nego):
+        self._index_expiry(nid, self._get_expiry(nego))
+
+    def _index_expiry(self, nid, expiry):
+        with self._lock:
+            if self._expiry_by_id.get(nid, None) == expiry: return
+            self._expiry_by_id[nid] = expiry
+            heapq.heappush(self._expiry_heap, (expiry, nid))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''
+A class providing the negotiator associated to a product
+
+Products are loaded from a catalog file (json):
+    {
+        "default" : "<pid of the product used when a request doesn't specify a product>",
+        "products": [
+            {
+                "pid"    : "<product id>",
+                "welcome": "<memo of the RequestACK message>",
+                "amounts": [<amount of output 1>, <amount of output 2>],
+                "floor"  : <minimum price (optional)>,
+                "seeds"  : {"output1": "<seed>", "output2": "<seed>", "sign": "<seed>"} (optional),
+                "scripts": ["<output script 1>", "<output script 2>"] (optional, replace scripts derived from seeds)
+            },
+            ...
+        ]
+    }
+Without catalog, the registry serves the product of the demo (pid = '').
+
+Negotiators are built on first use and cached (one per product).
+Products sharing the same seeds share the same derived keys (keys are derived once).
+'''
+import json
+import hashlib
+import threading
+from helpers.metrics_helpers import NO_METRICS
+from helpers.keystore_helpers import load_keys
+from services.negotiator_service import NegotiatorService
+from services.strategy_service import RandomDiscountStrategy
+
+
+
+class Product(object):
+    '''
+    Configuration of a product
+    '''
+
+    __slots__ = ('pid', 'welcome', 'amounts', 'floor', 'seeds', 'scripts')
+
+    '''
+    ATTRIBUTES
+
+    pid     = product id
+    welcome = memo of the RequestACK message
+    amounts = amounts of the 2 outputs of the initial offer
+    floor   = minimum price
+    seeds   = dictionary of seeds of the keys of the seller (see NegotiatorService.KEY_SEEDS)
+    scripts = output scripts (None = scripts derived from seeds)
+    '''
+
+    def __init__(self, pid = '', welcome = NegotiatorService.WELCOME_MSG, amounts = NegotiatorService.DEFAULT_AMOUNTS,
+                 floor = 0, seeds = None, scripts = None):
+        if len(amounts) != 2: raise ValueError('Product %s: 2 output amounts are required' % pid)
+        if scripts and len(scripts) != 2: raise ValueError('Product %s: 2 output scripts are required' % pid)
+        self.pid     = pid
+        self.welcome = welcome
+        self.amounts = [int(a) for a in amounts]
+        self.floor   = int(floor)
+        self.seeds   = seeds if seeds else NegotiatorService.KEY_SEEDS
+        self.scripts = [str(s) for s in scripts] if scripts else None
+
+
+def load_catalog(path):
+    '''
+    Loads a catalog file
+    Returns a tuple (dictionary of products indexed by pid, default pid)
+
+    Parameters:
+        path = path of the catalog file
+    '''
+    with open(path) as f:
+        catalog = json.load(f)
+    products = dict()
+    for p in catalog.get('products', []):
+        pid = str(p['pid'])
+        if pid in products: raise ValueError('Product %s is defined twice' % pid)
+        seeds = dict([(str(k), str(v)) for (k, v) in p['seeds'].items()]) if p.get('seeds') else None
+        products[pid] = Product(pid, str(p.get('welcome', NegotiatorService.WELCOME_MSG)),
+                                p.get('amounts', NegotiatorService.DEFAULT_AMOUNTS), p.get('floor', 0),
+                                seeds, p.get('scripts', None))
+    default_pid = str(catalog.get('default', ''))
+    if default_pid and not default_pid in products: raise ValueError('Default product %s is not defined' % default_pid)
+    return (products, default_pid)
+
+
+
+class NegotiatorRegistryService(object):
+
+    '''
+    ATTRIBUTES
+
+    default_pid    = pid of the product used when a request doesn't specify a product
+
+    _network       = network used for negotiations
+    _products      = dictionary of products indexed by pid
+    _keystore_path = path of the keystore file caching derived keys (None = keys are derived)
+    _metrics       = Metrics passed to negotiators
+    _sdata_codec   = SellerDataCodec passed to negotiators
+    _executor      = executor running signatures of negotiators (None = calling thread)
+    _negotiators   = dictionary of negotiators indexed by pid
+    _keys          = dictionary of derived keys indexed by seeds
+    _lock          = lock protecting the creation of negotiators
+    '''
+
+    def __init__(self, network, catalog_path = None, keystore_path = None, metrics = NO_METRICS, sdata_codec = None):
+        '''
+        Constructor
+
+        Parameters:
+            network       = network used for negotiations
+            catalog_path  = path of the catalog file (None = product of the demo)
+            keystore_path = path of the keystore file caching derived keys (None = keys are derived)
+            metrics       = Metrics passed to negotiators
+            sdata_codec   = SellerDataCodec passed to negotiators (None = seller data built for each message)
+        '''
+        if catalog_path:
+            self._products, self.default_pid = load_catalog(catalog_path)
+        else:
+            self._products, self.default_pid = {'': Product()}, ''
+        self._network       = network
+        self._keystore_path = keystore_path
+        self._metrics       = metrics
+        self._sdata_codec   = sdata_codec
+        self._executor      = None
+        self._negotiators   = dict()
+        self._keys          = dict()
+        self._lock          = threading.Lock()
+
+    def get_negotiator(self, pid = None):
+        '''
+        Returns the negotiator associated to a product (None if the product is unknown)
+        The negotiator is built on first use
+
+        Parameters:
+            pid = product id (None or '' = default product)
+        '''
+        pid = pid if pid else self.default_pid
+        negotiator = self._negotiators.get(pid, None)
+        if negotiator is None:
+            product = self._products.get(pid, None)
+            if product is None: return None
+            with self._lock:
+                negotiator = self._negotiators.get(pid, None)
+                if negotiator is None:
+                    negotiator = self._build_negotiator(product)
+                    self._negotiators[pid] = negotiator
+        return negotiator
+
+    def get_products(self):
+        return self._products.values()
+
+    def count_negotiators(self):
+        '''
+        Gets the number of negotiators built
+        '''
+        return len(self._negotiators)
+
+    def set_sign_executor(self, executor):
+        '''
+        Sets the executor running signatures of all negotiators (ie: a thread pool)
+
+        Parameters:
+            executor = object providing apply(func, args). None = signatures are computed by the calling thread
+        '''
+        with self._lock:
+            self._executor = executor
+            for negotiator in self._negotiators.values(): negotiator.set_sign_executor(executor)
+
+    def _build_negotiator(self, product):
+        negotiator = NegotiatorService(self._network, metrics = self._metrics, strategy = RandomDiscountStrategy(product.floor),
+                                       keys = self._get_keys(product.seeds), product = product,
+                                       sdata_codec = self._sdata_codec)
+        negotiator.set_sign_executor(self._executor)
+        return negotiator
+
+    def _get_keys(self, seeds):
+        '''
+        Returns the keys derived from seeds (derived once per set of seeds)
+        '''
+        key = tuple(sorted(seeds.items()))
+        keys = self._keys.get(key, None)
+        if keys is None:
+            # Keys of other products are stored under a prefix in the keystore
+            prefix = '' if seeds == NegotiatorService.KEY_SEEDS else hashlib.sha1(repr(key)).hexdigest()[:8] + '/'
+            stored = load_keys(self._keystore_path, dict([(prefix + n, s) for (n, s) in seeds.items()]), self._network)
+            keys = dict([(n, stored[prefix + n]) for n in seeds])
+            self._keys[key] = keys
+        return keys
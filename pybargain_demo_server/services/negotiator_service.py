@@ -3,11 +3,7 @@
 A class negotiating to sell a product/service
 Implements a very basic strategy
 '''
-import calendar
-from random import random, randint
-from datetime import datetime
-from bitcoin.main import sha256, privtopub, pubtoaddr
-from bitcoin.transaction import address_to_script
+import random
 from pybargain_protocol.constants import *
 from pybargain_protocol.bargaining_cancellation import BargainingCancellationDetails
 from pybargain_protocol.bargaining_message import BargainingMessage
@@ -15,6 +11,11 @@ from pybargain_protocol.bargaining_request_ack import BargainingRequestACKDetail
 from pybargain_protocol.bargaining_completion import BargainingCompletionDetails
 from pybargain_protocol.bargaining_proposal_ack import BargainingProposalACKDetails
 from helpers.messages_helpers import build_seller_data
+from helpers.metrics_helpers import NO_METRICS
+from helpers.nego_helpers import get_current_time
+from helpers.keystore_helpers import derive_keys
+from services.signer_service import SignerService
+from services.strategy_service import RandomDiscountStrategy, build_offer_history, round_amount
 
 
 class NegotiatorService(object):
@@ -25,6 +26,7 @@ class NegotiatorService(object):
     '''
     WELCOME_MSG     = 'Hi ! Here is our best offer for a BD-48T dedicated server (monthly rental)'
     AGREE_MSG       = 'Ok for this price. Please confirm the deal.'
+    DEFAULT_AMOUNTS = [150000000, 100000000]
     COMPLETION_MSG  = 'Deal ! Your transaction has been broadcast for validation'
     CANCEL_MSG      = 'We were unable to process your last message. Negotiation is aborted. Errors detected : %s'
     
@@ -47,10 +49,22 @@ class NegotiatorService(object):
                        'This is an incredible opportunity !',
                        'This is my best price']
     
+    # Seeds of the keys used by the seller (keys can be loaded from a keystore, see keystore_helpers.load_keys)
+    KEY_SEEDS       = {'output1': 'This is the first private key for the seller',
+                       'output2': 'This is the second private key for the seller',
+                       'sign'   : 'This is a private key used to sign messages sent by the seller'}
+    
     '''
     ATTRIBUTES
     
     bargain_uri   = bargain uri used by the seller
+    strategy      = PricingStrategy computing new offers
+    rnd           = random generator selecting memos (random module or random.Random instance)
+    product_id    = id of the product sold (stored in seller data)
+    
+    _welcome_msg  = memo of the RequestACK message
+    _amounts      = amounts of the 2 outputs of the initial offer
+    _sdata_codec  = SellerDataCodec encoding seller data (None = seller data built for each message)
     
     _privkey1     = first private key
     _pubkey1      = first public key
@@ -64,29 +78,75 @@ class NegotiatorService(object):
     
     _privkeysign  = private key used to sign messages
     _pubkeysign   = public key used to sign messages
+    _signer       = service signing messages
+    _metrics      = Metrics timing the signature and the serialization of messages
     '''
     
     
-    def __init__(self, network, bargain_uri = ''):
+    def __init__(self, network, bargain_uri = '', metrics = NO_METRICS, strategy = None, keys = None, product = None,
+                 sdata_codec = None):
         '''
         Constructor
+        
+        Parameters:
+            network     = network used for negotiations
+            bargain_uri = bargain uri used by the seller
+            metrics     = Metrics timing the signature and the serialization of messages
+            strategy    = PricingStrategy computing new offers (default = RandomDiscountStrategy)
+            keys        = dictionary of keys indexed by name (see KEY_SEEDS). Keys are derived if not provided.
+            product     = Product sold (see negotiator_registry_service). None = product of the demo
+            sdata_codec = SellerDataCodec encoding seller data (None = seller data built for each message)
         '''
-        self.bargain_uri = bargain_uri
+        self.bargain_uri  = bargain_uri
+        self.strategy     = strategy if strategy else RandomDiscountStrategy()
+        self.rnd          = random
+        self.product_id   = product.pid if product else ''
+        self._welcome_msg = product.welcome if product else NegotiatorService.WELCOME_MSG
+        self._amounts     = product.amounts if product else NegotiatorService.DEFAULT_AMOUNTS
+        self._sdata_codec = sdata_codec
+        self._metrics     = metrics
+        
+        keys = keys if keys else derive_keys(NegotiatorService.KEY_SEEDS, network)
+        
+        self._privkey1    = keys['output1']['privkey']
+        self._pubkey1     = keys['output1']['pubkey']
+        self._addr1       = keys['output1']['address']
+        self._script1     = keys['output1']['script']
+        
+        self._privkey2    = keys['output2']['privkey']
+        self._pubkey2     = keys['output2']['pubkey']
+        self._addr2       = keys['output2']['address']
+        self._script2     = keys['output2']['script']
         
-        magicbytes = MAGIC_BYTES_TESTNET if network == TESTNET else MAGIC_BYTES_MAINNET
+        self._privkeysign = keys['sign']['privkey']
+        self._pubkeysign  = keys['sign']['pubkey']
+        self._signer      = SignerService(self._privkeysign, self._pubkeysign)
         
-        self._privkey1    = sha256('This is the first private key for the seller')
-        self._pubkey1     = privtopub(self._privkey1)  
-        self._addr1       = pubtoaddr(self._pubkey1, magicbytes)
-        self._script1     = address_to_script(self._addr1)
+        if product and product.scripts:
+            self._script1, self._script2 = product.scripts
         
-        self._privkey2    = sha256('This is the second private key for the seller')
-        self._pubkey2     = privtopub(self._privkey2) 
-        self._addr2       = pubtoaddr(self._pubkey2, magicbytes)
-        self._script2     = address_to_script(self._addr2)
+    
+    def set_sign_executor(self, executor):
+        '''
+        Sets the executor running signatures of messages (ie: a thread pool)
         
-        self._privkeysign = sha256('This is a private key used to sign messages sent by the seller')
-        self._pubkeysign  = privtopub(self._privkeysign)  
+        Parameters:
+            executor = object providing apply(func, args). None = signatures are computed by the calling thread
+        '''
+        self._signer.executor = executor
+        
+    
+    def warm_up(self):
+        '''
+        Builds, signs, serializes and parses a message
+        Primes the lazy initializations of message classes and of the signature backend
+        '''
+        time = get_current_time()
+        dtls = BargainingCancellationDetails(time, '', build_seller_data(), 'Warm up')
+        msg = BargainingMessage(TYPE_BARGAIN_CANCELLATION, dtls)
+        msg.check_msg_fmt(TESTNET)
+        self._signer.sign(msg, None)
+        BargainingMessage.deserialize(msg.serialize())
         
     
     def process(self, nego):
@@ -115,14 +175,30 @@ class NegotiatorService(object):
         if msg == None: return None
         
         if msg.check_msg_fmt(nego.network):
-            msg.sign(last_msg, SIGN_ECDSA_SHA256, self._pubkeysign, self._privkeysign)
+            with self._metrics.stage('sign', msg.msg_type):
+                self._signer.sign(msg, last_msg)
             if nego.check_consistency(msg): 
-                msg.pbuff = msg.serialize()
+                with self._metrics.stage('serialize', msg.msg_type):
+                    msg.pbuff = msg.serialize()
                 return msg
             else: return None
         else: return None
                 
     
+    def compute_offers(self, negos):
+        '''
+        Computes new offers for a list of negotiations in a single batch (ie: to reprice open offers)
+        Returns a list of tuples (nid, new offer). Negotiations without offer of the buyer are ignored.
+        
+        Parameters:
+            negos = list of negotiations
+        '''
+        negos = [(n.nid, build_offer_history(n)) for n in negos if n.status == NEGO_STATUS_NEGOTIATION]
+        negos = [(nid, h) for (nid, h) in negos if h.seller_offers and h.buyer_offers]
+        offers = self.strategy.compute_offers([h for (nid, h) in negos])
+        return zip([nid for (nid, h) in negos], offers)
+    
+    
     def _build_request_ack_msg(self, last_msg, nego):
         '''
         Builds a RequestACK message
@@ -131,15 +207,15 @@ class NegotiatorService(object):
             last_msg = last message received from buyer            
             nego     = current negotiation
         '''
-        time    = long(calendar.timegm(datetime.now().timetuple()))
+        time    = get_current_time()
         bdata   = last_msg.details.buyer_data
-        sdata   = build_seller_data(nego.nid)
+        sdata   = self._get_seller_data(nego)
         network = nego.network
         expires = time + 1200L # 20 minutes
         uri     = self.bargain_uri
-        memo    = NegotiatorService.WELCOME_MSG
-        outputs = [{'amount': 150000000, 'script': self._script1}, 
-                   {'amount': 100000000, 'script': self._script2}]
+        memo    = self._welcome_msg
+        outputs = [{'amount': self._amounts[0], 'script': self._script1}, 
+                   {'amount': self._amounts[1], 'script': self._script2}]
         dtls = BargainingRequestACKDetails(time, bdata, sdata, network, expires, uri, outputs, memo) 
         return BargainingMessage(TYPE_BARGAIN_REQUEST_ACK, dtls)
     
@@ -152,9 +228,9 @@ class NegotiatorService(object):
             last_msg = last message received from buyer
             nego     = current negotiation
         '''
-        time    = long(calendar.timegm(datetime.now().timetuple()))
+        time    = get_current_time()
         bdata   = last_msg.details.buyer_data
-        sdata   = build_seller_data(nego.nid)
+        sdata   = self._get_seller_data(nego)
         outputs, memo = self._compute_new_offer(last_msg, nego)
         dtls = BargainingProposalACKDetails(time, bdata, sdata, outputs, memo)
         return BargainingMessage(TYPE_BARGAIN_PROPOSAL_ACK, dtls)
@@ -168,9 +244,9 @@ class NegotiatorService(object):
             last_msg = last message received from buyer
             nego     = current negotiation
         '''
-        time    = long(calendar.timegm(datetime.now().timetuple()))
+        time    = get_current_time()
         bdata   = last_msg.details.buyer_data
-        sdata   = build_seller_data(nego.nid)
+        sdata   = self._get_seller_data(nego)
         txs     = last_msg.details.transactions
         memo    = NegotiatorService.COMPLETION_MSG
         dtls = BargainingCompletionDetails(time, bdata, sdata, txs, memo)
@@ -185,48 +261,47 @@ class NegotiatorService(object):
             last_msg = last message received from buyer            
             nego     = current negotiation
         '''
-        time = long(calendar.timegm(datetime.now().timetuple()))
+        time = get_current_time()
         bdata = last_msg.details.buyer_data
-        sdata = build_seller_data(nego.nid)
+        sdata = self._get_seller_data(nego)
         memo = NegotiatorService.CANCEL_MSG % ", ".join(last_msg.errors)
         dtls = BargainingCancellationDetails(time, bdata, sdata, memo)
         return BargainingMessage(TYPE_BARGAIN_CANCELLATION, dtls)
     
     
-    def _select_memo(self):
-        idx = randint(0, len(NegotiatorService.NEGO_MSGS) - 1)
+    def _get_seller_data(self, nego):
+        if self._sdata_codec is None: return build_seller_data(nego.nid, self.product_id)
+        return self._sdata_codec.encode(nego.nid, self.product_id)
+    
+    
+    def select_memo(self, nego, history):
+        '''
+        Returns the memo of a new offer of the seller (replaced by the replay of captures, see benchmarks/replay.py)
+        
+        Parameters:
+            nego    = current negotiation
+            history = OfferHistory of the negotiation
+        '''
+        idx = self.rnd.randint(0, len(NegotiatorService.NEGO_MSGS) - 1)
         return NegotiatorService.NEGO_MSGS[idx]
     
     
     def _compute_new_offer(self, last_msg, nego):
-        prev_idx = nego.length() - 2
-        buyer_last_offer = last_msg.details.amount + last_msg.details.fees
-        seller_last_offer = nego.get_msg_at_idx(prev_idx).details.amount
-        
-        if random() < 0.1: 
-            # We keep the same offer (probability = 1/10)
-            new_offer = nego.get_msg_at_idx(prev_idx).details.amount
-            outputs =  nego.get_msg_at_idx(prev_idx).details.outputs
+        history = build_offer_history(nego)
+        new_offer = self.strategy.compute_offer(history)
+        
+        if new_offer == history.get_seller_last_offer():
+            # We keep the same offer (and the same outputs)
+            outputs = nego.get_msg_at_idx(nego.length() - 2).details.outputs
         else:
-            def round_amount(x): return (x / 100000) * 100000
-            # Computes a new offer
-            gap = seller_last_offer - buyer_last_offer
-            if gap < 1000000:
-                new_offer = buyer_last_offer
-            elif gap < 2000000:
-                new_offer = seller_last_offer
-            else:
-                discount = int(random() * gap / 2)
-                new_offer = round_amount(seller_last_offer - discount)
-                new_offer = max(buyer_last_offer, new_offer)
             # Splits the offer in 2 outputs
-            offer_part1 = round_amount(int(new_offer * 0.5))
+            offer_part1 = round_amount(int(new_offer * 0.5), 100000)
             offer_part2 = new_offer - offer_part1
             outputs = [{'amount': offer_part1, 'script': self._script1}, 
                        {'amount': offer_part2, 'script': self._script2}]
             
         # Gets a content for memo field 
-        memo = self.AGREE_MSG if (new_offer == buyer_last_offer) else self._select_memo()
+        memo = self.AGREE_MSG if (new_offer == history.get_buyer_last_offer()) else self.select_memo(nego, history)
         # Returns the new offer (outputs, memo)
         return (outputs, memo)
     
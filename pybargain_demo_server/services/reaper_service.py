@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+'''
+A class periodically removing finished and expired negotiations from a NegoDbService
+The reaper runs in a background (daemon) thread.
+'''
+import threading
+
+
+class ReaperService(object):
+
+    '''
+    CONSTANTS
+    '''
+    # Default period (in seconds) between two runs of the reaper
+    DEFAULT_PERIOD = 30
+
+    '''
+    ATTRIBUTES
+
+    nb_runs          = number of runs of the reaper
+
+    _nego_db_service = NegoDbService to clean
+    _period          = period (in seconds) between two runs of the reaper
+    _stop_event      = event used to stop the reaper
+    _thread          = background thread
+    '''
+
+    def __init__(self, nego_db_service, period = DEFAULT_PERIOD):
+        '''
+        Constructor
+
+        Parameters:
+            nego_db_service = NegoDbService to clean
+            period          = period (in seconds) between two runs of the reaper
+        '''
+        self.nb_runs          = 0
+        self._nego_db_service = nego_db_service
+        self._period          = period
+        self._stop_event      = threading.Event()
+        self._thread          = None
+
+    def start(self):
+        '''
+        Starts the reaper in a background thread
+        '''
+        if self.is_running(): return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target = self._run, name = 'nego-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the reaper
+        '''
+        self._stop_event.set()
+        if self._thread is not None: self._thread.join()
+        self._thread = None
+
+    def is_running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def run_once(self, now = None):
+        '''
+        Removes finished and expired negotiations
+        Returns the number of removed negotiations
+
+        Parameters:
+            now = current time (defaults to current time)
+        '''
+        self.nb_runs += 1
+        return self._nego_db_service.reap_negos(now)
+
+    def _run(self):
+        while not self._stop_event.wait(self._period):
+            try:
+                self.run_once()
+            except Exception:
+                # Keeps the reaper alive. Negotiations will be removed during next run
+                pass
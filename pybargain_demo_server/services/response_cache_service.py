@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+A class storing the responses sent for received messages
+Retransmitted messages (ie: retries after a network timeout) are answered with the exact same response,
+without deserialization of the message nor access to the negotiation.
+Responses are indexed by a hash of the received protobuff message.
+'''
+import hashlib
+from helpers.cache_helpers import LruCache
+from helpers.messages_helpers import build_msg_headers
+
+
+class ResponseCacheService(object):
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_MAX_SIZE = 10000
+    # Default time to live (in seconds) of a response (same as the expiration of a negotiation)
+    DEFAULT_TTL      = 1200
+
+    '''
+    ATTRIBUTES
+
+    _cache = LruCache of (protobuff response, http headers) indexed by hash of received message
+    '''
+
+    def __init__(self, max_size = DEFAULT_MAX_SIZE, ttl = DEFAULT_TTL):
+        '''
+        Constructor
+
+        Parameters:
+            max_size = maximum number of responses stored in cache
+            ttl      = time to live (in seconds) of a response
+        '''
+        self._cache = LruCache(max_size, ttl)
+
+    def get_response(self, pbuff):
+        '''
+        Returns the response sent for a received message (tuple (protobuff response, http headers))
+        or None if no response is found
+
+        Parameters:
+            pbuff = received protobuff message
+        '''
+        return self._cache.get(self._get_key(pbuff))
+
+    def set_response(self, pbuff, msg, next_msg_types):
+        '''
+        Stores the response sent for a received message
+
+        Parameters:
+            pbuff          = received protobuff message
+            msg            = BargainingMessage sent as a response
+            next_msg_types = list of expected message types for the next message
+        '''
+        if (msg is None) or (not msg.pbuff): return
+        self._cache.set(self._get_key(pbuff), (msg.pbuff, build_msg_headers(msg, next_msg_types)))
+
+    def get_stats(self):
+        '''
+        Gets counters about the cache (hits, misses, ...)
+        '''
+        return self._cache.get_stats()
+
+    def _get_key(self, pbuff):
+        return hashlib.sha256(pbuff).digest()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+'''
+A class routing messages to the node owning their negotiation (see seller_router.py)
+
+    - new negotiations are spread over the active nodes (round robin)
+    - messages of a negotiation are routed to the node encoded in its id (see routing_helpers.build_nego_id)
+      or to the peer which received the negotiation when its owner was drained
+    - drain(node) transfers the live negotiations of a node to the other active nodes (see handoff_service.py)
+
+The routes of negotiations moved to a peer are only kept in memory by the front (a restarted front routes them
+to their drained owner, which answers with a 503). The front must not be restarted before moved negotiations expire.
+'''
+import json
+import threading
+import urllib2
+from helpers.cache_helpers import LruCache
+from helpers.routing_helpers import get_nego_owner, unpack_negos
+from helpers.messages_helpers import ADMIN_TOKEN_HEADER
+
+
+class RouterService(object):
+
+    '''
+    CONSTANTS
+    '''
+    FORWARD  = 'forward'
+    REDIRECT = 'redirect'
+    # Timeout (in seconds) of requests sent to nodes
+    DEFAULT_TIMEOUT    = 60
+    # Maximum number of negotiations transferred per handoff request
+    DEFAULT_BATCH_SIZE = 500
+    # Negotiations moved to a peer are forgotten after this delay (in seconds, greater than the time to live of negotiations)
+    MOVED_TTL          = 3600
+    MAX_MOVED          = 1000000
+
+    '''
+    ATTRIBUTES
+
+    mode          = routing mode (FORWARD = messages are forwarded to nodes, REDIRECT = buyers are redirected)
+
+    _nodes        = dictionary of base uris of nodes indexed by node id
+    _active       = list of ids of nodes accepting new negotiations
+    _moved        = LruCache of node ids indexed by id of negotiations moved to a peer
+    _next         = index of the next node receiving a new negotiation
+    _timeout      = timeout (in seconds) of requests sent to nodes
+    _admin_token  = token authenticating handoff requests sent to nodes
+    _nb_forwarded = number of messages forwarded
+    _nb_failed    = number of messages which couldn't be forwarded (node unreachable)
+    _lock         = lock protecting the list of active nodes and the round robin
+    '''
+
+    def __init__(self, nodes = None, mode = FORWARD, timeout = DEFAULT_TIMEOUT, admin_token = ''):
+        '''
+        Constructor
+
+        Parameters:
+            nodes       = dictionary of base uris of nodes (ie: http://10.0.0.1:8082) indexed by node id
+            mode        = routing mode (FORWARD or REDIRECT)
+            timeout     = timeout (in seconds) of requests sent to nodes
+            admin_token = token authenticating handoff requests sent to nodes (see ADMIN_TOKEN_PATH in seller_demo.py)
+        '''
+        if not mode in [RouterService.FORWARD, RouterService.REDIRECT]: raise ValueError('Invalid routing mode %s' % mode)
+        self.mode          = mode
+        self._nodes        = dict()
+        self._active       = []
+        self._moved        = LruCache(RouterService.MAX_MOVED, RouterService.MOVED_TTL)
+        self._next         = 0
+        self._timeout      = timeout
+        self._admin_token  = admin_token
+        self._nb_forwarded = 0
+        self._nb_failed    = 0
+        self._lock         = threading.Lock()
+        for (node_id, uri) in (nodes or {}).items(): self.add_node(node_id, uri)
+
+    def add_node(self, node_id, uri):
+        '''
+        Adds a node accepting new negotiations
+
+        Parameters:
+            node_id = id of the node (encoded in the ids of its negotiations)
+            uri     = base uri of the node (ie: http://10.0.0.1:8082)
+        '''
+        with self._lock:
+            self._nodes[node_id] = uri.rstrip('/')
+            if not node_id in self._active: self._active = sorted(self._active + [node_id])
+
+    def route(self, nid):
+        '''
+        Returns the id of the node processing a message (None if no node is available)
+
+        Parameters:
+            nid = id of the negotiation of the message ('' = new negotiation)
+        '''
+        if nid:
+            node_id = self._moved.get(nid) or get_nego_owner(nid)
+            if node_id in self._nodes: return node_id
+        # New negotiation (or unknown owner). Picks an active node.
+        with self._lock:
+            active = self._active
+            if not active: return None
+            self._next = (self._next + 1) % len(active)
+            return active[self._next]
+
+    def get_uri(self, node_id, path, query = ''):
+        '''
+        Returns the uri of a resource of a node
+
+        Parameters:
+            node_id = id of the node
+            path    = path of the resource (ie: /bargain)
+            query   = query string
+        '''
+        uri = self._nodes[node_id] + path
+        return uri + '?' + query if query else uri
+
+    def forward(self, node_id, pbuff, headers, query = ''):
+        '''
+        Forwards a message to a node
+        Returns a tuple (http status, body, dictionary of http headers). Status is 502 if the node is unreachable.
+
+        Parameters:
+            node_id = id of the node
+            pbuff   = protobuff message
+            headers = dictionary of http headers forwarded to the node
+            query   = query string forwarded to the node
+        '''
+        req = urllib2.Request(self.get_uri(node_id, '/bargain', query), pbuff, headers)
+        try:
+            resp = urllib2.urlopen(req, timeout = self._timeout)
+            try:
+                res = (resp.getcode(), resp.read(), dict(resp.info().items()))
+            finally:
+                resp.close()
+        except urllib2.HTTPError, e:
+            res = (e.code, e.read(), dict(e.info().items()))
+        except Exception:
+            self._nb_failed += 1
+            return (502, '', {})
+        self._nb_forwarded += 1
+        return res
+
+    def drain(self, node_id, batch_size = DEFAULT_BATCH_SIZE):
+        '''
+        Transfers the live negotiations of a node to the other active nodes (the node stops accepting new negotiations)
+        Negotiations refused by peers (ie: store full) are kept by the node.
+        Returns a dictionary (transferred = dictionary of numbers of negotiations transferred indexed by peer,
+                              kept = list of ids of negotiations refused by peers)
+
+        Parameters:
+            node_id    = id of the drained node
+            batch_size = maximum number of negotiations transferred per request
+        '''
+        with self._lock:
+            if not node_id in self._nodes: raise ValueError('Unknown node %s' % node_id)
+            self._active = [n for n in self._active if n != node_id]
+            peers = list(self._active)
+        if not peers: raise ValueError('No peer available')
+        transferred = dict([(p, 0) for p in peers])
+        kept = []
+        idx = 0
+        while True:
+            # Each batch is exported, imported, routed and committed before the next one
+            data = self._admin(node_id, 'export', 'max=%d' % batch_size)
+            if not data: break
+            peer = peers[idx % len(peers)]
+            idx += 1
+            try:
+                imported = json.loads(self._admin(peer, 'import', data = data))
+            except Exception:
+                self._admin(node_id, 'abort')
+                raise
+            # Only negotiations stored by the peer are routed to it and deleted by the node
+            imported = set(imported)
+            for (nid, network, chain) in unpack_negos(data):
+                if nid in imported: self._moved.set(nid, peer)
+                else: kept.append(nid)
+            self._admin(node_id, 'commit', data = json.dumps(sorted(imported)))
+            transferred[peer] += len(imported)
+        return {'transferred': transferred, 'kept': kept}
+
+    def get_stats(self):
+        '''
+        Gets counters about routing
+        '''
+        return {'nodes'    : len(self._nodes),
+                'active'   : len(self._active),
+                'moved'    : len(self._moved),
+                'forwarded': self._nb_forwarded,
+                'failed'   : self._nb_failed}
+
+    def get_nodes(self):
+        '''
+        Returns a dictionary describing the nodes (uri, active) indexed by node id
+        '''
+        return dict([(n, {'uri': uri, 'active': n in self._active}) for (n, uri) in self._nodes.items()])
+
+    def _admin(self, node_id, action, query = '', data = ''):
+        '''
+        Sends a handoff request to a node and returns the body of the response
+        '''
+        query = 'action=%s&%s' % (action, query) if query else 'action=%s' % action
+        headers = {'Content-Type': 'application/octet-stream', ADMIN_TOKEN_HEADER: self._admin_token}
+        req = urllib2.Request(self.get_uri(node_id, '/handoff', query), data, headers)
+        resp = urllib2.urlopen(req, timeout = self._timeout)
+        try:
+            return resp.read()
+        finally:
+            resp.close()
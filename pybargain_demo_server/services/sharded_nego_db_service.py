@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+A class spreading Negotiations over several stores.
+The store used for a negotiation is selected with a hash of its id.
+'''
+import zlib
+from itertools import chain
+from services.nego_db_service import NegoDbService
+
+
+class ShardedNegoDbService(NegoDbService):
+
+    '''
+    ATTRIBUTES
+
+    _stores = list of NegoDbService (one per shard)
+    '''
+
+    def __init__(self, stores):
+        '''
+        Constructor
+
+        Parameters:
+            stores = list of NegoDbService (one per shard)
+        '''
+        if not stores: raise ValueError('At least one store is required')
+        self._stores = list(stores)
+
+    def create_nego(self, nid, nego):
+        if not nid: return False
+        return self.get_store(nid).create_nego(nid, nego)
+
+    def update_nego(self, nid, nego):
+        if not nid: return False
+        return self.get_store(nid).update_nego(nid, nego)
+
+    def delete_nego(self, nid):
+        if not nid: return False
+        return self.get_store(nid).delete_nego(nid)
+
+    def get_nego_by_id(self, nid):
+        if not nid: return None
+        return self.get_store(nid).get_nego_by_id(nid)
+
+    def get_all_negos(self):
+        return list(chain.from_iterable([s.get_all_negos() for s in self._stores]))
+
+    def count_negos(self):
+        return sum([s.count_negos() for s in self._stores])
+
+    def reap_negos(self, now = None):
+        return sum([s.reap_negos(now) for s in self._stores])
+
+    def get_stats(self):
+        stats = dict()
+        for store in self._stores:
+            for (k, v) in store.get_stats().items(): stats[k] = stats.get(k, 0) + v
+        return stats
+
+    def get_store(self, nid):
+        '''
+        Returns the store associated to a negotiation id
+
+        Parameters:
+            nid = id of the negotiation
+        '''
+        return self._stores[(zlib.crc32(str(nid)) & 0xffffffff) % len(self._stores)]
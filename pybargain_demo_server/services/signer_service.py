@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+'''
+A class signing messages sent by the seller
+
+Messages are signed by BargainingMessage.sign() which relies on the ECDSA implementation of pybitcointools.
+The ECDSA backend used by pybitcointools can be replaced at startup (see install_backend()):
+    - 'python'    = pure python implementation using a precomputed table of multiples of the generator
+                    (built and checked on the first signature, not at startup)
+    - 'coincurve' = libsecp256k1 bindings (optional dependency)
+    - 'auto'      = coincurve if available, python otherwise
+Both backends use the same deterministic nonces than pybitcointools and produce the same signatures.
+The backend is also installed in modules which imported the function of pybitcointools (ie: from bitcoin import *)
+and install_backend() checks that BargainingMessage.sign() calls it.
+'''
+import sys
+import threading
+import bitcoin.main as btc
+from pybargain_protocol.constants import SIGN_ECDSA_SHA256, TYPE_BARGAIN_CANCELLATION
+from pybargain_protocol.bargaining_message import BargainingMessage
+from pybargain_protocol.bargaining_cancellation import BargainingCancellationDetails
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+
+class SignerService(object):
+
+    '''
+    ATTRIBUTES
+
+    executor = executor running signatures (object providing apply(func, args)). None = calling thread
+
+    _privkey = private key used to sign messages
+    _pubkey  = public key (precomputed)
+    '''
+
+    def __init__(self, privkey, pubkey = None, executor = None):
+        '''
+        Constructor
+
+        Parameters:
+            privkey  = private key used to sign messages
+            pubkey   = public key (derived from private key if not provided)
+            executor = executor running signatures (ie: a thread pool)
+        '''
+        self.executor = executor
+        self._privkey = privkey
+        self._pubkey  = pubkey if pubkey else btc.privtopub(privkey)
+
+    @property
+    def pubkey(self):
+        return self._pubkey
+
+    def sign(self, msg, last_msg):
+        '''
+        Signs a message
+
+        Parameters:
+            msg      = BargainingMessage to sign
+            last_msg = last message of the negotiation
+        '''
+        args = (last_msg, SIGN_ECDSA_SHA256, self._pubkey, self._privkey)
+        if self.executor is None: msg.sign(*args)
+        else: self.executor.apply(msg.sign, args)
+
+
+
+class PythonEcdsaBackend(object):
+    '''
+    Pure python ECDSA signature
+    k*G is computed with a precomputed table of multiples of the generator (fixed base comb)
+    instead of a double and add multiplication. The table is built on first use.
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    # Number of bits of the scalar processed per table lookup
+    WINDOW = 8
+
+    '''
+    ATTRIBUTES
+
+    _table = table of multiples of the generator (None = not built yet)
+    _lock  = lock protecting the build of the table
+    '''
+
+    def __init__(self):
+        self._table = None
+        self._lock  = threading.Lock()
+
+    def multiply_generator(self, k):
+        '''
+        Returns k*G (affine coordinates)
+        '''
+        mask = (1 << PythonEcdsaBackend.WINDOW) - 1
+        res = (0, 0, 1)
+        for row in self._get_table():
+            if k & mask: res = btc.jacobian_add(res, row[k & mask])
+            k >>= PythonEcdsaBackend.WINDOW
+        return btc.from_jacobian(res)
+
+    def ecdsa_raw_sign(self, msghash, priv):
+        '''
+        Same as bitcoin.main.ecdsa_raw_sign
+        '''
+        z = btc.hash_to_int(msghash)
+        k = btc.deterministic_generate_k(msghash, priv)
+        r, y = self.multiply_generator(k)
+        s = btc.inv(k, btc.N) * (z + r * btc.decode_privkey(priv)) % btc.N
+        v, r, s = 27 + ((y % 2) ^ (0 if s * 2 < btc.N else 1)), r, s if s * 2 < btc.N else btc.N - s
+        if 'compressed' in btc.get_privkey_format(priv): v += 4
+        return v, r, s
+
+    def _get_table(self):
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    # table[i][j] = j * 2^(WINDOW*i) * G (jacobian coordinates)
+                    table = []
+                    base = btc.to_jacobian(btc.G)
+                    for i in range(256 / PythonEcdsaBackend.WINDOW):
+                        row = [(0, 0, 1), base]
+                        for j in range(2, 1 << PythonEcdsaBackend.WINDOW): row.append(btc.jacobian_add(row[-1], base))
+                        table.append(row)
+                        base = btc.jacobian_add(row[-1], base)
+                    self._table = table
+        return self._table
+
+
+
+class CoincurveEcdsaBackend(object):
+    '''
+    ECDSA signature computed by libsecp256k1 (coincurve bindings)
+    libsecp256k1 uses RFC6979 nonces and low s values, as pybitcointools.
+    '''
+
+    def __init__(self):
+        if coincurve is None: raise ImportError('coincurve is not installed')
+        # Cache of coincurve keys indexed by private key
+        self._keys = dict()
+
+    def ecdsa_raw_sign(self, msghash, priv):
+        '''
+        Same as bitcoin.main.ecdsa_raw_sign
+        '''
+        key = self._keys.get(priv, None)
+        if key is None:
+            key = coincurve.PrivateKey(btc.encode_privkey(priv, 'bin'))
+            self._keys[priv] = key
+        z = btc.encode(btc.hash_to_int(msghash), 256, 32)
+        sig = key.sign_recoverable(z, hasher = None)
+        r, s, recid = btc.decode(sig[0:32], 256), btc.decode(sig[32:64], 256), ord(sig[64:65])
+        v = 27 + recid
+        if 'compressed' in btc.get_privkey_format(priv): v += 4
+        return v, r, s
+
+
+
+class CheckedEcdsaBackend(object):
+    '''
+    Backend checked on its first signature (keeps the cost of the check, ie: table of the python backend, out of startup)
+    Signatures are computed by pybitcointools if the backend doesn't produce the same signatures.
+    '''
+
+    '''
+    ATTRIBUTES
+
+    _backend = checked backend
+    _func    = function computing signatures (None = not checked yet)
+    _lock    = lock protecting the check
+    '''
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._func    = None
+        self._lock    = threading.Lock()
+
+    def ecdsa_raw_sign(self, msghash, priv):
+        if self._func is None:
+            with self._lock:
+                if self._func is None:
+                    self._func = self._backend.ecdsa_raw_sign if check_backend(self._backend) else _default_ecdsa_raw_sign
+        return self._func(msghash, priv)
+
+
+
+'''
+BACKEND SELECTION
+'''
+BACKENDS = {'python': PythonEcdsaBackend, 'coincurve': CoincurveEcdsaBackend}
+# Backends checked on their first signature (see CheckedEcdsaBackend)
+LAZY_BACKENDS = ['python']
+
+# Reference implementation of pybitcointools and implementation currently installed
+_default_ecdsa_raw_sign   = btc.ecdsa_raw_sign
+_installed_ecdsa_raw_sign = btc.ecdsa_raw_sign
+
+
+def check_backend(backend):
+    '''
+    Checks that a backend produces the same signatures than pybitcointools
+
+    Parameters:
+        backend = ECDSA backend
+    '''
+    privkey = btc.sha256('Test key of the ecdsa backend')
+    msghash = btc.bin_sha256('Test message of the ecdsa backend')
+    return backend.ecdsa_raw_sign(msghash, privkey) == _default_ecdsa_raw_sign(msghash, privkey)
+
+
+def build_backend(name, lazy = False):
+    '''
+    Builds an ECDSA backend
+    Returns None if the backend is not available or doesn't produce the same signatures than pybitcointools
+
+    Parameters:
+        name = name of the backend ('python', 'coincurve')
+        lazy = flag indicating if the backend is checked on its first signature (see CheckedEcdsaBackend)
+    '''
+    try:
+        backend = BACKENDS[name]()
+    except ImportError:
+        return None
+    if lazy: return CheckedEcdsaBackend(backend)
+    return backend if check_backend(backend) else None
+
+
+def is_backend_called():
+    '''
+    Checks that BargainingMessage.sign() calls the installed ECDSA function
+    (pybargain_protocol may have bound the function of pybitcointools when it has been imported)
+    '''
+    calls = []
+    def probe(msghash, priv):
+        calls.append(msghash)
+        return _default_ecdsa_raw_sign(msghash, priv)
+    installed = _installed_ecdsa_raw_sign
+    _set_ecdsa_raw_sign(probe)
+    try:
+        privkey = btc.sha256('Test key of the ecdsa backend')
+        msg = BargainingMessage(TYPE_BARGAIN_CANCELLATION, BargainingCancellationDetails(0L, '', '', 'Check of the signer'))
+        msg.sign(None, SIGN_ECDSA_SHA256, btc.privtopub(privkey), privkey)
+    finally:
+        _set_ecdsa_raw_sign(installed)
+    return len(calls) > 0
+
+
+def install_backend(name = 'auto'):
+    '''
+    Replaces the ECDSA implementation used by pybitcointools
+    Returns the name of the installed backend ('default' if no backend has been installed
+    or if BargainingMessage.sign() doesn't call it)
+
+    Parameters:
+        name = name of the backend ('auto', 'python', 'coincurve', 'default')
+    '''
+    names = ['coincurve', 'python'] if name == 'auto' else [name]
+    for n in names:
+        backend = build_backend(n, n in LAZY_BACKENDS) if n in BACKENDS else None
+        if not backend is None:
+            _set_ecdsa_raw_sign(backend.ecdsa_raw_sign)
+            if is_backend_called(): return n
+            break
+    _set_ecdsa_raw_sign(_default_ecdsa_raw_sign)
+    return 'default'
+
+
+def _set_ecdsa_raw_sign(func):
+    '''
+    Replaces the ECDSA function in pybitcointools and in the modules which imported it
+    '''
+    global _installed_ecdsa_raw_sign
+    for module in sys.modules.values():
+        if module is None: continue
+        current = getattr(module, 'ecdsa_raw_sign', None)
+        if (current is _installed_ecdsa_raw_sign) or (current is _default_ecdsa_raw_sign): module.ecdsa_raw_sign = func
+    btc.ecdsa_raw_sign = func
+    _installed_ecdsa_raw_sign = func
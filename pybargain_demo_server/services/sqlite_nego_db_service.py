@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+'''
+A class storing Negotiations in a sqlite database.
+Negotiations are stored as their serialized chain of messages.
+The db file can be shared by several processes (ie: gunicorn workers).
+
+In append only mode, update_nego() only writes the messages appended since the last write
+into a log table. The negotiation is rebuilt on load by replaying its chain and its log.
+The log of a negotiation is periodically merged into its chain (compaction).
+
+The expiry index is an index of the negos table on the expires column.
+
+Updates are checked with an optimistic version check: a negotiation is updated only if the number of
+messages stored in db hasn't changed since it has been loaded (ie: a concurrent update by another process).
+The number of messages stored when the negotiation has been loaded is kept by the negotiation (db_length attribute)
+so that the check doesn't depend on the thread loading or updating it (ie: pool of executor threads).
+
+count_negos() returns a live counter maintained by the instance instead of scanning the table.
+The counter only sees the writes of its process. It's synchronized with the db when negotiations are reaped
+(the drift due to other processes sharing the db file is bounded by the period of the reaper).
+'''
+import os
+import sqlite3
+import threading
+from helpers.nego_helpers import serialize_msg, serialize_nego, deserialize_nego, get_current_time, is_nego_finished
+from services.nego_db_service import NegoDbService
+
+
+class SqliteNegoDbService(NegoDbService):
+
+    '''
+    CONSTANTS
+    '''
+    # Default number of log records triggering the compaction of a negotiation
+    COMPACTION_THRESHOLD = 64
+
+    '''
+    ATTRIBUTES
+
+    bytes_written         = number of bytes of serialized messages written by this instance
+
+    _path                 = path of the sqlite db file
+    _append_only          = flag indicating if updates are written in the log
+    _compaction_threshold = number of log records triggering the compaction of a negotiation (0 = no compaction)
+    _local                = thread local storage (one connection per thread and per process)
+    _live                 = number of negotiations stored in db (live counter, see count_negos)
+    _live_lock            = lock protecting the live counter
+
+    Negotiations returned by the service have a db_length attribute (number of messages stored in db when loaded)
+    '''
+
+    def __init__(self, path, append_only = False, compaction_threshold = COMPACTION_THRESHOLD,
+                 ttl = NegoDbService.DEFAULT_TTL, finished_ttl = NegoDbService.DEFAULT_FINISHED_TTL):
+        '''
+        Constructor
+
+        Parameters:
+            path                 = path of the sqlite db file
+            append_only          = flag indicating if updates are written in the log
+            compaction_threshold = number of log records triggering the compaction of a negotiation (0 = no compaction)
+            ttl                  = time to live (in seconds) of a negotiation without RequestACK message
+            finished_ttl         = time to live (in seconds) of a finished negotiation
+        '''
+        super(SqliteNegoDbService, self).__init__(ttl, finished_ttl)
+        self.bytes_written         = 0
+        self._path                 = path
+        self._append_only          = append_only
+        self._compaction_threshold = compaction_threshold
+        self._local                = threading.local()
+        conn = self._get_conn()
+        # negos.length = number of messages stored (chain + log)
+        # negos.chain_length = number of messages stored in chain
+        conn.execute('CREATE TABLE IF NOT EXISTS negos (nid TEXT PRIMARY KEY, network TEXT, chain BLOB, '
+                     'length INTEGER, chain_length INTEGER, expires INTEGER, finished INTEGER)')
+        conn.execute('CREATE INDEX IF NOT EXISTS negos_expires ON negos (expires)')
+        conn.execute('CREATE TABLE IF NOT EXISTS nego_log (nid TEXT, idx INTEGER, record BLOB, PRIMARY KEY (nid, idx))')
+        self._live_lock            = threading.Lock()
+        self._live                 = self._count_rows(conn)
+
+    def create_nego(self, nid, nego):
+        # Checks parameters
+        if not (nid and self._check_nego(nego)):
+            return False
+        chain = serialize_nego(nego)
+        try:
+            self._get_conn().execute('INSERT INTO negos (nid, network, chain, length, chain_length, expires, finished) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (nid, nego.network, sqlite3.Binary(chain), nego.length(), nego.length(),
+                                      self._get_expiry(nego), is_nego_finished(nego)))
+            self.bytes_written += len(chain)
+            nego.db_length = nego.length()
+            self._add_live(1)
+            return True
+        except sqlite3.IntegrityError:
+            # A nego with same id has already been stored in db
+            return False
+
+    def update_nego(self, nid, nego):
+        # Checks parameters
+        if not (nid and self._check_nego(nego)):
+            return False
+        # Number of messages stored in db when the nego has been loaded (None = unknown)
+        loaded_length = getattr(nego, 'db_length', None)
+        if not self._append_only:
+            chain = serialize_nego(nego)
+            cur = self._get_conn().execute('UPDATE negos SET chain = ?, length = ?, chain_length = ?, expires = ?, finished = ? '
+                                           'WHERE nid = ? AND (? IS NULL OR length = ?)',
+                                           (sqlite3.Binary(chain), nego.length(), nego.length(),
+                                            self._get_expiry(nego), is_nego_finished(nego), nid, loaded_length, loaded_length))
+            if cur.rowcount != 1: return False
+            self.bytes_written += len(chain)
+            nego.db_length = nego.length()
+            return True
+        # Append only mode
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT length, chain_length FROM negos WHERE nid = ?', (nid,)).fetchone()
+            if (row is None) or not (loaded_length is None or loaded_length == row[0]):
+                conn.execute('ROLLBACK')
+                return False
+            length, chain_length = row
+            # Writes the new messages in the log
+            records = [serialize_msg(nego.get_msg_at_idx(idx)) for idx in range(length, nego.length())]
+            conn.executemany('INSERT INTO nego_log (nid, idx, record) VALUES (?, ?, ?)',
+                             [(nid, length + i, sqlite3.Binary(r)) for (i, r) in enumerate(records)])
+            conn.execute('UPDATE negos SET length = ?, expires = ?, finished = ? WHERE nid = ?',
+                         (max(length, nego.length()), self._get_expiry(nego), is_nego_finished(nego), nid))
+            conn.execute('COMMIT')
+        except sqlite3.IntegrityError:
+            # Messages with same indices have been written by another process (concurrent update)
+            conn.execute('ROLLBACK')
+            return False
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        self.bytes_written += sum([len(r) for r in records])
+        nego.db_length = max(length, nego.length())
+        # Compacts the negotiation if its log is too long
+        if self._compaction_threshold and (nego.length() - chain_length >= self._compaction_threshold):
+            self.compact_nego(nid)
+        return True
+
+    def delete_nego(self, nid):
+        # Checks parameter
+        if not nid: return False
+        conn = self._get_conn()
+        cur = conn.execute('DELETE FROM negos WHERE nid = ?', (nid,))
+        conn.execute('DELETE FROM nego_log WHERE nid = ?', (nid,))
+        if cur.rowcount != 1: return False
+        self._add_live(-1)
+        return True
+
+    def get_nego_by_id(self, nid):
+        if not nid: return None
+        conn = self._get_conn()
+        row = conn.execute('SELECT network, chain, length, chain_length FROM negos WHERE nid = ?', (nid,)).fetchone()
+        if row is None: return None
+        network, chain, length, chain_length = row
+        if length > chain_length: chain = self._replay(conn, nid, chain, chain_length)
+        nego = deserialize_nego(nid, network, chain)
+        nego.db_length = length
+        return nego
+
+    def get_all_negos(self):
+        conn = self._get_conn()
+        rows = conn.execute('SELECT nid, network, chain, length, chain_length FROM negos').fetchall()
+        negos = []
+        for (nid, network, chain, length, chain_length) in rows:
+            if length > chain_length: chain = self._replay(conn, nid, chain, chain_length)
+            nego = deserialize_nego(nid, network, chain)
+            nego.db_length = length
+            negos.append(nego)
+        return negos
+
+    def count_negos(self):
+        with self._live_lock:
+            return self._live
+
+    def reap_negos(self, now = None):
+        now  = get_current_time() if now is None else now
+        conn = self._get_conn()
+        rows = conn.execute('SELECT nid, finished FROM negos WHERE expires <= ?', (now,)).fetchall()
+        nb_reaped = 0
+        for (nid, finished) in rows:
+            # Checks the nego has not been updated since the select
+            cur = conn.execute('DELETE FROM negos WHERE nid = ? AND expires <= ?', (nid, now))
+            if cur.rowcount != 1: continue
+            conn.execute('DELETE FROM nego_log WHERE nid = ?', (nid,))
+            self._count_reaped(finished)
+            nb_reaped += 1
+        # Synchronizes the live counter with the db (negotiations written by other processes)
+        live = self._count_rows(conn)
+        with self._live_lock:
+            self._live = live
+        return nb_reaped
+
+    def compact_nego(self, nid):
+        '''
+        Merges the log of a negotiation into its chain
+        Returns True if the negotiation has been compacted
+
+        Parameters:
+            nid = id of the negotiation
+        '''
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT chain, length, chain_length FROM negos WHERE nid = ?', (nid,)).fetchone()
+            if (row is None) or (row[1] == row[2]):
+                conn.execute('ROLLBACK')
+                return False
+            chain = self._replay(conn, nid, row[0], row[2])
+            conn.execute('UPDATE negos SET chain = ?, chain_length = ? WHERE nid = ?', (sqlite3.Binary(chain), row[1], nid))
+            conn.execute('DELETE FROM nego_log WHERE nid = ?', (nid,))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        self.bytes_written += len(chain)
+        return True
+
+    def compact_all(self):
+        '''
+        Merges the logs of all negotiations into their chains
+        '''
+        nids = [r[0] for r in self._get_conn().execute('SELECT nid FROM negos WHERE length > chain_length').fetchall()]
+        for nid in nids: self.compact_nego(nid)
+
+    def _count_rows(self, conn):
+        return conn.execute('SELECT COUNT(*) FROM negos').fetchone()[0]
+
+    def _add_live(self, delta):
+        with self._live_lock:
+            self._live = max(0, self._live + delta)
+
+    def _replay(self, conn, nid, chain, chain_length):
+        '''
+        Returns the chain of a negotiation completed with the records stored in its log
+        '''
+        rows = conn.execute('SELECT record FROM nego_log WHERE nid = ? AND idx >= ? ORDER BY idx', (nid, chain_length)).fetchall()
+        return str(chain) + ''.join([str(r[0]) for r in rows])
+
+    def _get_conn(self):
+        '''
+        Returns the connection to the db for current thread
+        A new connection is opened if the process has been forked since the last call
+        '''
+        conn = getattr(self._local, 'conn', None)
+        if (conn is None) or (self._local.pid != os.getpid()):
+            # Autocommit mode. Each statement is a transaction
+            conn = sqlite3.connect(self._path, timeout = 30, isolation_level = None)
+            # WAL allows concurrent readers while a process writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid  = os.getpid()
+        return conn
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+'''
+Pricing strategies used by the negotiator to compute new offers
+
+A strategy receives a compact numeric history of a negotiation (offers of the seller, offers and fees of the buyer).
+Strategies can evaluate a single negotiation (compute_offer) or many live negotiations at once (compute_offers),
+ie: to reprice all open offers when a price floor changes. Batches are evaluated with NumPy if available.
+'''
+import random
+from pybargain_protocol.constants import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+class OfferHistory(object):
+    '''
+    Numeric history of the offers of a negotiation (amounts in satoshis, oldest first)
+    '''
+
+    __slots__ = ('seller_offers', 'buyer_offers', 'buyer_fees')
+
+    '''
+    ATTRIBUTES
+
+    seller_offers = list of amounts offered by the seller (RequestACK and ProposalACK messages)
+    buyer_offers  = list of amounts offered by the buyer (Proposal messages)
+    buyer_fees    = list of fees paid by the buyer (Proposal messages)
+    '''
+
+    def __init__(self, seller_offers = None, buyer_offers = None, buyer_fees = None):
+        self.seller_offers = seller_offers or []
+        self.buyer_offers  = buyer_offers or []
+        self.buyer_fees    = buyer_fees or []
+
+    def get_seller_last_offer(self):
+        return self.seller_offers[-1]
+
+    def get_buyer_last_offer(self):
+        '''
+        Returns the last offer of the buyer (amount + fees)
+        '''
+        return self.buyer_offers[-1] + self.buyer_fees[-1]
+
+
+def build_offer_history(nego):
+    '''
+    Builds the history of offers of a negotiation (single pass over the chain of messages)
+
+    Parameters:
+        nego = Negotiation
+    '''
+    history = OfferHistory()
+    for idx in range(nego.length()):
+        msg = nego.get_msg_at_idx(idx)
+        if msg.msg_type in (TYPE_BARGAIN_REQUEST_ACK, TYPE_BARGAIN_PROPOSAL_ACK):
+            history.seller_offers.append(msg.details.amount)
+        elif msg.msg_type == TYPE_BARGAIN_PROPOSAL:
+            history.buyer_offers.append(msg.details.amount)
+            history.buyer_fees.append(msg.details.fees)
+    return history
+
+
+
+class PricingStrategy(object):
+    '''
+    Interface of a pricing strategy
+    '''
+
+    def compute_offer(self, history):
+        '''
+        Returns the new offer of the seller (amount in satoshis)
+
+        Parameters:
+            history = OfferHistory (at least one offer of the seller and one offer of the buyer)
+        '''
+        raise NotImplementedError()
+
+    def compute_offers(self, histories):
+        '''
+        Returns the list of new offers for a list of negotiations
+        Default implementation calls compute_offer() for each negotiation
+
+        Parameters:
+            histories = list of OfferHistory
+        '''
+        return [self.compute_offer(h) for h in histories]
+
+
+
+class RandomDiscountStrategy(PricingStrategy):
+    '''
+    Default strategy of the demo
+        - the seller keeps its last offer with a given probability
+        - the seller accepts the offer of the buyer if the gap is small
+        - the seller keeps its last offer if the gap is medium
+        - otherwise the seller gives a random discount (up to half the gap, never below the offer of the buyer)
+    New offers are never below the price floor.
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    KEEP_PROBABILITY = 0.1
+    # Gaps (in satoshis) under which the seller accepts the offer of the buyer / keeps its last offer
+    ACCEPT_GAP       = 1000000
+    KEEP_GAP         = 2000000
+    # Discounted offers are rounded to this unit (in satoshis)
+    ROUNDING         = 100000
+
+    '''
+    ATTRIBUTES
+
+    floor    = minimum price (in satoshis)
+
+    _rnd     = random generator (random module or random.Random instance)
+    _np_rnd  = numpy random generator (batch evaluation)
+    '''
+
+    def __init__(self, floor = 0, seed = None):
+        '''
+        Constructor
+
+        Parameters:
+            floor = minimum price (in satoshis)
+            seed  = seed of random generators (None = random module)
+        '''
+        self.floor   = floor
+        self._rnd    = random if seed is None else random.Random(seed)
+        self._np_rnd = None if np is None else np.random.RandomState(seed)
+
+    def compute_offer(self, history):
+        seller_last_offer = history.get_seller_last_offer()
+        buyer_last_offer  = history.get_buyer_last_offer()
+        if self._rnd.random() < RandomDiscountStrategy.KEEP_PROBABILITY:
+            new_offer = seller_last_offer
+        else:
+            gap = seller_last_offer - buyer_last_offer
+            if gap < RandomDiscountStrategy.ACCEPT_GAP:
+                new_offer = buyer_last_offer
+            elif gap < RandomDiscountStrategy.KEEP_GAP:
+                new_offer = seller_last_offer
+            else:
+                discount = int(self._rnd.random() * gap / 2)
+                new_offer = round_amount(seller_last_offer - discount, RandomDiscountStrategy.ROUNDING)
+                new_offer = max(buyer_last_offer, new_offer)
+        return max(new_offer, self.floor)
+
+    def compute_offers(self, histories):
+        if np is None: return super(RandomDiscountStrategy, self).compute_offers(histories)
+        seller = np.fromiter((h.get_seller_last_offer() for h in histories), np.int64, len(histories))
+        buyer  = np.fromiter((h.get_buyer_last_offer() for h in histories), np.int64, len(histories))
+        return self.compute_offers_array(seller, buyer).tolist()
+
+    def compute_offers_array(self, seller, buyer):
+        '''
+        Returns the array of new offers for arrays of last offers (NumPy required)
+
+        Parameters:
+            seller = array of last offers of the seller (int64)
+            buyer  = array of last offers of the buyer (amount + fees, int64)
+        '''
+        n = len(seller)
+        keep = self._np_rnd.random_sample(n) < RandomDiscountStrategy.KEEP_PROBABILITY
+        gap = seller - buyer
+        discount = (self._np_rnd.random_sample(n) * gap / 2).astype(np.int64)
+        rounding = RandomDiscountStrategy.ROUNDING
+        discounted = np.maximum(buyer, (seller - discount) // rounding * rounding)
+        offers = np.where(gap < RandomDiscountStrategy.ACCEPT_GAP, buyer,
+                          np.where(gap < RandomDiscountStrategy.KEEP_GAP, seller, discounted))
+        offers = np.where(keep, seller, offers)
+        return np.maximum(offers, self.floor)
+
+
+
+'''
+UTILITY FUNCTIONS
+'''
+def round_amount(x, unit):
+    return (x / unit) * unit
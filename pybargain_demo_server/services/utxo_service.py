@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+'''
+A class computing the sum of unspent inputs of transactions (used to precheck the transactions of proposals)
+
+Values of outpoints are provided by a pluggable backend:
+    - BlockrUtxoBackend = values retrieved from blockr.io (batched queries)
+    - StubUtxoBackend   = local stub (offline tests and load benchmarks)
+
+Values are cached (LRU + TTL) and cache misses are fetched with a single backend query.
+In non blocking mode, missing values are fetched by a background thread (see prefetch()).
+'''
+import json
+import time
+import threading
+from Queue import Queue, Empty
+from bitcoin.transaction import deserialize
+from pybargain_protocol.constants import TESTNET
+from helpers.cache_helpers import LruCache
+
+
+
+class UtxoBackend(object):
+    '''
+    Interface of a backend providing values of outpoints
+    '''
+
+    def get_unspent_values(self, outpoints, network):
+        '''
+        Returns a dictionary of values indexed by outpoint (value = 0 if outpoint is spent or unknown)
+
+        Parameters:
+            outpoints = list of outpoints (txid:index)
+            network   = network
+        '''
+        raise NotImplementedError()
+
+
+
+class BlockrUtxoBackend(UtxoBackend):
+    '''
+    Gets values of outpoints from blockr.io
+    Outpoints are queried in batches of transactions
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    API_URLS    = {TESTNET: 'http://tbtc.blockr.io/api/v1/tx/info/%s'}
+    DEFAULT_URL = 'http://btc.blockr.io/api/v1/tx/info/%s'
+    # Maximum number of transactions per query (limit of blockr api)
+    MAX_BATCH   = 20
+    TIMEOUT     = 10
+
+    def get_unspent_values(self, outpoints, network):
+        # Imported on demand (startup time of workers using another backend)
+        import urllib2
+        values = dict([(op, 0) for op in outpoints])
+        txids = sorted(set([op.split(':')[0] for op in outpoints]))
+        url = BlockrUtxoBackend.API_URLS.get(network, BlockrUtxoBackend.DEFAULT_URL)
+        for i in range(0, len(txids), BlockrUtxoBackend.MAX_BATCH):
+            batch = txids[i:i + BlockrUtxoBackend.MAX_BATCH]
+            resp = json.load(urllib2.urlopen(url % ','.join(batch), timeout = BlockrUtxoBackend.TIMEOUT))
+            data = resp.get('data', [])
+            # blockr returns an object instead of a list for a single tx
+            if isinstance(data, dict): data = [data]
+            for tx in data:
+                for vout in tx.get('vouts', []):
+                    op = '%s:%d' % (tx['tx'], vout['n'])
+                    if (op in values) and not vout.get('is_spent', 0):
+                        values[op] = int(round(float(vout['amount']) * 100000000))
+        return values
+
+
+
+class StubUtxoBackend(UtxoBackend):
+    '''
+    Local stub considering every outpoint as unspent
+    '''
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_VALUE = 100000000000
+
+    '''
+    ATTRIBUTES
+
+    nb_queries     = number of queries received by the backend
+
+    _values        = dictionary of values indexed by outpoint
+    _default_value = value of outpoints not found in _values
+    _latency       = simulated latency (in seconds) of a query
+    '''
+
+    def __init__(self, values = None, default_value = DEFAULT_VALUE, latency = 0):
+        '''
+        Constructor
+
+        Parameters:
+            values        = dictionary of values indexed by outpoint
+            default_value = value of outpoints not found in values
+            latency       = simulated latency (in seconds) of a query
+        '''
+        self.nb_queries     = 0
+        self._values        = values or dict()
+        self._default_value = default_value
+        self._latency       = latency
+
+    def get_unspent_values(self, outpoints, network):
+        self.nb_queries += 1
+        if self._latency: time.sleep(self._latency)
+        return dict([(op, self._values.get(op, self._default_value)) for op in outpoints])
+
+
+
+class UtxoService(object):
+
+    '''
+    CONSTANTS
+    '''
+    DEFAULT_CACHE_SIZE = 100000
+    DEFAULT_CACHE_TTL  = 60
+    DEFAULT_BATCH_SIZE = 100
+
+    '''
+    ATTRIBUTES
+
+    _backend    = UtxoBackend
+    _cache      = LruCache of values indexed by (network, outpoint)
+    _blocking   = flag indicating if missing values are fetched synchronously
+    _batch_size = maximum number of outpoints per backend query
+    _queue      = queue of prefetch jobs (outpoints, network, callback)
+    _thread     = background thread processing prefetch jobs
+    _lock       = lock protecting the start of the background thread
+    '''
+
+    def __init__(self, backend, cache_size = DEFAULT_CACHE_SIZE, cache_ttl = DEFAULT_CACHE_TTL,
+                 blocking = True, batch_size = DEFAULT_BATCH_SIZE):
+        '''
+        Constructor
+
+        Parameters:
+            backend    = UtxoBackend
+            cache_size = maximum number of outpoints stored in cache
+            cache_ttl  = time to live (in seconds) of cached values
+            blocking   = flag indicating if missing values are fetched synchronously
+            batch_size = maximum number of outpoints per backend query
+        '''
+        self._backend    = backend
+        self._cache      = LruCache(cache_size, cache_ttl)
+        self._blocking   = blocking
+        self._batch_size = batch_size
+        self._queue      = Queue()
+        self._thread     = None
+        self._lock       = threading.Lock()
+
+    def __call__(self, txs, network = TESTNET):
+        '''
+        Returns the sum of unspent inputs of a transaction (or a list of transactions)
+        Same signature as blockr_sum_unspent_inputs. An instance can be used as SUM_UNSPENT_FUNC.
+
+        Parameters:
+            txs     = transaction or list of transactions
+            network = network
+        '''
+        outpoints = get_outpoints(txs)
+        values = self._get_cached_values(outpoints, network)
+        missing = [op for op in outpoints if not op in values]
+        if missing: values.update(self._fetch(missing, network))
+        return sum([values[op] for op in outpoints])
+
+    def is_ready(self, txs, network):
+        '''
+        Checks if values of all inputs of transactions are available in cache
+
+        Parameters:
+            txs     = transaction or list of transactions
+            network = network
+        '''
+        return all([self._cache.contains((network, op)) for op in get_outpoints(txs)])
+
+    def prefetch(self, txs, network, callback = None):
+        '''
+        Fetches the values of inputs of transactions in background
+        The callback is called (without parameters) once the values are available in cache
+
+        Parameters:
+            txs      = transaction or list of transactions
+            network  = network
+            callback = function called when values are available in cache
+        '''
+        outpoints = [op for op in get_outpoints(txs) if not self._cache.contains((network, op))]
+        if not outpoints:
+            if callback: callback()
+            return
+        self._start()
+        self._queue.put((outpoints, network, callback))
+
+    def is_blocking(self):
+        return self._blocking
+
+    def get_stats(self):
+        '''
+        Gets counters about the cache of values
+        '''
+        return self._cache.get_stats()
+
+    def _get_cached_values(self, outpoints, network):
+        values = dict()
+        for op in outpoints:
+            value = self._cache.get((network, op))
+            if not value is None: values[op] = value
+        return values
+
+    def _fetch(self, outpoints, network):
+        '''
+        Gets values of outpoints from backend (by batches) and stores them in cache
+        '''
+        outpoints = list(set(outpoints))
+        values = dict()
+        for i in range(0, len(outpoints), self._batch_size):
+            values.update(self._backend.get_unspent_values(outpoints[i:i + self._batch_size], network))
+        for (op, value) in values.items(): self._cache.set((network, op), value)
+        return values
+
+    def _start(self):
+        with self._lock:
+            if (self._thread is None) or not self._thread.is_alive():
+                self._thread = threading.Thread(target = self._run, name = 'utxo-prefetch')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Groups pending jobs in a single backend query per network
+            jobs = [self._queue.get()]
+            try:
+                while sum([len(j[0]) for j in jobs]) < self._batch_size: jobs.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            for network in set([j[1] for j in jobs]):
+                outpoints = [op for j in jobs if j[1] == network for op in j[0]]
+                try:
+                    self._fetch(outpoints, network)
+                except Exception:
+                    # Values will be fetched again by the next call
+                    pass
+            for (_, _, callback) in jobs:
+                if callback: callback()
+
+
+
+'''
+UTILITY FUNCTIONS
+'''
+def get_outpoints(txs):
+    '''
+    Returns the list of outpoints (txid:index) spent by a transaction (or a list of transactions)
+
+    Parameters:
+        txs = transaction (hex or deserialized) or list of transactions
+    '''
+    if not isinstance(txs, (list, tuple)): txs = [txs]
+    outpoints = []
+    for tx in txs:
+        if not isinstance(tx, dict): tx = deserialize(tx)
+        outpoints += ['%s:%d' % (i['outpoint']['hash'], i['outpoint']['index']) for i in tx['ins']]
+    return outpoints